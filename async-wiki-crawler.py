@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+import aiohttp
+
+from wiki.wiki.parsers import PARSERS, DEFAULT_PARSER, get_parser
+from wiki.wiki.ratelimit import MAX_ATTEMPTS, DONE, RETRY, DROP, HostRateLimiter, AsyncFetchScheduler
+from wiki.wiki.mwapi import FETCH_MODES, DEFAULT_FETCH_MODE, article_url, article_content
+from wiki.wiki.frontier import Frontier, checkpoint
+from wiki.wiki.visited import VisitedStore
+from wiki.wiki.sinks import FORMATS, DEFAULT_FORMAT, open_sink, open_formula_sink, article_record, formula_records
+from wiki.wiki.linkgraph import PRIORITIES, DEFAULT_PRIORITY, LinkGraph, Ranker
+from wiki.wiki.metrics import PROFILERS, DEFAULT_PROFILER, Metrics, StatsReporter, PageProfiler
+
+DEFAULT_OUTPUT = 'async_wiki_output'
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/52.0.2743.116 Safari/537.36'
+DEFAULT_CONCURRENCY = 200  # requests in flight
+DEFAULT_RATE = 50.0  # requests per second and per host
+DEFAULT_BURST = 10  # requests allowed at once by the per-host token bucket
+DEFAULT_TIMEOUT = 30  # seconds per request
+CHECKPOINT_INTERVAL = 10  # seconds between two checkpoints of the crawl state
+RETRY_POLL_INTERVAL = 1.0  # longest sleep of the delayed-retry feeder
+NUM_PARSE_WORKERS = os.cpu_count()
+
+
+def load_pending_urls(pending_url_file):
+    """Resume previous session if any, load pending URLs"""
+    pending_urls = []
+    try:
+        with open(pending_url_file) as fin:
+            for line in fin:
+                pending_urls.append(line.strip())
+    except FileNotFoundError:
+        pass
+    return pending_urls
+
+
+def parse_article(status:int, body:str, parser_name:str, with_text:bool, article:str, profiler:PageProfiler,
+                  fetch_mode:str=DEFAULT_FETCH_MODE):
+    """Runs in the parse pool: article links of the page, its text and formulas, and the time of each stage"""
+    metrics = Metrics()
+    with profiler.profile(article):
+        with metrics.time('parse'):
+            _, html = article_content(status, body, article, fetch_mode)
+            page = get_parser(parser_name).parse(html)
+
+        with metrics.time('links'):
+            _pend_urls = []
+            for href in page.links():
+                if not href:
+                    continue
+                if href[0:6] != '/wiki/':  # allow only article pages
+                    continue
+                elif ':' in href:  # ignore special articles e.g. 'Special:'
+                    continue
+                elif href[-4:] in ".png .jpg .jpeg .svg":  # ignore image files inside articles
+                    continue
+                _pend_urls.append(href)
+
+        # get plain text without the citation sections
+        if not with_text:
+            return _pend_urls, None, None, metrics.snapshot()
+        with metrics.time('extract'):
+            out_text, formulas = page.text_with_formulas()
+    return _pend_urls, out_text, formulas, metrics.snapshot()
+
+
+class AsyncWikiCrawler:
+    """Single-process crawler: one pooled HTTP session, parsing in a process pool"""
+
+    def __init__(self, base_url:str, output_dir:str, concurrency:int=DEFAULT_CONCURRENCY,
+                 rate:float=DEFAULT_RATE, burst:float=DEFAULT_BURST, parse_workers:int=NUM_PARSE_WORKERS,
+                 parser_name:str=DEFAULT_PARSER, articles_limit:int=None, output_format:str=DEFAULT_FORMAT,
+                 record_links:bool=False, priority:str=DEFAULT_PRIORITY, stats_file:str=None, metrics_port:int=None,
+                 profile_rate:float=0.0, profiler_name:str=DEFAULT_PROFILER, max_attempts:int=MAX_ATTEMPTS,
+                 fetch_mode:str=DEFAULT_FETCH_MODE):
+        self.base_url = base_url
+        self.fetch_mode = fetch_mode
+        self.output_dir = output_dir
+        self.concurrency = concurrency
+        self.limiter = HostRateLimiter(rate, burst)
+        # requests in flight per host, halved on 429/503 and back up to concurrency, and the delayed retries
+        self.scheduler = AsyncFetchScheduler(window=concurrency, max_window=concurrency, max_attempts=max_attempts)
+        self.parse_workers = parse_workers
+        self.parser_name = parser_name
+        self.articles_limit = articles_limit
+        self.priority = priority
+        self.record_links = record_links or priority != 'bfs'
+
+        self.session_file = os.path.join(output_dir, "session_visited_urls.txt")
+        self.pending_url_file = os.path.join(output_dir, "pending_urls.txt")  # written by older versions
+        self.frontier_file = os.path.join(output_dir, "frontier.sqlite")
+        self.output_file = os.path.join(output_dir, "wiki_data_{:03d}.{}".format(0, output_format))
+        self.links_prefix = os.path.join(output_dir, "links")
+        self.stats_file = stats_file
+        self.metrics_port = metrics_port
+        self.profiler = PageProfiler(os.path.join(output_dir, "profiles"), profile_rate, profiler_name)
+        self.metrics = Metrics()  # of this process, the parse pool sends the times of its stages with each page
+
+        self.visited_urls = None  # all urls already visited, to not visit twice, a VisitedStore opened by run()
+        self.pending_urls = None  # queue, a Frontier opened by run()
+        self.ready_urls = deque()  # failed URLs whose retry time has come, crawled before the pending ones
+        self.link_graph = None  # LinkGraph opened by run() if record_links
+        self.stats = None  # StatsReporter opened by run()
+        self.ranker = None
+        self.num_crawled = 0
+        self.num_in_flight = 0
+
+    def add_pending(self, href:str) -> None:
+        if href in self.visited_urls:
+            return
+        self.pending_urls.push(href)  # ignored if already queued once
+
+    async def fetch(self, session, article:str):
+        """(status, body, Retry-After header) of an article, status None on connection errors"""
+        try:
+            with self.metrics.time('fetch'):
+                async with session.get(article_url(self.base_url, article, self.fetch_mode)) as r:
+                    if r.status not in (200, 404):
+                        return r.status, None, r.headers.get('Retry-After')
+                    return r.status, await r.text(), None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Failed to request page {article} ({e!r})")
+            return None, None, None
+
+    async def crawl(self, session, pool, article:str) -> str:
+        """Fetch and parse one article: DONE, RETRY (later, by the scheduler) or DROP"""
+        article_format = article.replace('/wiki/', '')[:35]
+        full_url = self.base_url + article
+        with self.metrics.time('wait'):
+            token = await self.scheduler.acquire(full_url)
+            await self.limiter.acquire(full_url)
+        status, html, retry_after = await self.fetch(session, article)
+        outcome = await self.scheduler.release(full_url, token, status, retry_after)
+        if outcome != DONE:
+            self.metrics.count('failed')
+            if status is not None:
+                print("Failed to request page {} (code {}), {}".format(
+                    article, status, "retrying later" if outcome == RETRY else "dropped"))
+            return outcome
+
+        # skip text if already added from this article, as continuing session
+        with_text = article not in self.visited_urls
+        loop = asyncio.get_running_loop()
+        try:
+            _pend_urls, out_text, formulas, stage_times = await loop.run_in_executor(
+                pool, parse_article, status, html, self.parser_name, with_text, article, self.profiler, self.fetch_mode)
+        except Exception as e:
+            print(e)
+            return self.scheduler.fail(full_url)
+        self.metrics.merge(stage_times)
+
+        with self.metrics.time('frontier'):
+            for href in _pend_urls:
+                self.add_pending(href)
+        if not with_text:
+            print("Already visited: {}".format(article))
+            return DONE
+
+        self.visited_urls.add(article)  # logged to the session file
+        self.num_crawled += 1
+        print("Crawl from ", article_format)
+        with self.metrics.time('write'):
+            if self.link_graph is not None:
+                self.link_graph.add(article, _pend_urls)
+            self.sink.write(article_record(self.base_url + article, out_text, len(formulas)))
+            self.formula_sink.write_many(formula_records(self.base_url + article, formulas))
+        self.metrics.count('pages')
+        return DONE
+
+    def limit_reached(self) -> bool:
+        return self.articles_limit is not None and self.num_crawled >= self.articles_limit
+
+    async def worker(self, session, pool, idle:asyncio.Condition):
+        while True:
+            async with idle:
+                # wait for work, or for the last in-flight crawl to end without new links nor delayed retries
+                await idle.wait_for(lambda: self.ready_urls or self.pending_urls or self.limit_reached()
+                                    or (self.num_in_flight == 0 and self.scheduler.num_retries() == 0))
+                if not (self.ready_urls or self.pending_urls) or self.limit_reached():
+                    idle.notify_all()
+                    return
+                article = self.ready_urls.popleft() if self.ready_urls else self.pending_urls.pop()
+                self.num_in_flight += 1
+            outcome = None
+            try:
+                outcome = await self.crawl(session, pool, article)
+            finally:
+                async with idle:
+                    self.num_in_flight -= 1
+                    if outcome is None:
+                        self.pending_urls.retry(article)  # interrupted, retry in the next session
+                    elif outcome != RETRY:  # a retried URL stays in flight in the frontier until done or dropped
+                        self.pending_urls.done(article)
+                    if outcome == DROP:
+                        print("Dropped {} after {} attempts".format(article, self.scheduler.max_attempts))
+                    idle.notify_all()
+
+    async def feed_retries(self, idle:asyncio.Condition):
+        """Moves the failed URLs whose retry time has come to ready_urls"""
+        while True:
+            ready = self.scheduler.ready()
+            if ready:
+                async with idle:
+                    self.ready_urls.extend(url[len(self.base_url):] for url in ready)
+                    idle.notify_all()
+            await asyncio.sleep(min(self.scheduler.wait_time() or RETRY_POLL_INTERVAL, RETRY_POLL_INTERVAL))
+
+    def checkpoint(self) -> None:
+        outputs = [self.sink, self.formula_sink] + ([self.link_graph] if self.link_graph is not None else [])
+        checkpoint(self.pending_urls, self.visited_urls, *outputs)
+
+    async def report(self, interval:float=CHECKPOINT_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            if self.ranker is not None:
+                self.ranker.maybe_rank()
+            with self.metrics.time('checkpoint'):
+                self.checkpoint()
+            self.stats.maybe_report(self.metrics.snapshot)
+            print("Number of pending URLs: {}, in flight: {}, delayed retries: {}, crawled: {}, window: {}".format(
+                len(self.pending_urls), self.num_in_flight, self.scheduler.num_retries(), self.num_crawled,
+                self.scheduler.window(self.base_url)))
+
+    async def run(self, initial_url:str) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.stats = StatsReporter(self.stats_file, self.metrics_port)
+        self.visited_urls = VisitedStore(self.session_file)
+        print("Number of visited URLs: {}".format(len(self.visited_urls)))
+        self.pending_urls = Frontier(self.frontier_file, ranked=self.priority != 'bfs')
+        if self.record_links:
+            self.link_graph = LinkGraph(self.links_prefix)
+            if self.priority != 'bfs':
+                self.ranker = Ranker(self.pending_urls, self.link_graph, self.priority)
+        if self.pending_urls.is_new():
+            for href in load_pending_urls(self.pending_url_file):
+                self.add_pending(href)
+        if not self.pending_urls:
+            self.pending_urls.push(initial_url)
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT)
+        idle = asyncio.Condition()
+        # flushed at each checkpoint, before the session file
+        with open_sink(self.output_file) as self.sink, open_formula_sink(self.output_file) as self.formula_sink, \
+                ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                             headers={'User-Agent': USER_AGENT}) as session:
+                reporter = asyncio.create_task(self.report())
+                feeder = asyncio.create_task(self.feed_retries(idle))
+                try:
+                    await asyncio.gather(*[self.worker(session, pool, idle) for _ in range(self.concurrency)])
+                finally:
+                    reporter.cancel()
+                    feeder.cancel()
+                    self.checkpoint()
+                    if self.link_graph is not None:
+                        self.link_graph.close()
+                    self.pending_urls.close()
+                    self.visited_urls.close()
+                    self.stats.close(self.metrics.snapshot())
+        print("Number of visited URLs in total: {}".format(len(self.visited_urls)))
+
+
+def main(initial_url, output_dir, concurrency, rate, burst, parse_workers, parser_name, articles_limit, output_format=DEFAULT_FORMAT,
+         record_links=False, priority=DEFAULT_PRIORITY, stats_file=None, metrics_port=None, profile_rate=0.0,
+         profiler_name=DEFAULT_PROFILER, max_attempts=MAX_ATTEMPTS, fetch_mode=DEFAULT_FETCH_MODE):
+    base_url = '{uri.scheme}://{uri.netloc}'.format(uri=urlparse(initial_url))
+    initial_url = initial_url[len(base_url):]
+    crawler = AsyncWikiCrawler(base_url, output_dir, concurrency, rate, burst, parse_workers, parser_name, articles_limit,
+                               output_format, record_links, priority, stats_file, metrics_port, profile_rate, profiler_name,
+                               max_attempts, fetch_mode)
+    print("\t(Press CTRL+C to stop, pending URLs are saved for the next session)\n")
+    try:
+        asyncio.run(crawler.run(initial_url))
+    except KeyboardInterrupt:
+        pass
+    print("Finished!")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--initial_url", nargs='?', help="Initial Wikipedia article, e.g. https://en.wikipedia.org/wiki/Mathematics", default="https://en.wikipedia.org/wiki/Mathematics")
+    parser.add_argument("-o", "--output", nargs='?', default=DEFAULT_OUTPUT, help="Output directory")
+    parser.add_argument("-a", "--articles", nargs='?', default=None, type=int, help="Total number of articles (default: no limit)")
+    parser.add_argument("-c", "--concurrency", nargs='?', default=DEFAULT_CONCURRENCY, type=int, help="Number of requests in flight")
+    parser.add_argument("-r", "--rate", nargs='?', default=DEFAULT_RATE, type=float, help="Requests per second and per host (0: no limit)")
+    parser.add_argument("-b", "--burst", nargs='?', default=DEFAULT_BURST, type=float, help="Burst size of the per-host rate limit")
+    parser.add_argument("-w", "--parse_workers", nargs='?', default=NUM_PARSE_WORKERS, type=int, help="Number of parsing processes")
+    parser.add_argument("-p", "--parser", nargs='?', default=DEFAULT_PARSER, choices=list(PARSERS), help="HTML parser backend")
+    parser.add_argument("-f", "--format", nargs='?', default=DEFAULT_FORMAT, choices=FORMATS, help="Output format of the wiki_data_000 file")
+    parser.add_argument("--links", action='store_true', help="Record the link graph (links.sqlite and links.edges)")
+    parser.add_argument("--priority", nargs='?', default=DEFAULT_PRIORITY, choices=PRIORITIES, help="Order of the pending URLs, by link graph in-degree or PageRank instead of breadth-first (records the link graph)")
+    parser.add_argument("--stats", nargs='?', default=None, help="JSON file of the stage timings, rewritten every few seconds")
+    parser.add_argument("--metrics_port", nargs='?', default=None, type=int, help="Serve the stage timings in the Prometheus format on this local port")
+    parser.add_argument("--profile_rate", nargs='?', default=0.0, type=float, help="Share of the pages profiled, to <output>/profiles/")
+    parser.add_argument("--profiler", nargs='?', default=DEFAULT_PROFILER, choices=PROFILERS, help="Profiler of the sampled pages")
+    parser.add_argument("--max_attempts", nargs='?', default=MAX_ATTEMPTS, type=int, help="Failed requests of a page before it is dropped, 429/503 responses not counted")
+    parser.add_argument("--fetch", nargs='?', default=DEFAULT_FETCH_MODE, choices=FETCH_MODES, help="Fetch the full page, or the article content only from the REST API (Parsoid HTML) or action=parse")
+    args = parser.parse_args()
+    main(args.initial_url, args.output, args.concurrency, args.rate, args.burst, args.parse_workers, args.parser, args.articles, args.format,
+         args.links, args.priority, args.stats, args.metrics_port, args.profile_rate, args.profiler, args.max_attempts, args.fetch)
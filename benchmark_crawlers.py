@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import json
+import time
+import zlib
+import hashlib
+import tempfile
+import argparse
+import threading
+import subprocess
+import importlib.util
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, quote, parse_qs
+
+import requests
+from bs4 import BeautifulSoup
+
+from wiki.wiki.parsers import PARSERS, DEFAULT_PARSER, get_parser
+from wiki.wiki.httpcache import ResponseCache, cache_key
+from wiki.wiki.mwapi import FETCH_MODES, DEFAULT_FETCH_MODE, REST_HTML_PATH, ACTION_API_PATH, article_url, article_content
+
+DEFAULT_CORPUS = './fixtures/pages'
+DEFAULT_ARTICLES = 50  # articles crawled by each crawler
+DEFAULT_RAY_WORKERS = 4
+THROTTLE_RETRY_AFTER = 1  # seconds, Retry-After of the 429 responses of a throttling CorpusServer
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# crawler name -> module it needs, crawlers whose module is missing are skipped
+CRAWLERS = {
+    'single': 'requests',
+    'async': 'aiohttp',
+    'ray': 'ray',
+    'scrapy': 'scrapy',
+}
+
+
+def load_corpus(corpus):
+    """{title: html} from a directory of saved pages or a ResponseCache file"""
+    pages = {}
+    if os.path.isdir(corpus):
+        for html_file in sorted(glob.glob(os.path.join(corpus, "*.html"))):
+            title = unquote(os.path.basename(html_file)[:-len(".html")])
+            with open(html_file, encoding='utf-8') as fin:
+                pages[title] = fin.read()
+    else:
+        cache = ResponseCache(corpus)
+        for url, body in cache.db.execute("SELECT url, body FROM responses WHERE status = 200"):
+            pages[cache_key(url).split('/wiki/')[-1]] = zlib.decompress(body).decode('utf-8')
+        cache.close()
+    return pages
+
+
+class CorpusServer:
+    """Local stand-in for Wikipedia serving the corpus under /wiki/<title>
+
+    Titles missing from the corpus get one of its pages, picked from a hash
+    of the title, so that every link of the corpus leads to a real page.
+    With a throttle rate, requests above it (one second bursts allowed) get
+    a 429 with a Retry-After, like a rate limited wiki.
+
+    The content-only fetch modes are served from the same pages: action=parse
+    answers the div#mw-content-text content as JSON, the REST page/html
+    endpoint answers it in a <body> with Parsoid's relative links (./<title>).
+    The rest of the Parsoid markup is not reproduced.
+    """
+
+    def __init__(self, pages:dict, latency:float=0.0, throttle:float=0.0):
+        self.pages = pages
+        self.titles = sorted(pages)
+        self.latency = latency
+        self.throttle = throttle  # requests per second, 0: no limit
+        self.tokens = throttle
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+        self.contents = {}  # title -> inner HTML of div#mw-content-text
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+            disable_nagle_algorithm = True  # headers and body are sent in two writes
+
+            def do_GET(self):
+                path, _, query = self.path.partition('?')
+                if path.startswith('/wiki/'):
+                    mode, title = 'page', unquote(path[len('/wiki/'):])
+                elif path.startswith(REST_HTML_PATH):
+                    mode, title = 'rest', unquote(path[len(REST_HTML_PATH):])
+                elif path == ACTION_API_PATH and parse_qs(query).get('action') == ['parse']:
+                    mode, title = 'parse', parse_qs(query).get('page', [''])[0]
+                else:
+                    self.send_error(404)
+                    return
+                server.requests += 1
+                if not server.allow():
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(THROTTLE_RETRY_AFTER))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                body, content_type = server.response(mode, title)
+                body = body.encode('utf-8')
+                server.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def allow(self) -> bool:
+        """Token bucket of the throttle rate, False if the request is throttled"""
+        if self.throttle <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.throttle, self.tokens + (now - self.updated) * self.throttle)
+            self.updated = now
+            if self.tokens < 1.0:
+                self.throttled += 1
+                return False
+            self.tokens -= 1.0
+            return True
+
+    def corpus_title(self, title:str) -> str:
+        if title in self.pages:
+            return title
+        h = int.from_bytes(hashlib.blake2b(title.encode('utf-8'), digest_size=8).digest(), 'big')
+        return self.titles[h % len(self.titles)]
+
+    def page(self, title:str) -> str:
+        return self.pages[self.corpus_title(title)]
+
+    def content(self, title:str) -> str:
+        title = self.corpus_title(title)
+        if title not in self.contents:
+            div = BeautifulSoup(self.pages[title], 'html.parser').find('div', {'id': 'mw-content-text'})
+            self.contents[title] = ''.join(str(child) for child in div.contents) if div is not None else ''
+        return self.contents[title]
+
+    def response(self, mode:str, title:str) -> tuple:
+        """(body, content type) of the title in a fetch mode"""
+        if mode == 'parse':
+            return json.dumps({"parse": {"title": title, "text": self.content(title)}}), 'application/json; charset=utf-8'
+        if mode == 'rest':
+            html = self.content(title).replace('href="/wiki/', 'href="./')
+            html = html.replace('href="#', 'href="./{}#'.format(quote(title.replace(' ', '_'))))
+            return ('<!DOCTYPE html><html><head><meta charset="utf-8"/></head><body>' + html + '</body></html>',
+                    'text/html; charset=utf-8')
+        return self.page(title), 'text/html; charset=utf-8'
+
+    def url(self, title:str) -> str:
+        return "http://127.0.0.1:{}/wiki/{}".format(self.httpd.server_address[1], quote(title))
+
+    def base_url(self) -> str:
+        return "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def percentile(values:list, p:float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def benchmark_stages(server, parser_name:str, repeat:int=1, fetch_mode:str=DEFAULT_FETCH_MODE) -> dict:
+    """Per page fetch / parse / extract latencies, measured in this process"""
+    parser = get_parser(parser_name)
+    session = requests.Session()
+    timings = {"fetch": [], "parse": [], "extract": []}
+    cpu = {"fetch": 0.0, "parse": 0.0, "extract": 0.0}
+    received = 0
+    for _ in range(repeat):
+        for title in server.titles:
+            article = '/wiki/' + quote(title)
+            start, start_cpu = time.perf_counter(), time.process_time()
+            r = session.get(article_url(server.base_url(), article, fetch_mode))
+            t1, t1_cpu = time.perf_counter(), time.process_time()
+            received += len(r.content)
+            _, html = article_content(r.status_code, r.text, article, fetch_mode)
+            page = parser.parse(html)
+            page.links()
+            t2, t2_cpu = time.perf_counter(), time.process_time()
+            page.text()
+            t3, t3_cpu = time.perf_counter(), time.process_time()
+            for stage, elapsed, elapsed_cpu in (("fetch", t1 - start, t1_cpu - start_cpu),
+                                                ("parse", t2 - t1, t2_cpu - t1_cpu),
+                                                ("extract", t3 - t2, t3_cpu - t2_cpu)):
+                timings[stage].append(elapsed)
+                cpu[stage] += elapsed_cpu
+    session.close()
+    total_cpu = sum(cpu.values()) or 1.0
+    stages = {stage: {"p50_ms": 1000 * percentile(values, 50), "p99_ms": 1000 * percentile(values, 99),
+                      "cpu_share": cpu[stage] / total_cpu}
+              for stage, values in timings.items()}
+    stages["fetch"]["kb_per_page"] = received / 1024 / max(len(timings["fetch"]), 1)
+    return stages
+
+
+def crawler_command(name:str, initial_url:str, output_dir:str, articles:int, parser_name:str, ray_workers:int=DEFAULT_RAY_WORKERS,
+                    fetch_mode:str=DEFAULT_FETCH_MODE):
+    """(command, working directory, output files pattern) of a crawler run"""
+    python = sys.executable
+    if name == 'single':
+        return ([python, os.path.join(ROOT_DIR, "wikipedia-crawler.py"), "--initial_url", initial_url,
+                 "-a", str(articles), "-i", "0", "-o", os.path.join(output_dir, "wiki_output.jsonl"), "-p", parser_name,
+                 "--fetch", fetch_mode],
+                output_dir, "wiki_output.jsonl")
+    if name == 'async':
+        return ([python, os.path.join(ROOT_DIR, "async-wiki-crawler.py"), "--initial_url", initial_url,
+                 "-o", output_dir, "-a", str(articles), "-r", "0", "-p", parser_name, "--fetch", fetch_mode],
+                output_dir, "wiki_data_*.jsonl")
+    if name == 'ray':
+        # no article limit, crawls every page reachable in the corpus
+        return ([python, os.path.join(ROOT_DIR, "ray-wiki-crawler.py"), "--initial_url", initial_url,
+                 "-o", output_dir, "-p", parser_name, "-w", str(ray_workers), "--fetch", fetch_mode],
+                output_dir, "wiki_data_*.jsonl")
+    if name == 'scrapy':
+        return ([python, "-m", "scrapy", "crawl", "wiki_math", "-a", "start_url=" + initial_url,
+                 "-s", "ITEM_PIPELINES={}", "-s", "ROBOTSTXT_OBEY=False", "-s", "WIKI_PARSER=" + parser_name,
+                 "-s", "WIKI_FETCH_MODE=" + fetch_mode,
+                 "-s", "CLOSESPIDER_ITEMCOUNT={}".format(articles), "-O", os.path.join(output_dir, "items.jsonl")],
+                os.path.join(ROOT_DIR, "wiki"), "items.jsonl")
+    raise ValueError("Unknown crawler {}".format(name))
+
+
+def benchmark_crawler(server, name:str, initial_title:str, articles:int, parser_name:str, ray_workers:int=DEFAULT_RAY_WORKERS,
+                      fetch_mode:str=DEFAULT_FETCH_MODE) -> dict:
+    """pages/s, CPU time, peak RSS, bytes received and 429 responses of one crawler run against the corpus server"""
+    throttled, bytes_sent = server.throttled, server.bytes_sent
+    with tempfile.TemporaryDirectory() as output_dir:
+        command, cwd, pattern = crawler_command(name, server.url(initial_title), output_dir, articles, parser_name, ray_workers,
+                                                fetch_mode)
+        env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        pages = 0
+        for output_file in glob.glob(os.path.join(output_dir, pattern)):
+            with open(output_file, encoding='utf-8') as fin:
+                pages += sum(1 for _ in fin)
+    return {"pages": pages, "seconds": elapsed, "pages_per_s": pages / elapsed,
+            "cpu_user_s": usage.ru_utime, "cpu_sys_s": usage.ru_stime,
+            "peak_rss_mb": usage.ru_maxrss / 1024, "throttled": server.throttled - throttled,
+            "kb_per_page": (server.bytes_sent - bytes_sent) / 1024 / max(pages, 1),
+            "exit_status": os.waitstatus_to_exitcode(status)}
+
+
+def compare_with_baseline(results:dict, baseline_file:str, tolerance:float) -> bool:
+    """False if a crawler got slower than the baseline by more than tolerance"""
+    with open(baseline_file) as fin:
+        baseline = json.load(fin)
+    ok = True
+    for name, result in results["crawlers"].items():
+        if name not in baseline.get("crawlers", {}):
+            continue
+        reference = baseline["crawlers"][name]["pages_per_s"]
+        if result["pages_per_s"] < (1 - tolerance) * reference:
+            ok = False
+            print("REGRESSION {:<8} {:.1f} pages/s (baseline {:.1f})".format(name, result["pages_per_s"], reference))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus", nargs='?', default=DEFAULT_CORPUS, help="Directory of saved article HTML files, or a --cache file of a previous crawl")
+    parser.add_argument("-c", "--crawlers", nargs='+', default=list(CRAWLERS), choices=list(CRAWLERS), help="Crawlers to run")
+    parser.add_argument("-a", "--articles", nargs='?', default=DEFAULT_ARTICLES, type=int, help="Articles crawled by each crawler (not applied to ray)")
+    parser.add_argument("-p", "--parser", nargs='?', default=DEFAULT_PARSER, choices=list(PARSERS), help="HTML parser backend")
+    parser.add_argument("-r", "--repeat", nargs='?', default=5, type=int, help="Passes over the corpus for the stage latencies")
+    parser.add_argument("-w", "--ray_workers", nargs='?', default=DEFAULT_RAY_WORKERS, type=int, help="Worker actors of the ray crawler")
+    parser.add_argument("-l", "--latency", nargs='?', default=0.0, type=float, help="Simulated server latency (seconds)")
+    parser.add_argument("--fetch", nargs='?', default=DEFAULT_FETCH_MODE, choices=FETCH_MODES, help="Fetch mode of the stages and crawlers: full page, REST page/html or action=parse")
+    parser.add_argument("--throttle", nargs='?', default=0.0, type=float, help="Requests per second served to the crawlers, 429 with Retry-After above (0: no limit)")
+    parser.add_argument("-j", "--json", nargs='?', default=None, help="Write the results to this JSON file")
+    parser.add_argument("-b", "--baseline", nargs='?', default=None, help="Fail if pages/s drop below the ones of this JSON file")
+    parser.add_argument("-t", "--tolerance", nargs='?', default=0.2, type=float, help="Allowed pages/s drop relative to the baseline")
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        sys.exit("No page in {}".format(args.corpus))
+    results = {"corpus": args.corpus, "corpus_pages": len(pages), "parser": args.parser, "fetch": args.fetch, "throttle": args.throttle, "crawlers": {}}
+    with CorpusServer(pages, args.latency) as server:
+        print("{} page(s) served on {}".format(len(pages), server.url("")))
+        results["stages"] = benchmark_stages(server, args.parser, args.repeat, args.fetch)
+        for stage, timing in results["stages"].items():
+            print("{:<8} p50 {:7.2f} ms  p99 {:7.2f} ms  {:5.1%} of CPU{}".format(stage, timing["p50_ms"], timing["p99_ms"], timing["cpu_share"],
+                  "  {:.1f} kB/page".format(timing["kb_per_page"]) if "kb_per_page" in timing else ""))
+
+        server.throttle = server.tokens = args.throttle  # the crawlers only
+
+        for name in args.crawlers:
+            if importlib.util.find_spec(CRAWLERS[name]) is None:
+                print("{:<8} skipped ({} is not installed)".format(name, CRAWLERS[name]))
+                continue
+            result = benchmark_crawler(server, name, server.titles[0], args.articles, args.parser, args.ray_workers, args.fetch)
+            results["crawlers"][name] = result
+            print("{:<8} {:5d} pages  {:7.1f} pages/s  cpu {:6.2f}s user {:5.2f}s sys  peak RSS {:6.1f} MB  {:6.1f} kB/page  {} x 429{}".format(
+                name, result["pages"], result["pages_per_s"], result["cpu_user_s"], result["cpu_sys_s"], result["peak_rss_mb"],
+                result["kb_per_page"], result["throttled"],
+                "" if result["exit_status"] == 0 else "  (exit status {})".format(result["exit_status"])))
+
+    if args.json:
+        with open(args.json, 'w') as fout:
+            json.dump(results, fout, indent=2)
+    if args.baseline and not compare_with_baseline(results, args.baseline, args.tolerance):
+        sys.exit(1)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import time
+import argparse
+
+from wiki.wiki.parsers import PARSERS, DEFAULT_PARSER, get_parser
+
+DEFAULT_CORPUS = './fixtures/pages'
+
+
+def parse_page(parser, html):
+    """{"links", "text", "formulas"} extracted from a page by one backend"""
+    article = parser.parse(html)
+    links = article.links()
+    text, formulas = article.text_with_formulas()
+    return {"links": links, "text": text, "formulas": formulas}
+
+
+def check_parser_parity(corpus_dir, backends, repeat=1):
+    """Compare every backend with the reference one on the HTML files of corpus_dir"""
+    html_files = sorted(glob.glob(os.path.join(corpus_dir, "*.html")))
+    if not html_files:
+        print("No .html file in {}".format(corpus_dir))
+        return False
+
+    parsers = {name: get_parser(name) for name in backends}
+    timings = {name: 0.0 for name in backends}
+    ok = True
+    for html_file in html_files:
+        with open(html_file, encoding='utf-8') as fin:
+            html = fin.read()
+        reference = parse_page(parsers[DEFAULT_PARSER], html)
+        for name, parser in parsers.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = parse_page(parser, html)
+            timings[name] += time.perf_counter() - start
+            if result != reference:
+                ok = False
+                field = next(f for f in ("links", "text", "formulas") if result[f] != reference[f])
+                print("MISMATCH {:<12} {} ({})".format(name, os.path.basename(html_file), field))
+
+    print("{} page(s) checked".format(len(html_files)))
+    for name, elapsed in timings.items():
+        print("{:<12} {:.1f} ms/page".format(name, 1000 * elapsed / (repeat * len(html_files))))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus", nargs='?', default=DEFAULT_CORPUS, help="Directory of saved article HTML files")
+    parser.add_argument("-p", "--parsers", nargs='+', default=list(PARSERS), choices=list(PARSERS), help="Backends compared to {}".format(DEFAULT_PARSER))
+    parser.add_argument("-r", "--repeat", nargs='?', default=1, type=int, help="Parse each page several times for timing")
+    args = parser.parse_args()
+    backends = [DEFAULT_PARSER] + [p for p in args.parsers if p != DEFAULT_PARSER]
+    sys.exit(0 if check_parser_parity(args.corpus, backends, args.repeat) else 1)
@@ -0,0 +1,34 @@
+import argparse
+
+import numpy as np
+
+from wiki.wiki.linkgraph import LinkGraph, in_degrees, pagerank
+
+_LINKS_PREFIX = r"./ray_wiki_output/links"
+_OUTPUT = r"./link_graph"
+
+# Link graph recorded by a crawler with --links, saved as CSR arrays
+#
+# <output>.npz holds indptr (int64, number of articles + 1) and indices
+# (int32, number of links): the articles linked from article i are
+# indices[indptr[i]:indptr[i + 1]]. Line i of <output>.titles.txt is the
+# title of article i. E.g. with scipy:
+#   graph = np.load("link_graph.npz")
+#   scipy.sparse.csr_matrix((np.ones(len(graph["indices"])), graph["indices"], graph["indptr"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs='?', default=_LINKS_PREFIX, help="Link graph of a crawl, without the .sqlite/.edges extension")
+    parser.add_argument("-o", "--output", nargs='?', default=_OUTPUT, help="Output, without the .npz/.titles.txt extension")
+    parser.add_argument("-t", "--top", nargs='?', default=10, type=int, help="Print the articles of highest in-degree and PageRank")
+    args = parser.parse_args()
+    graph = LinkGraph(args.input)
+    indptr, indices = graph.export_csr(args.output)
+    print("link graph: {} articles, {} links".format(len(indptr) - 1, len(indices)))
+    if args.top > 0 and len(indices) > 0:
+        titles = list(graph.titles())
+        for name, scores in [("in-degree", in_degrees(indptr, indices)), ("PageRank", pagerank(indptr, indices))]:
+            top = np.argsort(-scores, kind='stable')[:args.top]
+            print("top {} by {}: {}".format(len(top), name, ", ".join(titles[i] for i in top)))
+    graph.close()
@@ -1,22 +1,139 @@
 import os
+import re
 import glob
-import pandas as pd
+import json
+import shutil
+import argparse
+from functools import partial
+from multiprocessing import Pool
+
+from wiki.wiki.sinks import read_lines, sink_format
 
 _CRAWLED_WIKI_DATA_DIR = r"./ray_wiki_output_unique/"
 _MATH_OUTPUT_DIR = r"./wiki_math_output/"
+_MATH_OUTPUT_FILE = "wiki_math_data.jsonl"
+_INPUT_PATTERNS = ["*.jsonl", "*.jsonl.zst", "*.parquet"]  # output formats of the crawlers
+
+# every formula is extracted as $...$, ${\displaystyle ...}$ for <math> and $<text>$ for span.texhtml
+_RAW_MATH_MARKER = b"$"  # in the raw JSONL line of a record written before num_formulas
+_RAW_NUM_FORMULAS = b'"num_formulas": '  # formula count of the records, <math> and texhtml (wiki/sinks.py)
+_RAW_NO_FORMULA = _RAW_NUM_FORMULAS + b'0,'
+_FORMULA_REGEX = re.compile(r'\$[^$]+\$')
+
+
+class MathPredicate:
+    """Which articles are kept: at least min_formulas formulas, a math density
+    (characters of formulas / characters of text) of at least min_density and
+    text matching regex"""
+
+    def __init__(self, min_formulas=1, min_density=0.0, regex=None):
+        self.min_formulas = min_formulas
+        self.min_density = min_density
+        self.regex = re.compile(regex) if regex else None
+
+    def may_match(self, raw_line: bytes) -> bool:
+        """Cheap test on the raw JSONL line, False only if the article can't match"""
+        if self.min_formulas <= 0 and self.min_density <= 0:
+            return True
+        if _RAW_NUM_FORMULAS in raw_line:
+            return _RAW_NO_FORMULA not in raw_line
+        return _RAW_MATH_MARKER in raw_line  # record written before num_formulas
+
+    def match(self, text: str, num_formulas: int = None) -> bool:
+        """num_formulas of the record, counted from the formulas of the text if None"""
+        formulas = _FORMULA_REGEX.findall(text) if num_formulas is None or self.min_density > 0 else None
+        if num_formulas is None:
+            num_formulas = len(formulas)
+        if self.min_formulas > 0 and num_formulas < self.min_formulas:
+            return False
+        if self.min_density > 0:
+            # the formulas of num_formulas, <math> and texhtml
+            math_chars = sum(len(f) for f in formulas)
+            if math_chars < self.min_density * max(len(text), 1):
+                return False
+        if self.regex is not None and self.regex.search(text) is None:
+            return False
+        return True
+
 
-def filter_wiki_math_articles(crawled_src_dir, output_dir):
+def filter_jsonl_file(input_file, output_file, predicate):
+    """Copy the lines of input_file whose article matches, return (lines read, lines kept)"""
+    num_lines = num_kept = 0
+    with open(output_file, 'wb') as fout:
+        for line in read_lines(input_file):
+            num_lines += 1
+            # most articles have no formula, skip them before decoding JSON
+            if not predicate.may_match(line):
+                continue
+            try:
+                record = json.loads(line)
+                text = record["text"]
+            except (ValueError, KeyError):
+                continue
+            if text and predicate.match(text, record.get("num_formulas")):
+                fout.write(line)
+                num_kept += 1
+    return num_lines, num_kept
+
+
+def filter_parquet_file(input_file, output_file, predicate):
+    """Same as filter_jsonl_file for a Parquet part file
+
+    The formula count is the num_formulas column: the row groups without
+    enough formulas are skipped from their statistics, and the text of the
+    others is only read for the rows that have enough.
+    """
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(input_file)
+    filters = [('num_formulas', '>=', predicate.min_formulas)] if predicate.min_formulas > 0 else None
+    num_lines = parquet_file.metadata.num_rows
+    table = pq.read_table(input_file, filters=filters)
+    num_kept = 0
+    with open(output_file, 'w', encoding='utf-8') as fout:
+        for record in table.to_pylist():
+            if record["text"] and predicate.match(record["text"], record["num_formulas"]):
+                if record["crawl_time"] is not None:
+                    record["crawl_time"] = int(record["crawl_time"].timestamp())
+                fout.write(json.dumps(record) + '\n')
+                num_kept += 1
+    return num_lines, num_kept
+
+
+def filter_file(input_file, output_file, predicate):
+    if sink_format(input_file) == 'parquet':
+        return filter_parquet_file(input_file, output_file, predicate)
+    return filter_jsonl_file(input_file, output_file, predicate)
+
+
+def filter_wiki_math_articles(crawled_src_dir, output_dir, predicate=None, processes=None):
     os.makedirs(output_dir, exist_ok=True)
-    jsonl_files = glob.glob(os.path.join(crawled_src_dir, "*.jsonl"))
-    dfs = []
-    for f in jsonl_files:
-        df = pd.read_json(f, lines=True)
-        df = df[df.apply(lambda x: "\displaystyle" in x["text"], axis=1)]
-        dfs.append(df)
-    df_all = pd.concat(dfs)
-    print("filtered math data shape: ", df_all.shape)
-    df_all.to_json(os.path.join(output_dir, "wiki_math_data.jsonl"), orient="records", lines=True)
+    predicate = predicate or MathPredicate()
+    input_files = sorted(f for pattern in _INPUT_PATTERNS for f in glob.glob(os.path.join(crawled_src_dir, pattern)))
+    # one part per input file, filtered in parallel then concatenated in order
+    parts_dir = os.path.join(output_dir, "parts")
+    os.makedirs(parts_dir, exist_ok=True)
+    part_files = [os.path.join(parts_dir, "{:05d}.jsonl".format(i)) for i in range(len(input_files))]
+    with Pool(processes=processes) as pool:
+        counts = pool.starmap(partial(filter_file, predicate=predicate), zip(input_files, part_files))
+
+    with open(os.path.join(output_dir, _MATH_OUTPUT_FILE), 'wb') as fout:
+        for part_file in part_files:
+            with open(part_file, 'rb') as fin:
+                shutil.copyfileobj(fin, fout)
+    shutil.rmtree(parts_dir)
+    num_lines = sum(n for n, _ in counts)
+    num_kept = sum(k for _, k in counts)
+    print("filtered math data: {} of {} articles".format(num_kept, num_lines))
 
 
 if __name__ == "__main__":
-    filter_wiki_math_articles(_CRAWLED_WIKI_DATA_DIR, _MATH_OUTPUT_DIR)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs='?', default=_CRAWLED_WIKI_DATA_DIR, help="Directory of crawled jsonl, jsonl.zst or parquet files")
+    parser.add_argument("-o", "--output", nargs='?', default=_MATH_OUTPUT_DIR, help="Output directory")
+    parser.add_argument("-m", "--min_formulas", nargs='?', default=1, type=int, help="Minimum number of formulas")
+    parser.add_argument("-d", "--min_density", nargs='?', default=0.0, type=float, help="Minimum share of the text in formulas")
+    parser.add_argument("-r", "--regex", nargs='?', default=None, help="Keep only texts matching this regular expression")
+    parser.add_argument("-w", "--processes", nargs='?', default=None, type=int, help="Number of processes (default: one per core)")
+    args = parser.parse_args()
+    predicate = MathPredicate(args.min_formulas, args.min_density, args.regex)
+    filter_wiki_math_articles(args.input, args.output, predicate, args.processes)
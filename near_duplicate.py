@@ -0,0 +1,218 @@
+import os
+import re
+import glob
+import json
+import shutil
+import argparse
+import tempfile
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+_CRAWLED_WIKI_DATA_DIR = r"./ray_wiki_output_unique/"
+_OUTPUT_DIR = r"./ray_wiki_output_near_unique/"
+_CANONICAL_FILE = "canonical_urls.tsv"
+
+_SHINGLE_SIZE = 9  # characters per shingle
+_NUM_PERM = 128  # MinHash signature length
+_NUM_BANDS = 16  # LSH bands of _NUM_PERM // _NUM_BANDS rows
+_THRESHOLD = 0.8  # estimated Jaccard similarity of near-duplicates
+_CHUNK = 4096  # shingles hashed at once, bounds the memory per article
+_SEED = 42
+_SHINGLE_SEED = 1  # of the random multipliers of the shingle bytes
+_BAND_SEED = 2  # of the random multipliers of the band rows
+
+# Near-duplicate articles, e.g. the same article crawled under several
+# redirect hrefs (/wiki/Pythagoras_theorem and /wiki/Pythagorean_theorem)
+#
+# 1. every shard is read in parallel: the text of each article is cut into
+#    character shingles, hashed to 64 bits with numpy (a random odd multiplier
+#    per byte, then a 64-bit finalizer) and reduced to a MinHash signature; the
+#    signature is cut into bands and every band is hashed to 64 bits the same way
+# 2. for each band the articles are sorted by band hash, the articles sharing a
+#    band hash are candidates and are merged when their signatures agree on at
+#    least threshold of their values
+# 3. the first article of a cluster, in the order of the shards, is its canonical
+#    article; every url is written with the url of its canonical article and the
+#    shards are copied with the canonical articles only
+
+
+def _permutations(num_perm, seed=_SEED):
+    """(a, b) of the hash functions ((a * x + b) mod 2**64) >> 32, a odd"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    return a[:, None], b[:, None]
+
+
+def _multipliers(size, seed):
+    """Random odd 64-bit multipliers, one per position"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, np.iinfo(np.uint64).max, size=size, dtype=np.uint64, endpoint=True) | np.uint64(1)
+
+
+def _mix64(x):
+    """fmix64 finalizer of MurmurHash3, every bit of the result depends on every bit of x"""
+    x = x ^ (x >> np.uint64(33))
+    x = x * np.uint64(0xff51afd7ed558ccd)
+    x = x ^ (x >> np.uint64(33))
+    x = x * np.uint64(0xc4ceb9fe1a85ec53)
+    return x ^ (x >> np.uint64(33))
+
+
+def _normalize_text(text):
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+def shingle_hashes(text, shingle_size=_SHINGLE_SIZE):
+    """Distinct 64-bit hashes of the character shingles of text"""
+    data = np.frombuffer(_normalize_text(text).encode('utf-8'), dtype=np.uint8)
+    if len(data) < shingle_size:
+        return np.empty(0, dtype=np.uint64)
+    windows = np.lib.stride_tricks.sliding_window_view(data, shingle_size).astype(np.uint64)
+    # sum of the bytes times random odd multipliers, wrapping around 2**64
+    return np.unique(_mix64(windows @ _multipliers(shingle_size, _SHINGLE_SEED)))
+
+
+def minhash(hashes, a, b):
+    """MinHash signature (uint32) of a set of shingle hashes"""
+    signature = np.full(len(a), np.iinfo(np.uint32).max, dtype=np.uint32)
+    for start in range(0, len(hashes), _CHUNK):
+        chunk = hashes[None, start:start + _CHUNK]
+        values = ((a * chunk + b) >> np.uint64(32)).astype(np.uint32)
+        np.minimum(signature, values.min(axis=1), out=signature)
+    return signature
+
+
+def band_hashes(signatures, num_bands):
+    """64-bit hash of every band of every signature, shape (articles, bands)"""
+    rows = signatures.shape[1] // num_bands
+    bands = signatures[:, :rows * num_bands].reshape(len(signatures), num_bands, rows).astype(np.uint64)
+    return _mix64(bands @ _multipliers(rows, _BAND_SEED))
+
+
+def _sign_file(file_index, input_file, work_dir, shingle_size, num_perm, num_bands):
+    """Step 1: signatures and band hashes of the articles of a shard, saved as .npy; returns (urls, has text)"""
+    a, b = _permutations(num_perm)
+    urls = []
+    signatures = []
+    with open(input_file, 'rb') as fin:
+        for line in fin:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                data = {}
+            urls.append(data.get('url'))
+            signatures.append(minhash(shingle_hashes(data.get('text') or "", shingle_size), a, b))
+    signatures = np.array(signatures, dtype=np.uint32).reshape(len(urls), num_perm)
+    # an article without shingles keeps the initial signature, it is never merged
+    has_text = (signatures != np.iinfo(np.uint32).max).any(axis=1)
+    np.save(os.path.join(work_dir, "signatures_{:05d}.npy".format(file_index)), signatures)
+    np.save(os.path.join(work_dir, "bands_{:05d}.npy".format(file_index)), band_hashes(signatures, num_bands))
+    return urls, has_text
+
+
+class _Clusters:
+    """Union-find over the article ids, the root of a cluster is its smallest id"""
+
+    def __init__(self, size):
+        self.parent = np.arange(size, dtype=np.int64)
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+    def roots(self):
+        return np.array([self.find(i) for i in range(len(self.parent))], dtype=np.int64)
+
+
+def _find_clusters(work_dir, num_files, offsets, has_text, num_bands, threshold):
+    """Step 2: canonical article id of every article"""
+    signatures = [np.load(os.path.join(work_dir, "signatures_{:05d}.npy".format(f)), mmap_mode='r') for f in range(num_files)]
+    bands = [np.load(os.path.join(work_dir, "bands_{:05d}.npy".format(f)), mmap_mode='r') for f in range(num_files)]
+
+    def signature(i):
+        f = np.searchsorted(offsets, i, side='right') - 1
+        return signatures[f][i - offsets[f]]
+
+    clusters = _Clusters(len(has_text))
+    candidates = merged = 0
+    for band in range(num_bands):
+        column = np.concatenate([band_file[:, band] for band_file in bands]) if bands else np.empty(0, np.uint64)
+        ids = np.argsort(column, kind='stable')
+        ids = ids[has_text[ids]]
+        column = column[ids]
+        # articles of a run of equal band hashes are compared to the first one of the run
+        same = np.flatnonzero(column[1:] == column[:-1]) + 1
+        run_start = np.maximum.accumulate(np.where(np.r_[True, column[1:] != column[:-1]], np.arange(len(column)), 0))
+        for position in same:
+            i, first = ids[position], ids[run_start[position]]
+            if clusters.find(i) == clusters.find(first):
+                continue
+            candidates += 1
+            if np.mean(signature(i) == signature(first)) >= threshold:
+                clusters.union(i, first)
+                merged += 1
+    print("near-duplicate candidates: {}, merged: {}".format(candidates, merged))
+    return clusters.roots()
+
+
+def _copy_canonical(input_file, output_file, keep):
+    """Step 3: copy the lines of input_file whose article is canonical"""
+    with open(input_file, 'rb') as fin, open(output_file, 'wb') as fout:
+        for line, kept in zip(fin, keep):
+            if kept:
+                fout.write(line)
+
+
+def find_near_duplicates(input_files, output_dir, shingle_size=_SHINGLE_SIZE, num_perm=_NUM_PERM, num_bands=_NUM_BANDS,
+                         threshold=_THRESHOLD, processes=None, tmp_dir=None):
+    """Write canonical_urls.tsv (url<TAB>canonical url) and the shards without near-duplicates to output_dir"""
+    os.makedirs(output_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="near_dup_", dir=tmp_dir)
+    try:
+        with Pool(processes=processes) as pool:
+            results = pool.starmap(partial(_sign_file, work_dir=work_dir, shingle_size=shingle_size, num_perm=num_perm,
+                                           num_bands=num_bands), enumerate(input_files))
+            urls = [url for file_urls, _ in results for url in file_urls]
+            offsets = np.cumsum([0] + [len(file_urls) for file_urls, _ in results])
+            has_text = np.concatenate([h for _, h in results]) if results else np.empty(0, dtype=bool)
+            canonical = _find_clusters(work_dir, len(input_files), offsets, has_text, num_bands, threshold)
+
+            with open(os.path.join(output_dir, _CANONICAL_FILE), 'w', encoding='utf-8') as fout:
+                for url, root in zip(urls, canonical):
+                    if url is not None:
+                        fout.write("{}\t{}\n".format(url, urls[root] or url))
+            is_canonical = canonical == np.arange(len(canonical))
+            pool.starmap(_copy_canonical, [(f, os.path.join(output_dir, os.path.basename(f)), is_canonical[offsets[i]:offsets[i + 1]])
+                                           for i, f in enumerate(input_files)])
+    finally:
+        shutil.rmtree(work_dir)
+    num_kept = int(is_canonical.sum())
+    print("near-duplicates removed: {} kept, {} dropped".format(num_kept, len(canonical) - num_kept))
+    return canonical
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs='?', default=_CRAWLED_WIKI_DATA_DIR, help="Directory of crawled jsonl files")
+    parser.add_argument("-o", "--output", nargs='?', default=_OUTPUT_DIR, help="Output directory")
+    parser.add_argument("-k", "--shingle_size", nargs='?', default=_SHINGLE_SIZE, type=int, help="Characters per shingle")
+    parser.add_argument("-n", "--num_perm", nargs='?', default=_NUM_PERM, type=int, help="MinHash signature length")
+    parser.add_argument("-b", "--bands", nargs='?', default=_NUM_BANDS, type=int, help="LSH bands, more bands find less similar articles")
+    parser.add_argument("-t", "--threshold", nargs='?', default=_THRESHOLD, type=float, help="Minimum estimated Jaccard similarity of near-duplicates")
+    parser.add_argument("-w", "--processes", nargs='?', default=None, type=int, help="Number of processes (default: one per core)")
+    parser.add_argument("--tmp_dir", nargs='?', default=None, help="Directory of the temporary signatures")
+    args = parser.parse_args()
+    jsonl_files = sorted(glob.glob(os.path.join(args.input, "*.jsonl")))
+    find_near_duplicates(jsonl_files, args.output, args.shingle_size, args.num_perm, args.bands, args.threshold,
+                         args.processes, args.tmp_dir)
@@ -6,33 +6,37 @@ import ray
 import sys
 import time
 import argparse
-import re
-import json
+from collections import deque
 from urllib.parse import urlparse
 
 import requests
-from bs4 import BeautifulSoup
-import bs4
+
+from wiki.wiki.parsers import PARSERS, DEFAULT_PARSER, get_parser
+from wiki.wiki.frontier import Frontier, checkpoint
+from wiki.wiki.sharedfrontier import open_shared_frontier
+from wiki.wiki.visited import VisitedStore
+from wiki.wiki.httpcache import ResponseCache, fetch
+from wiki.wiki.sinks import FORMATS, DEFAULT_FORMAT, open_sink, open_formula_sink, article_record, formula_records
+from wiki.wiki.linkgraph import PRIORITIES, DEFAULT_PRIORITY, LinkGraph, Ranker
+from wiki.wiki.metrics import PROFILERS, DEFAULT_PROFILER, Metrics, StatsReporter, PageProfiler, merge_snapshots
+from wiki.wiki.ratelimit import MAX_ATTEMPTS, DONE, DROP, FetchScheduler
+from wiki.wiki.mwapi import FETCH_MODES, DEFAULT_FETCH_MODE, article_url, article_content
 
 DEFAULT_OUTPUT = 'ray_wiki_output'
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/52.0.2743.116 Safari/537.36'
 TIME_INTERVAL = 3  # interval before retry
 NUM_WORKERS = 120
+POOL_MAXSIZE = 4  # keep-alive connections kept by each worker
+TASKS_PER_WORKER = 2  # tasks queued on each worker, so that it never waits for the driver
+REPORT_INTERVAL = 10  # seconds between two progress reports
+CHECKPOINT_INTERVAL = 10  # seconds between two checkpoints of the crawl state
+IDLE_INTERVAL = 1  # seconds between two polls of a shared frontier emptied by the other nodes
+NOT_CACHED = 'not cached'  # failure of a page missing from the cache with --replay, not crawled
 
 
-visited_urls = set()  # all urls already visited, to not visit twice
+visited_urls = None  # all urls already visited, to not visit twice, a VisitedStore opened by main()
 pending_urls = []  # queue
 
-def load_visited_urls(session_file):
-    """Resume previous session if any, load visited URLs"""
-    try:
-        with open(session_file) as fin:
-            for line in fin:
-                visited_urls.add(line.strip())
-    except FileNotFoundError:
-        pass
-
-
 def load_pending_urls(pending_url_file):
     """Resume previous session if any, load pending URLs"""
     try:
@@ -43,211 +47,341 @@ def load_pending_urls(pending_url_file):
         pass
 
     
-def record_visited_urls(session_file:str, visited_not_recorded_urls:list) -> None:
-    with open(session_file, 'a') as fout:
-        for url in visited_not_recorded_urls:
-            fout.write(url + '\n')
-
-
-def record_pending_urls(pending_url_file:str, pending_urls:list) -> None:
-    with open(pending_url_file, 'w') as fout:
-        for url in pending_urls:
-            fout.write(url + '\n')
-
-
-def extract_text_with_math(element: bs4.element.Tag) -> str:
-    extracted_text = ""
-    
-    if isinstance(element, str):  # Regular text
-        extracted_text += element
-
-    elif element.name == 'math':  # MathML element
-        alttext = element.get('alttext')
-        if alttext:
-            extracted_text += f"${alttext}$"
-    
-    elif element.name == "span" and "texhtml" in element.get("class", []):  # LaTeX element
-        extracted_text += f"${element.get_text()}$"
-
-    else:
-        if not bool(element.find_all('math')) and not bool(element.find_all('span', class_='texhtml')):  
-            # Regular HTML element without math
-            extracted_text += element.get_text().strip()
-        else: # recursive call to extract text from children elements
-            for content in element.contents:
-                extracted_text += extract_text_with_math(content)
-    
-    return extracted_text
-
-
 @ray.remote
-def scrap(base_url:str, article:str, output_dir:str, process_id:int, visited_urls:set):
-    """Represents one request per article"""
-    article_format = article.replace('/wiki/', '')[:35]
-
-    full_url = base_url + article
-    try:
-        # time.sleep(TIME_INTERVAL)
-        r = requests.get(full_url, headers={'User-Agent': USER_AGENT})
-    except requests.exceptions.ConnectionError:
-        print(f"Failed to request page {article} (ConnectionError)")
-        # print("Check your Internet connection")
-        # print(f"Retrying in {TIME_INTERVAL} seconds...")
-        # time.sleep(TIME_INTERVAL)
-        
-        return [], False
-    if r.status_code not in (200, 404):
-        print("Failed to request page {} (code {})".format(article, r.status_code))
-        return [], False
-
-    try:
-        soup = BeautifulSoup(r.text, 'html.parser')
-        content = soup.find('div', {'id':'mw-content-text'})
-        # add new related articles to queue
-        # check if are actual articles URL
-
-        _pend_urls = []
-
-        for a in content.find_all('a'):
-            href = a.get('href')
-            if not href:
-                continue
-            
-            if href[0:6] != '/wiki/':  # allow only article pages
-                continue
-            elif ':' in href:  # ignore special articles e.g. 'Special:'
-                continue
-            elif href[-4:] in ".png .jpg .jpeg .svg":  # ignore image files inside articles
-                continue
-            elif href in visited_urls:  # already visited
-                continue
-            
-            _pend_urls.append(href)
-
-
-        # skip if already added text from this article, as continuing session
-        if article in visited_urls:  # already visited
-            print("Already visited: {}".format(article))
-            return _pend_urls, True
-
-
-        # remove all citation elements and related content
-        for _eid in ["See_also", "References", "External_links", "Works_cited"]:
-            # Find the element with id
-            _element = soup.find(id=_eid)
-            # Remove all the content after the references element
-            if _element is not None:
-                for x in _element.find_all_next():
-                    x.extract()
-                _element.extract()
-        
-        # parenthesis_regex = re.compile('\(.+?\)')  # to remove parenthesis content
-        citations_regex = re.compile('\[.+?\]')  # to remove citations, e.g. [1]
+class WikiWorker:
+    """Long-lived worker, keeps its HTTP connections and its output file open"""
+
+    def __init__(self, output_dir:str, process_id:int, parser_name:str=DEFAULT_PARSER,
+                 cache_file:str=None, replay:bool=False, output_format:str=DEFAULT_FORMAT, record_links:bool=False,
+                 profiler:PageProfiler=None, fetch_mode:str=DEFAULT_FETCH_MODE):
+        self.parser = get_parser(parser_name)
+        self.fetch_mode = fetch_mode  # full page, or content only from the REST or Action API
+        self.metrics = Metrics()  # collected by the driver with stats()
+        self.profiler = profiler or PageProfiler(output_dir)
+        self.record_links = record_links  # links of the crawled pages sent back for the link graph
+        # HTTP response cache shared by all the workers
+        self.cache = ResponseCache(cache_file) if cache_file else None
+        self.replay = replay
+        # keep-alive connections to the wiki server, reused for every article
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': USER_AGENT})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        output_file = os.path.join(output_dir, "wiki_data_{:03d}.{}".format(process_id, output_format))
+        self.sink = open_sink(output_file)  # flushed by the driver before each checkpoint
+        self.formula_sink = open_formula_sink(output_file)
+
+    def scrap(self, base_url:str, article:str, already_visited:bool):
+        """Represents one request per article
+
+        Returns (article links, success, links if the text was written,
+        (status, Retry-After header) of a failure, status None on errors,
+        or NOT_CACHED).
+        """
+        with self.profiler.profile(article):
+            return self._scrap(base_url, article, already_visited)
+
+    def _scrap(self, base_url:str, article:str, already_visited:bool):
+        article_format = article.replace('/wiki/', '')[:35]
+
+        full_url = base_url + article
+        fetch_url = article_url(base_url, article, self.fetch_mode)
+        try:
+            # time.sleep(TIME_INTERVAL)
+            with self.metrics.time('fetch'):
+                r = fetch(self.session, fetch_url, self.cache, self.replay)
+        except requests.exceptions.ConnectionError:
+            print(f"Failed to request page {article} (ConnectionError)")
+            # retried by the driver after a backoff delay
+            return [], False, None, (None, None)
+        if r is None:
+            print("Not in cache: {}".format(article))
+            return [], False, None, NOT_CACHED
+        if r.status not in (200, 304, 404):
+            self.metrics.count('failed')
+            print("Failed to request page {} (code {})".format(article, r.status))
+            return [], False, None, (r.status, r.retry_after)
 
-        # get plain text from each <p>
-        elem_list = content.find_all(['p', 'math'])
+        try:
+            if r.status == 304:
+                # not modified since cached, its links are known and its text is in a previous output
+                page = None
+                _pend_urls = r.links
+            else:
+                with self.metrics.time('parse'):
+                    _, html = article_content(r.status, r.html, article, self.fetch_mode)
+                    page = self.parser.parse(html)
+                # add new related articles to queue
+                # check if are actual articles URL
+
+                with self.metrics.time('links'):
+                    _pend_urls = []
+
+                    for href in page.links():
+                        if not href:
+                            continue
+
+                        if href[0:6] != '/wiki/':  # allow only article pages
+                            continue
+                        elif ':' in href:  # ignore special articles e.g. 'Special:'
+                            continue
+                        elif href[-4:] in ".png .jpg .jpeg .svg":  # ignore image files inside articles
+                            continue
+
+                        _pend_urls.append(href)
+
+                if self.cache is not None and r.status == 200 and not self.replay:
+                    self.cache.set_links(fetch_url, _pend_urls)
+
+            # the visited ones are dropped by the driver
+            _links = _pend_urls if self.record_links else None
+
+            # skip if already added text from this article, as continuing session
+            if already_visited:
+                print("Already visited: {}".format(article))
+                return _pend_urls, True, None, None
+            if page is None:
+                self.metrics.count('not_modified')
+                print("Not modified: {}".format(article))
+                return _pend_urls, True, None, None
+
+
+            # get plain text without the citation sections
+            with self.metrics.time('extract'):
+                out_text, formulas = page.text_with_formulas()
+
+            print("Crawl from ", article_format)
+            with self.metrics.time('write'):
+                self.sink.write(article_record(full_url, out_text, len(formulas)))
+                self.formula_sink.write_many(formula_records(full_url, formulas))
+            self.metrics.count('pages')
+
+            return _pend_urls, True, _links, None
         
-        visited_math_elements = set()
-        out_text = ""
-        for elem in elem_list:
-            if elem.name == 'p':
-                for _math_elem in elem.find_all('math'):
-                    visited_math_elements.add(_math_elem)
-
-                # text = elem.get_text().strip()
-                text = extract_text_with_math(elem)
-                # text = parenthesis_regex.sub('', text)
-                text = citations_regex.sub('', text)
-                if text:
-                    out_text += text + '\n' # extra line between paragraphs
-            
-            elif elem.name == 'math' and elem not in visited_math_elements: # latex math equation
-                latex_code = elem.get('alttext').strip()
-                if latex_code:
-                    out_text += f"${latex_code}$" + '\n'
-
-        json_data = {"url": full_url, "text": out_text}
-        output_file = os.path.join(output_dir, "wiki_data_{:03d}.jsonl".format(process_id))
-        print("Crawl from ", article_format)
-        append_to_jsonl(output_file, json_data)
-
-        return _pend_urls, True
-    
-    except Exception as e:
-        print(e)
-        return [], False
-
-
-# Write data to JSONL file
-def append_to_jsonl(file_path, data):
-    with open(file_path, 'a', encoding='utf-8') as f:
-        json.dump(data, f)
-        f.write('\n')  # Add newline to separate JSON objects
-
-
-
-
-
-def main(initial_url, output_dir):
+        except Exception as e:
+            print(e)
+            return [], False, None, (None, None)
+
+    def stats(self) -> dict:
+        return self.metrics.snapshot()
+
+    def flush(self) -> None:
+        self.sink.flush()
+        self.formula_sink.flush()
+
+    def close(self) -> None:
+        self.session.close()
+        self.sink.close()
+        self.formula_sink.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+class CrawlScheduler:
+    """Keeps TASKS_PER_WORKER tasks in flight on every worker and collects results as they come"""
+
+    def __init__(self, workers:list, base_url:str, tasks_per_worker:int=TASKS_PER_WORKER):
+        self.workers = workers
+        self.base_url = base_url
+        self.free_slots = deque(i for _ in range(tasks_per_worker) for i in range(len(workers)))
+        self.in_flight = {}  # ObjectRef -> (url, worker index)
+        self.num_done = 0
+        self.last_report = time.monotonic()
+        self.last_report_done = 0
+
+    def has_free_slot(self) -> bool:
+        return len(self.free_slots) > 0
+
+    def num_in_flight(self) -> int:
+        return len(self.in_flight)
+
+    def submit(self, url:str, already_visited:bool) -> None:
+        i = self.free_slots.popleft()
+        ref = self.workers[i].scrap.remote(self.base_url, url, already_visited)
+        self.in_flight[ref] = (url, i)
+
+    def wait(self):
+        """Yield (url, (pending urls, success, links, failure)) for every finished task, blocks until there is one"""
+        refs = list(self.in_flight)
+        if not refs:
+            return
+        ray.wait(refs, num_returns=1)
+        ready, _ = ray.wait(refs, num_returns=len(refs), timeout=0)
+        for ref in ready:
+            url, i = self.in_flight.pop(ref)
+            self.free_slots.append(i)
+            self.num_done += 1
+            try:
+                yield url, ray.get(ref)
+            except ray.exceptions.RayError as e:
+                print(e)
+                yield url, ([], False, None, (None, None))
+
+    def report(self, queue_depth:int, num_visited:int) -> None:
+        """Print queue depth and throughput every REPORT_INTERVAL seconds"""
+        now = time.monotonic()
+        if now - self.last_report < REPORT_INTERVAL:
+            return
+        throughput = (self.num_done - self.last_report_done) / (now - self.last_report)
+        print("Number of pending URLs: {}, in flight: {}, visited: {}, {:.1f} pages/s".format(
+            queue_depth, len(self.in_flight), num_visited, throughput))
+        self.last_report = now
+        self.last_report_done = self.num_done
+
+
+def main(initial_url, output_dir, parser_name=DEFAULT_PARSER, cache_file=None, replay=False, num_workers=NUM_WORKERS,
+         output_format=DEFAULT_FORMAT, record_links=False, priority=DEFAULT_PRIORITY, stats_file=None, metrics_port=None,
+         profile_rate=0.0, profiler_name=DEFAULT_PROFILER, max_attempts=MAX_ATTEMPTS, fetch_mode=DEFAULT_FETCH_MODE,
+         frontier_uri=None):
     global pending_urls, visited_urls
 
     os.makedirs(output_dir, exist_ok=True)
     print("\t(Press CTRL+C to pause)\n")
 
     session_file = os.path.join(output_dir, "session_visited_urls.txt")
-    load_visited_urls(session_file)
+    visited_urls = VisitedStore(session_file)
     print("Number of visited URLs: {}".format(len(visited_urls)))
 
     base_url = '{uri.scheme}://{uri.netloc}'.format(uri=urlparse(initial_url))
     initial_url = initial_url[len(base_url):]
-    pending_url_file = os.path.join(output_dir, "pending_urls.txt")
-    load_pending_urls(pending_url_file)
-    if len(pending_urls) == 0:
-        pending_urls.append(initial_url)
-
-    
-    while len(pending_urls) > 0:
+    if frontier_uri:
+        # shared with the drivers of other nodes, which lease their URLs from it
+        frontier = open_shared_frontier(frontier_uri)
+    else:
+        frontier = Frontier(os.path.join(output_dir, "frontier.sqlite"), ranked=priority != 'bfs')
+    if frontier.is_new():
+        # pending URLs saved as text by older versions
+        load_pending_urls(os.path.join(output_dir, "pending_urls.txt"))
+        frontier.push_many(pending_urls)
+    if len(frontier) == 0:
+        frontier.push(initial_url)
+    frontier.commit()
+    print("Number of pending URLs: {}".format(len(frontier)))
+    link_graph = ranker = None
+    outputs = []  # of the driver, flushed at each checkpoint
+    if record_links or priority != 'bfs':
+        link_graph = LinkGraph(os.path.join(output_dir, "links"))
+        outputs.append(link_graph)
+        if priority != 'bfs':
+            ranker = Ranker(frontier, link_graph, priority)
+
+    if cache_file:
+        ResponseCache(cache_file).close()  # created once, before the workers share it
+    profiler = PageProfiler(os.path.join(output_dir, "profiles"), profile_rate, profiler_name)
+    workers = [WikiWorker.remote(output_dir, i, parser_name, cache_file, replay, output_format,
+                                 link_graph is not None, profiler, fetch_mode)
+               for i in range(num_workers)]
+    # stage times of the workers, summed with those of the driver
+    metrics = Metrics()
+    reporter = StatsReporter(stats_file, metrics_port)
+
+    def collect_stats():
+        return merge_snapshots(ray.get([w.stats.remote() for w in workers]) + [metrics.snapshot()])
+
+    scheduler = CrawlScheduler(workers, base_url)
+    # requests in flight to the wiki, halved on 429/503 and back up to all the task slots, and the delayed retries
+    num_slots = len(workers) * TASKS_PER_WORKER
+    fetch_scheduler = FetchScheduler(window=num_slots, max_window=num_slots, max_attempts=max_attempts)
+    ready_urls = deque()  # failed URLs whose retry time has come, submitted before the pending ones
+    tokens = {}  # url in flight -> token of fetch_scheduler.start()
+    last_checkpoint = time.monotonic()
+
+    while len(frontier) > 0 or scheduler.num_in_flight() > 0 or ready_urls or fetch_scheduler.num_retries() > 0:
         try:
-            print("Number of pending URLs: {}".format(len(pending_urls)))
-            new_pending_urls = set()
-
-            batch_size = 10 * NUM_WORKERS
-            for b in range(0, len(pending_urls), batch_size):
-                next_urls = pending_urls[b:b+batch_size]
-                new_pending_url_lists_with_flags = ray.get([scrap.remote(base_url, next_url, output_dir, i%NUM_WORKERS, visited_urls) for i, next_url in enumerate(next_urls)])
-
-                prev_visited_urls = []
-                failed_urls = []
-                for (_list, _success), _url in zip(new_pending_url_lists_with_flags, next_urls):
-                    new_pending_urls.update(_list)
-                    if _success == True:
-                        prev_visited_urls.append(_url)
-                    else:
-                        print("Failed to request page: {}".format(_url))
-                        failed_urls.append(_url)
-
-                visited_urls.update(prev_visited_urls)
-                unrecorded_urls = set(prev_visited_urls) - set(visited_urls)
-                new_pending_urls.update(failed_urls)
-                if bool(unrecorded_urls):
-                    record_visited_urls(session_file, unrecorded_urls)
-                print("Number of visited URLs in total: {}".format(len(visited_urls)))
-                    
-            pending_urls = list(new_pending_urls)
-            record_pending_urls(pending_url_file, pending_urls)
-            
+            # keep every worker busy, as long as the wiki doesn't throttle
+            ready_urls.extend(url[len(base_url):] for url in fetch_scheduler.ready())
+            while scheduler.has_free_slot() and fetch_scheduler.can_start(base_url):
+                next_url = ready_urls.popleft() if ready_urls else frontier.pop()
+                if next_url is None:
+                    break
+                if next_url in tokens:
+                    # leased again while in flight here, its lease expired: acknowledged when it comes back
+                    continue
+                tokens[next_url] = fetch_scheduler.start(base_url + next_url)
+                scheduler.submit(next_url, next_url in visited_urls)
+            if scheduler.num_in_flight() == 0:
+                # paused by a Retry-After, delayed retries only, or URLs of a shared frontier leased by other nodes
+                time.sleep(fetch_scheduler.wait_time(base_url) or IDLE_INTERVAL)
+
+            # feed the results back into the frontier as soon as they come
+            for _url, (_list, _success, _links, _failure) in scheduler.wait():
+                if _failure == NOT_CACHED:
+                    # not crawled, neither visited nor retried: a live run fetches it
+                    fetch_scheduler.cancel(base_url + _url)
+                    tokens.pop(_url)
+                    frontier.done(_url)
+                    continue
+                status, retry_after = _failure or (200, None)
+                outcome = fetch_scheduler.finish(base_url + _url, tokens.pop(_url), status, retry_after)
+                if outcome == DONE:
+                    frontier.done(_url)
+                    if visited_urls.add(_url) and _links is not None:  # logged to the session file
+                        link_graph.add(_url, _links)
+                elif outcome == DROP:
+                    print("Failed to request page: {}, dropped after {} attempts".format(_url, max_attempts))
+                    frontier.done(_url)
+                elif frontier_uri:
+                    # its lease would expire during the delay and another node fetch it too:
+                    # back in the shared queue now, the host stays paused or backed off here
+                    fetch_scheduler.unschedule(base_url + _url)
+                    frontier.retry(_url)
+                    print("Failed to request page: {}, released to the shared frontier".format(_url))
+                else:
+                    # stays in flight in the frontier, resubmitted after its delay
+                    print("Failed to request page: {}, retrying later".format(_url))
+                with metrics.time('frontier'):
+                    # the ones already queued once are ignored
+                    frontier.push_many([href for href in _list if href not in visited_urls])
+
+            if time.monotonic() - last_checkpoint > CHECKPOINT_INTERVAL:
+                # the output of the pages logged as visited is flushed by the workers first
+                ray.get([w.flush.remote() for w in workers])
+                if ranker is not None:
+                    ranker.maybe_rank()
+                with metrics.time('checkpoint'):
+                    checkpoint(frontier, visited_urls, *outputs)
+                last_checkpoint = time.monotonic()
+            scheduler.report(len(frontier), len(visited_urls))
+            reporter.maybe_report(collect_stats)
+
         except KeyboardInterrupt:
             input("\n> PAUSED. Press [ENTER] to continue...\n")
 
+    reporter.close(collect_stats())
+    ray.get([w.close.remote() for w in workers])
+    if link_graph is not None:
+        link_graph.close()
+    frontier.close()
+    visited_urls.close()
     print("Finished!")
     sys.exit(0)
 
 
 if __name__ == '__main__':
-    ray.init(num_cpus=NUM_WORKERS)
     parser = argparse.ArgumentParser()
     parser.add_argument("--initial_url", nargs='?', help="Initial Wikipedia article, e.g. https://en.wikipedia.org/wiki/Mathematics", default="https://en.wikipedia.org/wiki/Mathematics")
     parser.add_argument("-o", "--output", nargs='?', default=DEFAULT_OUTPUT, help="File output")
+    parser.add_argument("-p", "--parser", nargs='?', default=DEFAULT_PARSER, choices=list(PARSERS), help="HTML parser backend")
+    parser.add_argument("--cache", nargs='?', default=None, help="HTTP response cache file, pages are then re-crawled with conditional requests")
+    parser.add_argument("--replay", action='store_true', help="Serve pages from the cache only, without network")
+    parser.add_argument("-f", "--format", nargs='?', default=DEFAULT_FORMAT, choices=FORMATS, help="Output format of the wiki_data_* files")
+    parser.add_argument("-w", "--workers", nargs='?', default=NUM_WORKERS, type=int, help="Number of worker actors")
+    parser.add_argument("--links", action='store_true', help="Record the link graph (links.sqlite and links.edges)")
+    parser.add_argument("--priority", nargs='?', default=DEFAULT_PRIORITY, choices=PRIORITIES, help="Order of the pending URLs, by link graph in-degree or PageRank instead of breadth-first (records the link graph)")
+    parser.add_argument("--stats", nargs='?', default=None, help="JSON file of the stage timings of all the workers, rewritten every few seconds")
+    parser.add_argument("--metrics_port", nargs='?', default=None, type=int, help="Serve the stage timings in the Prometheus format on this local port")
+    parser.add_argument("--profile_rate", nargs='?', default=0.0, type=float, help="Share of the pages profiled, to <output>/profiles/")
+    parser.add_argument("--profiler", nargs='?', default=DEFAULT_PROFILER, choices=PROFILERS, help="Profiler of the sampled pages")
+    parser.add_argument("--max_attempts", nargs='?', default=MAX_ATTEMPTS, type=int, help="Failed requests of a page before it is dropped, 429/503 responses not counted")
+    parser.add_argument("--fetch", nargs='?', default=DEFAULT_FETCH_MODE, choices=FETCH_MODES, help="Fetch the full page, or the article content only from the REST API (Parsoid HTML) or action=parse")
+    parser.add_argument("--frontier", nargs='?', default=None, help="Frontier shared with the crawlers of other nodes: redis://host:6379/0 or a SQLite file (default: <output>/frontier.sqlite of this node)")
     args = parser.parse_args()
-    main(args.initial_url,  args.output)
+    if args.replay and not args.cache:
+        parser.error("--replay needs a --cache file")
+    if args.frontier and args.priority != 'bfs':
+        parser.error("--priority needs the frontier of this node, not a shared --frontier")
+    ray.init(num_cpus=args.workers)
+    main(args.initial_url,  args.output, args.parser, args.cache, args.replay, args.workers, args.format, args.links,
+         args.priority, args.stats, args.metrics_port, args.profile_rate, args.profiler, args.max_attempts, args.fetch, args.frontier)
     ray.shutdown()
\ No newline at end of file
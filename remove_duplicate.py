@@ -1,20 +1,37 @@
 import os
+import re
 import glob
-
 import json
+import heapq
+import shutil
+import sqlite3
+import struct
+import hashlib
+import argparse
+import tempfile
+from functools import partial
+from multiprocessing import Pool
+
+from wiki.wiki.httpcache import cache_key
+from wiki.wiki.sinks import read_lines
 
+_NUM_BUCKETS = 64  # more buckets, less memory per bucket
+_ENTRY = struct.Struct('<II')  # (file index, line number) of a dropped line
+_URL_KEY = b'"url"'
+_URL_VALUE_REGEX = re.compile(r'\s*:\s*"')
+_URL_WINDOW = 4096  # bytes after "url" decoded to read its value
 
 
 def remove_duplicate_lines(input_file, output_file):
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     lines_seen = set()
-    
+
     with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
         for line in infile:
             if line not in lines_seen:
                 outfile.write(line)
                 lines_seen.add(line)
-    
+
     print("Duplicate lines removed and saved to", output_file)
 
 
@@ -26,11 +43,11 @@ def remove_duplicate_lines_in_jsonl_files(input_directory, output_directory):
             for line in infile:
                 data = json.loads(line)
                 url = data.get('url', None)
-                
+
                 if url is not None and url not in urls_seen:
                     outfile.write(json.dumps(data) + '\n')
                     urls_seen.add(url)
-        
+
         print("Duplicate lines removed and saved to", output_file)
 
     for filename in os.listdir(input_directory):
@@ -40,18 +57,215 @@ def remove_duplicate_lines_in_jsonl_files(input_directory, output_directory):
             remove_duplicate_lines_by_url_key(input_file_path, output_file_path)
 
 
+# Bounded-memory dedup, for corpora that do not fit in RAM
+#
+# 1. every input file is read in parallel and the normalized URL of each line
+#    is written to one of the bucket files, chosen from a hash of the URL
+# 2. buckets are deduplicated in parallel, only the URLs of one bucket are in
+#    memory; the (file, line) positions of the duplicates are written sorted
+# 3. the positions are merged per input file, and every input file is copied
+#    in parallel without its duplicate lines
+# The first occurrence of a URL, in the order of the input files, is kept.
+# jsonl.zst inputs are read through sinks.read_lines and copied as plain
+# JSON lines; Parquet shards are not supported.
+
+
+def jsonl_url(line: bytes):
+    """url field of a JSONL line, without decoding the whole record"""
+    start = line.find(_URL_KEY)
+    # "url" is the first key of the crawler records, only its value is decoded
+    if start >= 0 and line[:start].strip() == b'{':
+        head = line[start + len(_URL_KEY):start + len(_URL_KEY) + _URL_WINDOW].decode('utf-8', 'ignore')
+        match = _URL_VALUE_REGEX.match(head)
+        if match:
+            try:
+                return json.decoder.scanstring(head, match.end())[0]
+            except ValueError:
+                pass  # longer than the window
+    try:
+        return json.loads(line).get('url')
+    except ValueError:
+        return None
+
+
+def _lines(path):
+    """Raw lines of a text, jsonl or jsonl.zst file"""
+    if path.endswith('.jsonl.zst'):
+        yield from read_lines(path)
+        return
+    with open(path, 'rb') as fin:
+        yield from fin
+
+
+def text_url(line: bytes):
+    """URL of a line of a session file"""
+    return line.strip().decode('utf-8') or None
+
+
+class Redirects:
+    """Redirect targets from a TSV file "source url or title<TAB>target url or title",
+    looked up in a SQLite copy so that they are not held in memory"""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+
+    @classmethod
+    def build(cls, tsv_file, db_file):
+        db = sqlite3.connect(db_file)
+        db.execute("CREATE TABLE redirects (source TEXT PRIMARY KEY, target TEXT NOT NULL) WITHOUT ROWID")
+        with open(tsv_file, encoding='utf-8') as fin:
+            rows = (line.rstrip('\n').split('\t')[:2] for line in fin if '\t' in line)
+            db.executemany("INSERT OR REPLACE INTO redirects VALUES (?, ?)",
+                           ((_title_key(source), _title_key(target)) for source, target in rows))
+        db.commit()
+        db.close()
+        return cls(db_file)
+
+    def resolve(self, key):
+        row = self.db.execute("SELECT target FROM redirects WHERE source = ?", (key,)).fetchone()
+        return row[0] if row is not None else key
 
 
+def _title_key(url_or_title):
+    """Article title of a URL, percent-decoded and with the first letter in upper case"""
+    if '/wiki/' not in url_or_title:
+        url_or_title = '/wiki/' + url_or_title
+    return cache_key(url_or_title).split('/wiki/', 1)[1]
 
 
+def normalize_url(url, redirects=None):
+    """Same key for the variants of an article URL (percent-encoding, fragment, mobile host, redirects)"""
+    key = cache_key(url.replace('://en.m.', '://en.').replace('http://', 'https://', 1))
+    if redirects is not None and '/wiki/' in key:
+        prefix, title = key.split('/wiki/', 1)
+        key = prefix + '/wiki/' + redirects.resolve(title)
+    return key
+
+
+def _bucket_of(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _partition(file_index, input_file, work_dir, num_buckets, url_of_line, redirects_file):
+    """Step 1: write "key<TAB>file<TAB>line" of every line of input_file to its bucket"""
+    redirects = Redirects(redirects_file) if redirects_file else None
+    buckets = [open(os.path.join(work_dir, "bucket_{:04d}_{:05d}.tsv".format(b, file_index)), 'w', encoding='utf-8')
+               for b in range(num_buckets)]
+    for line_no, line in enumerate(_lines(input_file)):
+        url = url_of_line(line)
+        # lines without url are dropped, with an empty key
+        key = normalize_url(url, redirects) if url else ""
+        buckets[_bucket_of(key) % num_buckets].write("{}\t{}\t{}\n".format(key.replace('\t', ' ').replace('\n', ' '), file_index, line_no))
+    for fout in buckets:
+        fout.close()
+
+
+def _dedup_bucket(bucket, work_dir):
+    """Step 2: positions of the duplicate lines of a bucket, written sorted; returns their number"""
+    first = {}  # key -> first (file, line)
+    dropped = []
+    for bucket_file in sorted(glob.glob(os.path.join(work_dir, "bucket_{:04d}_*.tsv".format(bucket)))):
+        with open(bucket_file, encoding='utf-8') as fin:
+            for line in fin:
+                key, file_index, line_no = line.rstrip('\n').rsplit('\t', 2)
+                position = (int(file_index), int(line_no))
+                if not key:
+                    dropped.append(position)
+                elif key not in first:  # bucket files and their lines come in input order
+                    first[key] = position
+                else:
+                    dropped.append(position)
+        os.remove(bucket_file)
+    dropped.sort()
+    with open(os.path.join(work_dir, "dropped_{:04d}.bin".format(bucket)), 'wb') as fout:
+        for position in dropped:
+            fout.write(_ENTRY.pack(*position))
+    return len(dropped)
+
+
+def _read_entries(path):
+    with open(path, 'rb') as fin:
+        while True:
+            data = fin.read(_ENTRY.size)
+            if not data:
+                return
+            yield _ENTRY.unpack(data)
+
+
+def _split_dropped(work_dir, num_buckets, num_files):
+    """Step 3a: merge the sorted positions of the buckets into one sorted file per input file"""
+    files = [open(os.path.join(work_dir, "dropped_file_{:05d}.bin".format(f)), 'wb') for f in range(num_files)]
+    bucket_files = [os.path.join(work_dir, "dropped_{:04d}.bin".format(b)) for b in range(num_buckets)]
+    for file_index, line_no in heapq.merge(*[_read_entries(path) for path in bucket_files]):
+        files[file_index].write(_ENTRY.pack(file_index, line_no))
+    for fout in files:
+        fout.close()
+    for path in bucket_files:
+        os.remove(path)
+
+
+def _copy_unique(file_index, input_file, output_file, work_dir):
+    """Step 3b: copy input_file without its dropped lines, returns the number of lines kept"""
+    dropped = (line_no for _, line_no in _read_entries(os.path.join(work_dir, "dropped_file_{:05d}.bin".format(file_index))))
+    next_dropped = next(dropped, None)
+    num_kept = 0
+    with open(output_file, 'wb') as fout:
+        for line_no, line in enumerate(_lines(input_file)):
+            if line_no == next_dropped:
+                next_dropped = next(dropped, None)
+                continue
+            fout.write(line)
+            num_kept += 1
+    return num_kept
+
+
+def dedup_files(input_files, output_files, url_of_line=jsonl_url, num_buckets=_NUM_BUCKETS, processes=None,
+                redirects_tsv=None, tmp_dir=None):
+    """Copy input_files (text, jsonl or jsonl.zst) to output_files (uncompressed) keeping the first line of every
+    normalized URL"""
+    work_dir = tempfile.mkdtemp(prefix="dedup_", dir=tmp_dir)
+    try:
+        redirects_file = None
+        if redirects_tsv:
+            redirects_file = os.path.join(work_dir, "redirects.sqlite")
+            Redirects.build(redirects_tsv, redirects_file).db.close()
+        with Pool(processes=processes) as pool:
+            pool.starmap(partial(_partition, work_dir=work_dir, num_buckets=num_buckets, url_of_line=url_of_line,
+                                 redirects_file=redirects_file), enumerate(input_files))
+            num_dropped = sum(pool.map(partial(_dedup_bucket, work_dir=work_dir), range(num_buckets)))
+            _split_dropped(work_dir, num_buckets, len(input_files))
+            for output_file in output_files:
+                os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+            num_kept = sum(pool.starmap(partial(_copy_unique, work_dir=work_dir),
+                                        [(i, f, o) for i, (f, o) in enumerate(zip(input_files, output_files))]))
+    finally:
+        shutil.rmtree(work_dir)
+    print("Duplicate lines removed: {} kept, {} dropped".format(num_kept, num_dropped))
+    return num_kept, num_dropped
+
 
 if __name__ == "__main__":
-    # Replace these with your input and output file paths
-    input_session_file = "./ray_wiki_output/session_visited_urls.txt"
-    output_session_file = "./ray_wiki_output_unique/session_visited_urls.txt"
-    remove_duplicate_lines(input_session_file, output_session_file)
-
-    # Replace these with your input and output directory paths
-    input_directory = './ray_wiki_output'
-    output_directory = './ray_wiki_output_unique'
-    remove_duplicate_lines_in_jsonl_files(input_directory, output_directory)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs='?', default='./ray_wiki_output', help="Directory of crawled jsonl or jsonl.zst files and session_visited_urls.txt")
+    parser.add_argument("output", nargs='?', default='./ray_wiki_output_unique', help="Output directory")
+    parser.add_argument("-b", "--buckets", nargs='?', default=_NUM_BUCKETS, type=int, help="Number of hash partitions")
+    parser.add_argument("-w", "--processes", nargs='?', default=None, type=int, help="Number of processes (default: one per core)")
+    parser.add_argument("-r", "--redirects", nargs='?', default=None, help="TSV file of redirects: source<TAB>target (urls or titles)")
+    parser.add_argument("-t", "--tmp_dir", nargs='?', default=None, help="Directory of the temporary buckets")
+    args = parser.parse_args()
+    if glob.glob(os.path.join(args.input, "*.parquet")):
+        parser.error("Parquet shards are not supported, crawl with --format jsonl or jsonl.zst")
+    # wiki_data_000.jsonl.zst is written to wiki_data_000.jsonl
+    input_files = sorted(glob.glob(os.path.join(args.input, "*.jsonl")) + glob.glob(os.path.join(args.input, "*.jsonl.zst")))
+    output_files = [os.path.join(args.output, os.path.basename(f)[:-len('.zst')] if f.endswith('.zst') else os.path.basename(f))
+                    for f in input_files]
+    if len(set(output_files)) < len(output_files):
+        parser.error("Both jsonl and jsonl.zst files of the same shard in {}".format(args.input))
+
+    session_file = os.path.join(args.input, "session_visited_urls.txt")
+    if os.path.exists(session_file):
+        dedup_files([session_file], [os.path.join(args.output, "session_visited_urls.txt")], text_url,
+                    args.buckets, args.processes, args.redirects, args.tmp_dir)
+
+    dedup_files(input_files, output_files, jsonl_url, args.buckets, args.processes, args.redirects, args.tmp_dir)
@@ -0,0 +1,93 @@
+# Local HTTP stand-in for a wiki in the tests: fixed responses by path, the
+# crawlers run against it in subprocesses (scrapy crawl, crawler scripts)
+
+import os
+import sys
+import json
+import threading
+import subprocess
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def article_page(title, links=(), text=''):
+    """Full page of an article with its links in div#mw-content-text"""
+    anchors = ' '.join('<a href="/wiki/{0}">{0}</a>'.format(link) for link in links)
+    return ('<html><head><title>{0}</title></head><body><div id="mw-content-text"><div class="mw-parser-output">'
+            '<p>{1} {2}</p></div></div></body></html>').format(title, text or title, anchors)
+
+
+class StubWiki:
+    """Serves routes, {path (with its query string or not): (status, headers, body)}, counts the requests of each path"""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.hits = Counter()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                path = self.path.partition('?')[0]
+                server.hits[path] += 1
+                status, headers, body = server.response(self.path, path, self.headers)
+                body = body.encode('utf-8')
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def response(self, full_path, path, headers):
+        route = self.routes.get(full_path, self.routes.get(path))
+        if route is None:
+            return 404, {'Content-Type': 'text/html'}, article_page('Not found')
+        if callable(route):
+            return route(headers)
+        status, route_headers, body = route
+        return status, dict({'Content-Type': 'text/html; charset=utf-8'}, **route_headers), body
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def crawl_spider(start_url, output, settings=None, timeout=120):
+    """Run the wiki_math spider of the Scrapy project, return its items (JSON lines of output)"""
+    cmd = [sys.executable, '-m', 'scrapy', 'crawl', 'wiki_math', '-a', 'start_url=' + start_url,
+           '-s', 'ITEM_PIPELINES={}', '-s', 'ROBOTSTXT_OBEY=False', '-s', 'LOG_LEVEL=INFO', '-O', str(output)]
+    for name, value in (settings or {}).items():
+        cmd += ['-s', '{}={}'.format(name, value)]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    p = subprocess.run(cmd, cwd=os.path.join(ROOT, 'wiki'), env=env, capture_output=True, text=True, timeout=timeout)
+    assert p.returncode == 0 and 'Traceback' not in p.stderr, p.stderr[-3000:]
+    with open(output) as fin:
+        return [json.loads(line) for line in fin]
+
+
+def run_script(script, *args, cwd=None, timeout=300):
+    """Run a crawler script of the repository, return its output"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    p = subprocess.run([sys.executable, os.path.join(ROOT, script)] + [str(arg) for arg in args], cwd=cwd, env=env,
+                       stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=timeout)
+    assert p.returncode == 0 and 'Traceback' not in p.stderr, p.stdout[-2000:] + p.stderr[-3000:]
+    return p.stdout
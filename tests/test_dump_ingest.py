@@ -0,0 +1,72 @@
+import os
+import gzip
+import json
+import tarfile
+
+import pytest
+
+from filter_math_articles import MathPredicate, filter_file
+from stubserver import ROOT, run_script
+from wiki.wiki.parsers import DEFAULT_PARSER, get_parser
+from wiki.wiki.sinks import read_lines
+
+SAMPLE_DUMP = os.path.join(ROOT, 'fixtures', 'dumps', 'enwiki-NS0-SAMPLE-ENTERPRISE-HTML.json.tar.gz')
+
+
+def sample_records():
+    with tarfile.open(SAMPLE_DUMP, 'r:gz') as tar:
+        return [json.loads(line) for member in tar if member.isfile()
+                for line in tar.extractfile(member) if line.strip()]
+
+
+def read_shards(output_dir):
+    shards = sorted(f for f in os.listdir(output_dir) if f.startswith('wiki_data_'))
+    return shards, [json.loads(line) for shard in shards for line in read_lines(os.path.join(output_dir, shard))]
+
+
+def test_sample_dump_is_ingested_in_shards(tmp_path):
+    for _ in range(2):  # the shards of the first ingest are replaced
+        out = run_script('wiki-dump-ingest.py', SAMPLE_DUMP, '-o', tmp_path / 'out', '-s', 2, '-w', 2, cwd=tmp_path)
+    assert 'Number of articles in total: 3' in out
+    shards, records = read_shards(tmp_path / 'out')
+    assert shards == ['wiki_data_000.jsonl', 'wiki_data_001.jsonl']
+    expected = {r['url']: get_parser(DEFAULT_PARSER).parse(r['article_body']['html']).text_with_formulas()
+                for r in sample_records()}
+    assert [list(r) for r in records] == [['url', 'title', 'text', 'num_formulas', 'crawl_time']] * 3
+    assert {r['url']: (r['text'], r['num_formulas']) for r in records} == {
+        url: (text, len(formulas)) for url, (text, formulas) in expected.items()}
+    assert records[0]['title'] == 'Quadratic_formula'
+    _, formula_records = read_shards(tmp_path / 'out' / 'formulas')
+    assert [(f['url'], f['latex']) for f in formula_records] == [
+        (url, f.latex) for url, (_, formulas) in expected.items() for f in formulas]
+    assert formula_records
+
+
+def test_ingested_math_articles_pass_the_filter(tmp_path):
+    run_script('wiki-dump-ingest.py', SAMPLE_DUMP, '-o', tmp_path / 'out', '-w', 1, cwd=tmp_path)
+    _, records = read_shards(tmp_path / 'out')
+    math_titles = [r['title'] for r in records if r['num_formulas'] > 0]
+    assert filter_file(str(tmp_path / 'out' / 'wiki_data_000.jsonl'), str(tmp_path / 'math.jsonl'),
+                       MathPredicate()) == (3, len(math_titles))
+    assert [json.loads(line)['title'] for line in open(tmp_path / 'math.jsonl')] == math_titles
+
+
+def test_parquet_shards(tmp_path):
+    pytest.importorskip('pyarrow')
+    run_script('wiki-dump-ingest.py', SAMPLE_DUMP, '-o', tmp_path / 'out', '-w', 1, '-f', 'parquet', cwd=tmp_path)
+    assert filter_file(str(tmp_path / 'out' / 'wiki_data_000.00000.parquet'), str(tmp_path / 'math.jsonl'),
+                       MathPredicate(min_formulas=0)) == (3, 3)
+    assert os.path.exists(tmp_path / 'out' / 'formulas' / 'wiki_data_000.00000.parquet')
+
+
+def test_ndjson_dump_skips_other_namespaces(tmp_path):
+    records = sample_records()
+    talk = dict(records[0], url=records[0]['url'].replace('/wiki/', '/wiki/Talk:'), namespace={'identifier': 1})
+    dump_file = tmp_path / 'dump.ndjson.gz'
+    with gzip.open(dump_file, 'wt', encoding='utf-8') as fout:
+        for record in [talk] + records:
+            fout.write(json.dumps(record) + '\n\n')
+    out = run_script('wiki-dump-ingest.py', dump_file, '-o', tmp_path / 'out', '-a', 2, '-w', 1, cwd=tmp_path)
+    assert 'Number of articles in total: 2' in out
+    _, written = read_shards(tmp_path / 'out')
+    assert [r['url'] for r in written] == [r['url'] for r in records[:2]]
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+from scrapy import Request
+from scrapy.utils.test import get_crawler
+
+from wiki.wiki.dupefilters import SEEN_LOG, WikiTitleDupeFilter
+from wiki.wiki.mwapi import REST_HTML_PATH, article_url
+
+from stubserver import StubWiki, article_page, crawl_spider
+
+
+@pytest.fixture
+def fingerprinter():
+    return get_crawler(settings_dict={'REQUEST_FINGERPRINTER_IMPLEMENTATION': '2.7'}).request_fingerprinter
+
+
+def rest_page(links):
+    return '<html><body><p>text {}</p></body></html>'.format(' '.join('<a href="./{0}">{0}</a>'.format(l) for l in links))
+
+
+@pytest.mark.parametrize('fetch_mode', ['page', 'rest'])
+def test_redirect_target_is_crawled(tmp_path, fetch_mode):
+    # A -> B, B redirected to C: C is a new article, not a duplicate of B
+    prefix = '/wiki/' if fetch_mode == 'page' else REST_HTML_PATH
+    page = article_page if fetch_mode == 'page' else lambda title, links=(): rest_page(links)
+    routes = {
+        prefix + 'A': (200, {}, page('A', ['B'])),
+        prefix + 'B': (301, {'Location': prefix + 'C'}, ''),
+        prefix + 'C': (200, {}, page('C', ['A'])),
+    }
+    with StubWiki(routes) as wiki:
+        items = crawl_spider(wiki.base_url + '/wiki/A', tmp_path / 'items.jsonl', {'WIKI_FETCH_MODE': fetch_mode})
+    assert wiki.hits[prefix + 'C'] == 1
+    assert wiki.hits[prefix + 'A'] == 1
+    assert sorted(item['key'] for item in items) == ['A', 'C']
+
+
+def test_keyed_by_title(fingerprinter):
+    df = WikiTitleDupeFilter(fingerprinter)
+    assert not df.request_seen(Request('http://127.0.0.1/wiki/Euler%27s_identity#Explanation'))
+    assert df.request_seen(Request(article_url('http://127.0.0.1', "/wiki/Euler's_identity", 'rest')))
+    assert df.request_seen(Request(article_url('http://127.0.0.1', '/wiki/euler%27s_identity', 'parse')))
+    assert df.article_seen("/wiki/Euler's_identity")
+    assert not df.article_seen('/wiki/Leonhard_Euler')
+    assert not df.request_seen(Request('http://127.0.0.1/robots.txt'))
+    assert df.request_seen(Request('http://127.0.0.1/robots.txt'))
+
+
+def test_seen_hashes_survive_a_crash(tmp_path, fingerprinter):
+    df = WikiTitleDupeFilter(fingerprinter, str(tmp_path))
+    for title in ('A', 'B', 'C'):
+        assert not df.request_seen(Request('http://127.0.0.1/wiki/' + title))
+    # not closed: the hashes are in the log
+    df = WikiTitleDupeFilter(fingerprinter, str(tmp_path))
+    assert df.request_seen(Request('http://127.0.0.1/wiki/B'))
+    assert not df.request_seen(Request('http://127.0.0.1/wiki/D'))
+    df.close('finished')
+    assert os.path.getsize(tmp_path / SEEN_LOG) == 0
+    df = WikiTitleDupeFilter(fingerprinter, str(tmp_path))
+    assert all(df.article_seen('/wiki/' + title) for title in 'ABCD')
+    df.close('finished')
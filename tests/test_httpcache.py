@@ -0,0 +1,68 @@
+import json
+
+import requests
+
+from wiki.wiki.httpcache import ResponseCache, fetch
+from wiki.wiki.mwapi import ACTION_API_PATH
+
+from stubserver import StubWiki, article_page, crawl_spider
+
+ETAG = '"v1"'
+
+
+def conditional(body):
+    """Route answering 304 to a request with If-None-Match, the page with its ETag otherwise"""
+    def route(headers):
+        if headers.get('If-None-Match'):
+            return 304, {'ETag': ETAG}, ''
+        return 200, {'Content-Type': 'text/html; charset=utf-8', 'ETag': ETAG}, body
+    return route
+
+
+def test_conditional_refetch(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    with StubWiki({'/wiki/A': conditional(article_page('A', ['B']))}) as wiki, requests.Session() as session:
+        url = wiki.base_url + '/wiki/A'
+        r = fetch(session, url, cache)
+        assert r.status == 200 and 'href="/wiki/B"' in r.html
+        r = fetch(session, url, cache)  # not modified, links unknown: the cached page
+        assert r.status == 200 and 'href="/wiki/B"' in r.html
+        cache.set_links(url, ['/wiki/B'])
+        r = fetch(session, url, cache)
+        assert r.status == 304 and r.links == ['/wiki/B']
+    cache.close()
+
+
+def test_304_without_cached_page_is_a_miss(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    with StubWiki({'/wiki/A': conditional(article_page('A', ['B'])),
+                   '/wiki/Broken': (304, {}, '')}) as wiki, requests.Session() as session:
+        # conditional headers of the caller, nothing cached
+        r = fetch(session, wiki.base_url + '/wiki/A', cache, headers={'If-None-Match': ETAG})
+        assert r.status == 200 and 'href="/wiki/B"' in r.html
+        assert wiki.hits['/wiki/A'] == 2
+        r = fetch(session, wiki.base_url + '/wiki/Broken', cache)
+        assert r.status == 502 and r.html is None
+    cache.close()
+
+
+def test_spider_caches_parse_api_responses(tmp_path):
+    def parse(title, links):
+        text = '<p>{} {}</p>'.format(title, ' '.join('<a href="/wiki/{0}">{0}</a>'.format(l) for l in links))
+        return (200, {'Content-Type': 'application/json; charset=utf-8', 'ETag': ETAG},
+                json.dumps({'parse': {'title': title, 'text': '<div class="mw-parser-output">' + text + '</div>'}}))
+
+    routes = {ACTION_API_PATH + '?action=parse&format=json&formatversion=2&prop=text&redirects=1&page=A': parse('A', ['B']),
+              ACTION_API_PATH + '?action=parse&format=json&formatversion=2&prop=text&redirects=1&page=B': parse('B', ['A'])}
+    cache_file = tmp_path / 'cache.sqlite'
+    settings = {'WIKI_FETCH_MODE': 'parse', 'WIKI_HTTP_CACHE': cache_file}
+    with StubWiki(routes) as wiki:
+        items = crawl_spider(wiki.base_url + '/wiki/A', tmp_path / 'items.jsonl', settings)
+        assert sorted(item['key'] for item in items) == ['A', 'B']
+        cache = ResponseCache(str(cache_file))
+        assert all(cache.get(wiki.base_url + path) is not None for path in routes)
+        cache.close()
+        # served from the cache only
+        replayed = crawl_spider(wiki.base_url + '/wiki/A', tmp_path / 'replay.jsonl', dict(settings, WIKI_HTTP_CACHE_REPLAY=True))
+    assert sorted(item['key'] for item in replayed) == ['A', 'B']
+    assert wiki.hits[ACTION_API_PATH] == 2
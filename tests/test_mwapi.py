@@ -0,0 +1,92 @@
+import json
+
+import pytest
+import requests
+
+from stubserver import StubWiki, run_script
+from wiki.wiki.mwapi import (ACTION_API_PATH, FETCH_MODES, PARSE_QUERY, REST_HTML_PATH, article_content, article_url,
+                             url_article)
+from wiki.wiki.parsers import DEFAULT_PARSER, get_parser
+
+ARTICLE = '/wiki/Euler%27s_identity'
+CONTENT = ('<div class="mw-parser-output"><p>Euler\'s identity is <span class="texhtml">e<sup>iπ</sup> + 1 = 0</span>, '
+           'found by <a href="/wiki/Leonhard_Euler">Euler</a><sup><a href="#cite_note-1">[1]</a></sup>.</p>'
+           '<p><math alttext="{\\displaystyle e^{i\\pi }+1=0}"><mi>e</mi></math></p></div>')
+EULER_CONTENT = '<div class="mw-parser-output"><p>Leonhard Euler was a mathematician.</p></div>'
+
+
+def full_page(content):
+    """Page of the skin, with links outside of div#mw-content-text"""
+    return ('<html><body><div id="mw-navigation"><a href="/wiki/Main_Page">Main page</a></div>'
+            '<div id="mw-content-text">' + content + '</div></body></html>')
+
+
+def rest_page(title, content):
+    """Parsoid HTML: relative links, the citations link to the article itself"""
+    content = content.replace('href="/wiki/', 'href="./').replace('href="#', 'href="./{}#'.format(title))
+    return '<!DOCTYPE html><html><head><meta charset="utf-8"/></head><body>' + content + '</body></html>'
+
+
+def wiki_routes():
+    routes = {}
+    for title, content in (('Euler%27s_identity', CONTENT), ('Leonhard_Euler', EULER_CONTENT)):
+        routes['/wiki/' + title] = (200, {}, full_page(content))
+        routes[REST_HTML_PATH + title] = (200, {}, rest_page(title, content))
+        routes[ACTION_API_PATH + '?' + PARSE_QUERY + title] = (
+            200, {'Content-Type': 'application/json; charset=utf-8'}, json.dumps({"parse": {"text": content}}))
+    routes[ACTION_API_PATH] = (200, {'Content-Type': 'application/json; charset=utf-8'},
+                               json.dumps({"error": {"code": "missingtitle"}}))
+    return routes
+
+
+def fetch_article(base_url, article, mode):
+    r = requests.get(article_url(base_url, article, mode))
+    return article_content(r.status_code, r.text, article, mode)
+
+
+@pytest.mark.parametrize('mode', FETCH_MODES)
+@pytest.mark.parametrize('article', [ARTICLE, '/wiki/AC/DC', '/wiki/Tom_%26_Jerry', '/wiki/Set_(mathematics)'])
+def test_url_article_inverts_article_url(mode, article):
+    assert url_article(article_url('http://127.0.0.1:8000', article, mode)) == article
+
+
+def test_url_article_of_other_urls():
+    assert url_article('http://127.0.0.1/w/index.php?title=Special:Random') is None
+    assert url_article('http://127.0.0.1' + ACTION_API_PATH + '?action=query&titles=A') is None
+
+
+@pytest.mark.parametrize('mode', ['rest', 'parse'])
+def test_content_modes_give_the_links_and_text_of_the_page(mode):
+    parser = get_parser(DEFAULT_PARSER)
+    with StubWiki(wiki_routes()) as wiki:
+        _, page_html = fetch_article(wiki.base_url, ARTICLE, 'page')
+        status, html = fetch_article(wiki.base_url, ARTICLE, mode)
+    assert status == 200
+    page, content = parser.parse(page_html), parser.parse(html)
+    assert content.links() == page.links() == ['/wiki/Leonhard_Euler', '#cite_note-1']
+    assert content.text_with_formulas() == page.text_with_formulas()
+    assert len(page.text_with_formulas()[1]) == 2
+
+
+@pytest.mark.parametrize('mode', ['rest', 'parse'])
+def test_missing_article_is_a_404(mode):
+    with StubWiki(wiki_routes()) as wiki:
+        status, html = fetch_article(wiki.base_url, '/wiki/Missing', mode)
+    assert status == 404
+    assert get_parser(DEFAULT_PARSER).parse(html).links() == []
+
+
+@pytest.mark.parametrize('mode', FETCH_MODES)
+def test_crawler_fetch_modes(tmp_path, mode):
+    parser = get_parser(DEFAULT_PARSER)
+    expected = {title: parser.parse(full_page(content)).text()
+                for title, content in (('Euler%27s_identity', CONTENT), ('Leonhard_Euler', EULER_CONTENT))}
+    with StubWiki(wiki_routes()) as wiki:
+        run_script('wikipedia-crawler.py', '--initial_url', wiki.base_url + ARTICLE, '--fetch', mode, '-a', 10,
+                   '-i', 0, '-o', tmp_path / 'out.jsonl', cwd=tmp_path)
+    records = [json.loads(line) for line in open(tmp_path / 'out.jsonl')]
+    assert {r['url'].rsplit('/', 1)[1]: r['text'] for r in records} == expected
+    fetched = {'page': ['/wiki/Euler%27s_identity', '/wiki/Leonhard_Euler'],
+               'rest': [REST_HTML_PATH + 'Euler%27s_identity', REST_HTML_PATH + 'Leonhard_Euler'],
+               'parse': [ACTION_API_PATH, ACTION_API_PATH]}[mode]
+    assert sum(wiki.hits.values()) == 2 and all(wiki.hits[path] for path in fetched)  # skin links not followed
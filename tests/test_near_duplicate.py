@@ -0,0 +1,41 @@
+import json
+import inspect
+import email.message
+import email._header_value_parser
+
+from near_duplicate import _normalize_text, find_near_duplicates, shingle_hashes
+
+# long unrelated texts, with the same alphabet (merged by a weak shingle hash)
+EMAIL_TEXT = inspect.getsource(email.message)
+PARSER_TEXT = inspect.getsource(email._header_value_parser)
+
+
+def near_copy(text):
+    """text with a few words changed, as the same article crawled under another href"""
+    words = text.split(' ')
+    for i in range(0, len(words), 200):
+        words[i] = 'changed'
+    return ' '.join(words)
+
+
+def write_shard(path, articles):
+    with open(path, 'w', encoding='utf-8') as fout:
+        for url, text in articles:
+            fout.write(json.dumps({"url": url, "text": text}) + '\n')
+
+
+def test_shingle_hashes_are_distinct():
+    text = _normalize_text(EMAIL_TEXT).encode('utf-8')  # shingles of bytes
+    assert len(shingle_hashes(EMAIL_TEXT)) == len({text[i:i + 9] for i in range(len(text) - 8)})
+
+
+def test_unrelated_articles_are_kept_and_near_copies_dropped(tmp_path):
+    write_shard(tmp_path / 'wiki_data_000.jsonl', [('/wiki/Email', EMAIL_TEXT), ('/wiki/Parser', PARSER_TEXT)])
+    write_shard(tmp_path / 'wiki_data_001.jsonl', [('/wiki/Parsers', near_copy(PARSER_TEXT))])
+    output_dir = tmp_path / 'out'
+    canonical = find_near_duplicates([str(tmp_path / 'wiki_data_000.jsonl'), str(tmp_path / 'wiki_data_001.jsonl')],
+                                     str(output_dir), processes=1)
+    assert list(canonical) == [0, 1, 1]
+    assert [json.loads(line)['url'] for line in open(output_dir / 'wiki_data_000.jsonl')] == ['/wiki/Email', '/wiki/Parser']
+    assert open(output_dir / 'wiki_data_001.jsonl').read() == ''
+    assert open(output_dir / 'canonical_urls.tsv').read().splitlines()[2] == '/wiki/Parsers\t/wiki/Parser'
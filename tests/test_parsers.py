@@ -0,0 +1,35 @@
+import os
+import glob
+
+import pytest
+
+from check_parser_parity import check_parser_parity, parse_page
+from wiki.wiki.parsers import DEFAULT_PARSER, PARSERS, get_parser
+
+from stubserver import ROOT
+
+CORPUS = os.path.join(ROOT, 'fixtures', 'pages')
+PAGES = sorted(glob.glob(os.path.join(CORPUS, '*.html')))
+BACKENDS = [name for name in PARSERS if name != DEFAULT_PARSER]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    if request.param == 'lxml':
+        pytest.importorskip('lxml')
+    return request.param
+
+
+@pytest.mark.parametrize('html_file', PAGES, ids=os.path.basename)
+def test_backend_matches_the_reference(html_file, backend):
+    with open(html_file, encoding='utf-8') as fin:
+        html = fin.read()
+    reference = parse_page(get_parser(DEFAULT_PARSER), html)
+    assert reference["links"] and reference["text"]
+    result = parse_page(get_parser(backend), html)
+    for field in ("links", "text", "formulas"):
+        assert result[field] == reference[field], field
+
+
+def test_check_parser_parity(backend):
+    assert check_parser_parity(CORPUS, [DEFAULT_PARSER, backend])
@@ -0,0 +1,128 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from scrapy.exceptions import DropItem
+from twisted.internet.defer import Deferred
+
+from wiki.wiki import pipelines
+from wiki.wiki.items import WikiItem
+from wiki.wiki.pipelines import WikiMongoDBBulkPipeline
+
+mongomock = pytest.importorskip('mongomock')
+
+
+@pytest.fixture
+def threads(monkeypatch):
+    """deferToThread of the pipeline in plain threads, without a running reactor"""
+    started = []
+
+    def defer_to_thread(f, *args):
+        d = Deferred()
+        started.append(threading.Thread(target=lambda: d.callback(f(*args))))
+        started[-1].start()
+        return d
+
+    monkeypatch.setattr(pipelines, 'deferToThread', defer_to_thread)
+    yield started
+    for thread in started:
+        thread.join(5)
+
+
+@pytest.fixture
+def spider():
+    closed = []
+    engine = SimpleNamespace(close_spider=lambda spider, reason: closed.append(reason))
+    return SimpleNamespace(crawler=SimpleNamespace(engine=engine), closed=closed)
+
+
+def item(i):
+    return WikiItem({"key": "A%d" % i, "url": "http://127.0.0.1/wiki/A%d" % i, "text": "text %d" % i, "formulas": []})
+
+
+def close(pipeline, spider, threads):
+    d = pipeline.close_spider(spider)
+    threads[-1].join(10)
+    assert d.called
+
+
+class FlakyCollection:
+    """Collection whose bulk_write fails `failures` times first"""
+
+    def __init__(self, collection, failures, block=None):
+        self.collection = collection
+        self.failures = failures
+        self.block = block
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, operations, ordered=True):
+        self.calls += 1
+        if self.block is not None:
+            self.block.wait(10)
+        if self.failures > 0:
+            self.failures -= 1
+            raise mongomock.WriteError("down")
+        return self.collection.bulk_write(operations, ordered=ordered)
+
+
+def test_items_are_upserted_in_bulk(spider, threads):
+    client = mongomock.MongoClient()
+    pipeline = WikiMongoDBBulkPipeline(batch_size=10, flush_interval=0.05, client=client)
+    pipeline.open_spider(spider)
+    for i in range(25):
+        assert pipeline.process_item(item(i), spider) is not None
+    pipeline.process_item(item(3), spider)  # upserted again
+    close(pipeline, spider, threads)
+    collection = client['wiki']['wiki_math']
+    assert collection.count_documents({}) == 25
+    assert collection.find_one({"key": "A7"})["text"] == "text 7"
+    assert pipeline.num_written == 26 and pipeline.num_errors == 0
+
+
+def test_a_full_queue_does_not_block_process_item(spider, threads):
+    block = threading.Event()
+    pipeline = WikiMongoDBBulkPipeline(batch_size=1, flush_interval=0.05, client=mongomock.MongoClient())
+    pipeline.open_spider(spider)
+    pipeline.collection = FlakyCollection(pipeline.collection, 0, block)
+    results = [pipeline.process_item(item(i), spider) for i in range(20)]  # the queue holds 4
+    deferreds = [r for r in results if isinstance(r, Deferred)]
+    assert deferreds and not all(d.called for d in deferreds)
+    block.set()
+    for thread in threads:  # Scrapy closes the pipeline once the items are processed
+        thread.join(10)
+    assert all(d.called for d in deferreds)
+    close(pipeline, spider, threads)
+    assert pipeline.client['wiki']['wiki_math'].count_documents({}) == 20
+
+
+def test_a_failed_batch_is_retried(spider, threads):
+    pipeline = WikiMongoDBBulkPipeline(batch_size=5, flush_interval=0.05, retry_delay=0.01, client=mongomock.MongoClient())
+    pipeline.open_spider(spider)
+    pipeline.collection = FlakyCollection(pipeline.collection, 2)
+    for i in range(5):
+        pipeline.process_item(item(i), spider)
+    close(pipeline, spider, threads)
+    assert pipeline.collection.count_documents({}) == 5
+    assert pipeline.num_errors == 2 and pipeline.num_failed == 0
+    assert spider.closed == []
+
+
+def test_a_batch_that_keeps_failing_closes_the_spider(spider, threads):
+    pipeline = WikiMongoDBBulkPipeline(batch_size=2, flush_interval=0.05, retry_times=1, retry_delay=0.01,
+                                       client=mongomock.MongoClient())
+    pipeline.open_spider(spider)
+    pipeline.collection = FlakyCollection(pipeline.collection, 100)
+    pipeline.process_item(item(0), spider)
+    pipeline.process_item(item(1), spider)
+    for _ in range(100):
+        if pipeline.error is not None:
+            break
+        threading.Event().wait(0.05)
+    with pytest.raises(DropItem):
+        pipeline.process_item(item(2), spider)
+    assert spider.closed == ["mongodb_error"]
+    close(pipeline, spider, threads)
+    assert pipeline.num_failed == 2 and pipeline.collection.calls == 2
@@ -0,0 +1,82 @@
+import json
+import time
+import importlib.util
+
+import pytest
+
+from stubserver import StubWiki, article_page, run_script
+from wiki.wiki.ratelimit import DONE, DROP, RETRY, FetchScheduler, retry_after_seconds
+
+URL = 'http://127.0.0.1/wiki/A'
+
+
+def throttled_once(title, retry_after='1'):
+    """Route that answers 429 with a Retry-After to the first request, then the page"""
+    times = []
+
+    def route(headers):
+        times.append(time.monotonic())
+        if len(times) == 1:
+            return 429, {'Content-Type': 'text/html', 'Retry-After': retry_after}, 'slow down'
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, article_page(title)
+    route.times = times
+    return route
+
+
+def test_throttle_halves_the_window_once_per_epoch():
+    scheduler = FetchScheduler(window=8)
+    tokens = [scheduler.start(URL) for _ in range(4)]
+    for token in tokens:
+        assert scheduler.finish(URL, token, 429, '0') == RETRY
+    assert scheduler.window(URL) == 4  # halved once for the requests in flight together
+    assert scheduler.num_throttled == 4 and scheduler.num_retries() == 4
+    token = scheduler.start(URL)
+    assert scheduler.finish(URL, token, 200) == DONE
+
+
+def test_retry_after_pauses_the_host():
+    scheduler = FetchScheduler()
+    scheduler.finish(URL, scheduler.start(URL), 503, '30')
+    assert not scheduler.can_start(URL) and 29 < scheduler.pause_time(URL) <= 30
+    assert scheduler.ready() == []
+    assert retry_after_seconds('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert retry_after_seconds('soon') is None
+
+
+def test_backoff_without_retry_after_restarts_after_a_success():
+    scheduler = FetchScheduler(backoff_base=1.0, backoff_cap=300.0)
+    for _ in range(20):  # 20 throttles in a row, hours ago
+        scheduler.finish(URL, scheduler.start(URL), 429)
+    assert scheduler.hosts['127.0.0.1'].throttles == 20
+    scheduler.finish(URL, scheduler.start(URL), 200)
+    for _ in range(50):
+        scheduler.hosts['127.0.0.1'].paused_until = 0.0
+        scheduler.finish(URL, scheduler.start(URL), 200)
+        scheduler.finish(URL, scheduler.start(URL), 429)
+        assert scheduler.pause_time(URL) <= 2.0  # first throttle since the success, not the 21st
+
+
+def test_errors_are_dropped_after_max_attempts():
+    scheduler = FetchScheduler(max_attempts=3, backoff_base=0.0)
+    outcomes = [scheduler.finish(URL, scheduler.start(URL), 500) for _ in range(3)]
+    assert outcomes == [RETRY, RETRY, DROP]
+    assert scheduler.num_dropped == 1 and scheduler.ready() == [URL, URL]
+
+
+@pytest.mark.parametrize('script', ['wikipedia-crawler.py', 'async-wiki-crawler.py'])
+def test_crawler_waits_for_retry_after(tmp_path, script):
+    if script == 'async-wiki-crawler.py' and importlib.util.find_spec('aiohttp') is None:
+        pytest.skip('aiohttp is not installed')
+    route = throttled_once('B')
+    routes = {'/wiki/A': (200, {}, article_page('A', ['B'])), '/wiki/B': route}
+    with StubWiki(routes) as wiki:
+        if script == 'wikipedia-crawler.py':
+            output_file = tmp_path / 'out.jsonl'
+            out = run_script(script, '--initial_url', wiki.base_url + '/wiki/A', '-a', 10, '-i', 0, '-o', output_file,
+                             cwd=tmp_path)
+        else:
+            output_file = tmp_path / 'async_wiki_output' / 'wiki_data_000.jsonl'
+            out = run_script(script, '--initial_url', wiki.base_url + '/wiki/A', '--parse_workers', 1, cwd=tmp_path)
+    assert wiki.hits['/wiki/B'] == 2
+    assert route.times[1] - route.times[0] >= 1.0, out
+    assert sorted(json.loads(line)['url'].rsplit('/', 1)[1] for line in open(output_file)) == ['A', 'B']
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from stubserver import StubWiki, article_page, run_script
+from wiki.wiki.httpcache import ResponseCache
+
+pytest.importorskip('ray')
+
+
+def test_failed_page_is_released_to_the_shared_frontier(tmp_path):
+    routes = {
+        '/wiki/A': (200, {}, article_page('A', ['B'])),
+        '/wiki/B': (500, {}, 'error'),
+    }
+    with StubWiki(routes) as wiki:
+        out = run_script('ray-wiki-crawler.py', '--initial_url', wiki.base_url + '/wiki/A', '-o', tmp_path / 'out',
+                         '-w', 1, '--max_attempts', 3, '--frontier', tmp_path / 'frontier.sqlite', cwd=tmp_path)
+    assert 'released to the shared frontier' in out
+    assert 'dropped after 3 attempts' in out
+    assert wiki.hits['/wiki/A'] == 1 and wiki.hits['/wiki/B'] == 3
+
+
+def test_page_missing_from_the_replay_cache_is_not_visited(tmp_path):
+    base_url = 'http://127.0.0.1:9'  # not requested
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    cache.put(base_url + '/wiki/A', 200, None, None, article_page('A', ['B']))
+    cache.close()
+    out = run_script('ray-wiki-crawler.py', '--initial_url', base_url + '/wiki/A', '-o', tmp_path / 'out', '-w', 1,
+                     '--cache', tmp_path / 'cache.sqlite', '--replay', cwd=tmp_path)
+    assert 'Not in cache: /wiki/B' in out and 'retrying later' not in out
+    # a live crawl with this session fetches B
+    assert open(tmp_path / 'out' / 'session_visited_urls.txt').read().split() == ['/wiki/A']
+    assert [json.loads(line)['title'] for line in open(tmp_path / 'out' / 'wiki_data_000.jsonl')] == ['A']
+
+
+def test_every_page_is_crawled_once(tmp_path):
+    routes = {
+        '/wiki/A': (200, {}, article_page('A', ['B', 'C'])),
+        '/wiki/B': (200, {}, article_page('B', ['A', 'C', 'D'])),
+        '/wiki/C': (200, {}, article_page('C', ['A', 'B'])),
+        '/wiki/D': (200, {}, article_page('D', ['A', 'D'])),
+    }
+    with StubWiki(routes) as wiki:
+        run_script('ray-wiki-crawler.py', '--initial_url', wiki.base_url + '/wiki/A', '-o', tmp_path / 'out', '-w', 2,
+                   cwd=tmp_path)
+    assert dict(wiki.hits) == {'/wiki/A': 1, '/wiki/B': 1, '/wiki/C': 1, '/wiki/D': 1}
+    titles = [json.loads(line)['title'] for shard in sorted((tmp_path / 'out').glob('wiki_data_*.jsonl'))
+              for line in open(shard)]
+    assert sorted(titles) == ['A', 'B', 'C', 'D']
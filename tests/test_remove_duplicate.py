@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from remove_duplicate import Redirects, dedup_files, normalize_url
+from stubserver import run_script
+from wiki.wiki.sinks import open_sink
+
+PAGE = 'https://en.wikipedia.org/wiki/'
+
+
+def write_records(path, urls):
+    with open_sink(str(path)) as sink:
+        for i, url in enumerate(urls):
+            sink.write({"url": url, "text": "text {}".format(i)})
+
+
+def read_urls(path):
+    return [json.loads(line)['url'] for line in open(path)]
+
+
+def test_normalize_url(tmp_path):
+    key = PAGE + "Euler's_identity"
+    assert normalize_url('https://en.m.wikipedia.org/wiki/Euler%27s_identity') == key  # mobile host
+    assert normalize_url('http://en.wikipedia.org/wiki/euler%27s_identity#Proof') == key  # http, fragment, case
+    tsv_file = tmp_path / 'redirects.tsv'
+    tsv_file.write_text("Euler_identity\tEuler's identity\n" + PAGE + "Pythagoras_theorem\tPythagorean theorem\n")
+    redirects = Redirects.build(str(tsv_file), str(tmp_path / 'redirects.sqlite'))
+    assert normalize_url('http://en.m.wikipedia.org/wiki/Euler_identity', redirects) == key
+    assert normalize_url(PAGE + 'Pythagoras_theorem', redirects) == PAGE + 'Pythagorean_theorem'
+    assert normalize_url(PAGE + 'Euclid', redirects) == PAGE + 'Euclid'
+
+
+def test_bucketed_dedup_keeps_the_first_line_of_each_url(tmp_path):
+    write_records(tmp_path / 'wiki_data_000.jsonl', [PAGE + 'A', PAGE + 'B', 'http://en.m.wikipedia.org/wiki/A'])
+    write_records(tmp_path / 'wiki_data_001.jsonl', [PAGE + 'b#History', PAGE + 'C'])
+    input_files = [str(tmp_path / 'wiki_data_000.jsonl'), str(tmp_path / 'wiki_data_001.jsonl')]
+    output_files = [str(tmp_path / 'out' / 'wiki_data_000.jsonl'), str(tmp_path / 'out' / 'wiki_data_001.jsonl')]
+    assert dedup_files(input_files, output_files, num_buckets=3, processes=2) == (3, 2)
+    assert read_urls(output_files[0]) == [PAGE + 'A', PAGE + 'B']
+    assert read_urls(output_files[1]) == [PAGE + 'C']
+
+
+def test_compressed_shards_are_deduplicated(tmp_path):
+    pytest.importorskip('zstandard')
+    (tmp_path / 'in').mkdir()
+    write_records(tmp_path / 'in' / 'wiki_data_000.jsonl.zst', [PAGE + 'A', PAGE + 'B', PAGE + 'A'])
+    write_records(tmp_path / 'in' / 'wiki_data_001.jsonl', [PAGE + 'B', PAGE + 'C'])
+    run_script('remove_duplicate.py', tmp_path / 'in', tmp_path / 'out', '-b', 2, '-w', 1)
+    assert read_urls(tmp_path / 'out' / 'wiki_data_000.jsonl') == [PAGE + 'A', PAGE + 'B']
+    assert read_urls(tmp_path / 'out' / 'wiki_data_001.jsonl') == [PAGE + 'C']
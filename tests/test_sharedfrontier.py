@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+from wiki.wiki.sharedfrontier import RedisSharedFrontier, SqliteSharedFrontier, open_shared_frontier
+
+from stubserver import StubWiki, article_page, crawl_spider
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def open_node(request, tmp_path):
+    """open_node(lease_timeout, max_attempts): a node of one shared frontier, in SQLite or in a fake Redis"""
+    nodes = []
+    if request.param == 'redis':
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa')  # Lua scripts of fakeredis
+        server = fakeredis.FakeServer()
+
+        def open_node(lease_timeout=60, max_attempts=5):
+            nodes.append(RedisSharedFrontier('redis://', lease_timeout=lease_timeout, max_attempts=max_attempts,
+                                             client=fakeredis.FakeRedis(server=server)))
+            return nodes[-1]
+    else:
+        def open_node(lease_timeout=60, max_attempts=5):
+            nodes.append(SqliteSharedFrontier(str(tmp_path / 'frontier.sqlite'), lease_timeout, max_attempts))
+            return nodes[-1]
+    yield open_node
+    for node in nodes:
+        node.close()
+
+
+def test_push_dedup(open_node):
+    a, b = open_node(), open_node()
+    assert a.is_new()
+    assert a.push_many(['/wiki/A', '/wiki/B', '/wiki/A']) == 2
+    assert not b.push('/wiki/B')
+    assert b.push('/wiki/C')
+    assert not a.is_new()
+    assert len(a) == len(b) == 3
+    assert a.add_seen(['/wiki/A', 'other']) == [False, True]
+
+
+def test_a_url_is_leased_by_one_node(open_node):
+    a, b = open_node(), open_node()
+    a.push_many(['/wiki/%d' % i for i in range(10)])
+    leased_a, leased_b = a.lease(6), b.lease(6)
+    assert leased_a == ['/wiki/%d' % i for i in range(6)]
+    assert leased_b == ['/wiki/%d' % i for i in range(6, 10)]
+    assert a.num_queued() == 0 and a.num_leased() == 10
+    a.ack(leased_a)
+    b.ack(leased_b)
+    assert len(a) == 0 and a.lease(1) == []
+
+
+def test_expired_leases_are_queued_again_then_dropped(open_node):
+    a, b = open_node(lease_timeout=0.05, max_attempts=2), open_node(lease_timeout=0.05, max_attempts=2)
+    a.push('/wiki/A')
+    assert a.lease(1) == ['/wiki/A']
+    time.sleep(0.1)  # node a stopped
+    assert b.lease(1) == ['/wiki/A']
+    time.sleep(0.1)
+    assert b.lease(1) == []  # expired max_attempts times
+    assert len(b) == 0
+
+
+def test_release_and_close(open_node):
+    a, b = open_node(), open_node()
+    a.push_many(['/wiki/A', '/wiki/B', '/wiki/C'])
+    assert a.pop() == '/wiki/A'  # B and C leased too, not handed out
+    a.retry('/wiki/A')
+    a.close()
+    assert sorted(b.lease(3)) == ['/wiki/A', '/wiki/B', '/wiki/C']
+
+
+def test_done_is_acknowledged_at_commit(open_node):
+    a, b = open_node(lease_timeout=0.05), open_node(lease_timeout=0.05)
+    a.push('/wiki/A')
+    assert a.pop() == '/wiki/A'
+    a.done('/wiki/A')
+    assert a.num_leased() == 1
+    a.commit()
+    time.sleep(0.1)
+    assert b.lease(1) == [] and len(b) == 0
+
+
+def test_open_shared_frontier(tmp_path):
+    frontier = open_shared_frontier('sqlite://' + str(tmp_path / 'f.sqlite'))
+    assert isinstance(frontier, SqliteSharedFrontier)
+    frontier.close()
+    redis = pytest.importorskip('redis')
+    frontier = open_shared_frontier('redis://localhost:6379/3?prefix=test')
+    assert isinstance(frontier, RedisSharedFrontier)
+    assert frontier.keys['queue'] == 'test:queue'
+    assert frontier.redis.connection_pool.connection_kwargs['db'] == 3
+    frontier.redis.close()
+
+
+def test_spider_nodes_share_the_frontier(tmp_path):
+    # two spiders, one after the other, on one SQLite frontier; B is redirected to C
+    routes = {
+        '/wiki/A': (200, {}, article_page('A', ['B', 'D'])),
+        '/wiki/B': (301, {'Location': '/wiki/C'}, ''),
+        '/wiki/C': (200, {}, article_page('C', ['A', 'D'])),
+        '/wiki/D': (200, {}, article_page('D', ['A'])),
+    }
+    settings = {'WIKI_SHARED_FRONTIER': tmp_path / 'frontier.sqlite', 'SCHEDULER': 'wiki.scheduler.WikiSharedScheduler',
+                'DUPEFILTER_CLASS': 'wiki.scheduler.WikiSharedDupeFilter'}
+    with StubWiki(routes) as wiki:
+        items = crawl_spider(wiki.base_url + '/wiki/A', tmp_path / 'items1.jsonl', settings)
+        items += crawl_spider(wiki.base_url + '/wiki/A', tmp_path / 'items2.jsonl', settings)
+    assert sorted(item['key'] for item in items) == ['A', 'C', 'D']
+    assert all(wiki.hits[path] == 1 for path in routes)
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from filter_math_articles import MathPredicate, filter_file
+from wiki.wiki.parsers import get_parser
+from wiki.wiki.sinks import article_record, open_sink
+
+MATH_PAGE = ('<html><body><div id="mw-content-text"><p>The sum <math alttext="{\\displaystyle a+b}"><mi>a</mi></math> '
+             'and <span class="texhtml">x + y</span>.</p></div></body></html>')
+TEXHTML_PAGE = '<html><body><div id="mw-content-text"><p>Only <span class="texhtml">x + y</span> here.</p></div></body></html>'
+TEXT_PAGE = '<html><body><div id="mw-content-text"><p>No formula.</p></div></body></html>'
+
+
+def record(title, html):
+    text, formulas = get_parser('html.parser').parse(html).text_with_formulas()
+    return article_record('http://127.0.0.1/wiki/' + title, text, len(formulas))
+
+
+def test_num_formulas_counts_texhtml():
+    assert record('Sum', MATH_PAGE)['num_formulas'] == 2
+    assert record('Texhtml', TEXHTML_PAGE)['num_formulas'] == 1
+    assert record('Text', TEXT_PAGE)['num_formulas'] == 0
+
+
+@pytest.mark.parametrize('fmt', ['jsonl', 'parquet'])
+def test_filter_keeps_texhtml_articles(tmp_path, fmt):
+    if fmt == 'parquet':
+        pytest.importorskip('pyarrow')
+    with open_sink(str(tmp_path / ('data.' + fmt))) as sink:
+        for title, html in (('Sum', MATH_PAGE), ('Texhtml', TEXHTML_PAGE), ('Text', TEXT_PAGE)):
+            sink.write(record(title, html))
+    input_file = str(tmp_path / 'data.jsonl') if fmt == 'jsonl' else str(next(tmp_path.glob('data.*.parquet')))
+    for min_formulas, titles in ((1, ['Sum', 'Texhtml']), (2, ['Sum'])):
+        output_file = tmp_path / 'out.jsonl'
+        assert filter_file(input_file, str(output_file), MathPredicate(min_formulas)) == (3, len(titles))
+        assert [json.loads(line)['title'] for line in open(output_file)] == titles
+
+
+def test_density_counts_the_formulas_of_num_formulas():
+    text, formulas = get_parser('html.parser').parse(TEXHTML_PAGE).text_with_formulas()
+    assert MathPredicate(min_formulas=0, min_density=0.2).match(text, len(formulas))
+    assert not MathPredicate(min_formulas=0, min_density=0.5).match(text, len(formulas))
+    # record written before num_formulas: both forms are counted in its text
+    assert MathPredicate(min_formulas=2).match(record('Sum', MATH_PAGE)['text'])
+    assert MathPredicate(min_formulas=0, min_density=0.2).may_match(json.dumps({"text": text}).encode())
@@ -0,0 +1,45 @@
+import os
+
+from wiki.wiki.frontier import Frontier, checkpoint
+from wiki.wiki.visited import HashSet, VisitedStore
+
+
+class RecordingSink:
+    """Output sink that checks the visited log at each flush"""
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.logged_at_flush = []
+
+    def flush(self):
+        with open(self.log_file) as fin:
+            self.logged_at_flush.append(fin.read().split())
+
+
+def test_nothing_is_logged_before_the_outputs_are_flushed(tmp_path):
+    log_file = str(tmp_path / 'visited.txt')
+    visited = VisitedStore(log_file, snapshot_every=2)
+    frontier = Frontier(str(tmp_path / 'frontier.sqlite'))
+    sink = RecordingSink(log_file)
+    urls = ['/wiki/A', '/wiki/B', '/wiki/C']
+    assert visited.update(urls) == urls
+    # past snapshot_every, but not checkpointed yet
+    assert os.path.getsize(log_file) == 0
+    assert not os.path.exists(visited.snapshot_file)
+    checkpoint(frontier, visited, sink)
+    assert sink.logged_at_flush == [[]]
+    with open(log_file) as fin:
+        assert fin.read().split() == urls
+    assert os.path.exists(visited.snapshot_file)  # written by sync()
+    visited.close()
+    frontier.close()
+    reopened = VisitedStore(log_file, readonly=True)
+    assert all(url in reopened for url in urls) and '/wiki/D' not in reopened
+
+
+def test_hash_set():
+    s = HashSet([5, 3])
+    assert s.add(4) and not s.add(3) and not s.add(4)
+    assert 5 in s and 6 not in s and len(s) == 3
+    s.merge()
+    assert list(s.hashes) == [3, 4, 5]
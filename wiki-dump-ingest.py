@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import bz2
+import glob
+import gzip
+import lzma
+import json
+import tarfile
+import argparse
+import threading
+from multiprocessing import Pool
+
+from wiki.wiki.parsers import PARSERS, DEFAULT_PARSER, get_parser
+from wiki.wiki.sinks import FORMATS, DEFAULT_FORMAT, FORMULAS_DIR, open_sink, open_formula_sink, article_record, formula_records
+
+DEFAULT_OUTPUT = 'dump_wiki_output'
+DEFAULT_SHARD_SIZE = 100000  # articles per wiki_data_{:03d} file
+NUM_PARSE_WORKERS = os.cpu_count()
+MAX_IN_FLIGHT = 1024  # articles read ahead of the parse pool, bounds the memory
+
+
+def open_compressed(path:str):
+    """Binary stream of a .gz / .bz2 / .xz / plain file"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def dump_lines(path:str):
+    """Yield the NDJSON lines of a dump, e.g. a Wikimedia Enterprise HTML tarball
+
+    (enwiki-NS0-20240101-ENTERPRISE-HTML.json.tar.gz) or a single .ndjson[.gz]
+    file. The tarball is read as a stream, one member after the other.
+    """
+    if '.tar' in os.path.basename(path):
+        with tarfile.open(path, 'r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                for line in tar.extractfile(member):
+                    if line.strip():
+                        yield line
+        return
+    with open_compressed(path) as fin:
+        for line in fin:
+            if line.strip():
+                yield line
+
+
+def parse_record(line:bytes, parser_name:str):
+    """Runs in the parse pool: (article record, formula records) of an article, None if it is skipped"""
+    try:
+        record = json.loads(line)
+        if record.get("namespace", {}).get("identifier", 0) != 0:  # articles only
+            return None
+        html = record.get("article_body", {}).get("html")
+        if not html:
+            return None
+        page = get_parser(parser_name).parse(html)
+        # get plain text without the citation sections
+        out_text, formulas = page.text_with_formulas()
+    except Exception as e:
+        print(e)
+        return None
+    url = record["url"]
+    return article_record(url, out_text, len(formulas)), formula_records(url, formulas)
+
+
+def _parse_record(args):
+    return parse_record(*args)
+
+
+def bounded(iterable, slots:threading.BoundedSemaphore):
+    """Stop reading ahead when all slots are taken, Pool.imap reads its input without limit"""
+    for item in iterable:
+        slots.acquire()
+        yield item
+
+
+def remove_shard(path:str):
+    """Remove the files of a shard written by a previous ingest, the sinks append to them"""
+    if path.endswith('.parquet'):
+        base = path[:-len('.parquet')]
+        files = glob.glob(glob.escape(base) + '.[0-9][0-9][0-9][0-9][0-9].parquet') + [base + '.parquet.pending']
+    else:
+        files = [path, path + '.size']
+    for file in files:
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def ingest_dump(dump_file:str, output_dir:str, parser_name:str=DEFAULT_PARSER, parse_workers:int=NUM_PARSE_WORKERS,
+                shard_size:int=DEFAULT_SHARD_SIZE, articles_limit:int=None, output_format:str=DEFAULT_FORMAT) -> int:
+    """Write the records of every article of dump_file to wiki_data_* shards and their formulas to formulas/wiki_data_*,
+    return the number of articles"""
+    os.makedirs(output_dir, exist_ok=True)
+    slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+    num_articles = 0
+    sink = formula_sink = None
+    with Pool(processes=parse_workers) as pool:
+        results = pool.imap(_parse_record, ((line, parser_name) for line in bounded(dump_lines(dump_file), slots)), chunksize=16)
+        try:
+            for result in results:
+                slots.release()
+                if result is None:
+                    continue
+                if num_articles % shard_size == 0:
+                    if sink is not None:
+                        sink.close()
+                        formula_sink.close()
+                    output_file = os.path.join(output_dir, "wiki_data_{:03d}.{}".format(num_articles // shard_size, output_format))
+                    remove_shard(output_file)
+                    remove_shard(os.path.join(output_dir, FORMULAS_DIR, os.path.basename(output_file)))
+                    sink = open_sink(output_file)
+                    formula_sink = open_formula_sink(output_file)
+                record, formulas = result
+                sink.write(record)
+                formula_sink.write_many(formulas)
+                num_articles += 1
+                if num_articles % 10000 == 0:
+                    print("Number of articles: {}".format(num_articles))
+                if articles_limit is not None and num_articles >= articles_limit:
+                    pool.terminate()
+                    break
+        finally:
+            if sink is not None:
+                sink.close()
+                formula_sink.close()
+    return num_articles
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dump", help="Wikipedia HTML dump, e.g. enwiki-NS0-20240101-ENTERPRISE-HTML.json.tar.gz")
+    parser.add_argument("-o", "--output", nargs='?', default=DEFAULT_OUTPUT, help="Output directory")
+    parser.add_argument("-a", "--articles", nargs='?', default=None, type=int, help="Total number of articles (default: no limit)")
+    parser.add_argument("-s", "--shard_size", nargs='?', default=DEFAULT_SHARD_SIZE, type=int, help="Articles per output file")
+    parser.add_argument("-w", "--parse_workers", nargs='?', default=NUM_PARSE_WORKERS, type=int, help="Number of parsing processes")
+    parser.add_argument("-p", "--parser", nargs='?', default=DEFAULT_PARSER, choices=list(PARSERS), help="HTML parser backend")
+    parser.add_argument("-f", "--format", nargs='?', default=DEFAULT_FORMAT, choices=FORMATS, help="Output format of the wiki_data_* files")
+    args = parser.parse_args()
+    num_articles = ingest_dump(args.dump, args.output, args.parser, args.parse_workers, args.shard_size, args.articles,
+                               args.format)
+    print("Number of articles in total: {}".format(num_articles))
+    print("Finished!")
+    sys.exit(0)
@@ -0,0 +1,109 @@
+# Compact dupefilter of the wiki project
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/settings.html#dupefilter-class
+#
+# Scrapy's RFPDupeFilter keeps the hex SHA1 fingerprint of every request in a
+# set of str, over 100 bytes per request. WikiTitleDupeFilter keeps the 64-bit
+# hash of the article title (wiki/visited.py) in a HashSet, 8 to 16 bytes per
+# article; the #fragments and the fetch mode of an article share its title,
+# and a redirected request is keyed by the article it was redirected to. The
+# spider asks it before building the Request of a link, so that the links to
+# seen articles (most of them on a long crawl) cost no Request object.
+#
+# Only the seen hashes are compact: the pending requests are Request objects
+# in memory unless JOBDIR is set, in which case Scrapy queues them on disk and
+# the hashes are kept there too, for a crawl that resumes after a stop or a
+# crash.
+
+import os
+import logging
+from array import array
+
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.utils.job import job_dir
+
+from .mwapi import url_article
+from .visited import HashSet, article_title, title_hash
+
+SEEN_FILE = "wiki_titles.seen"  # in JOBDIR, sorted 64-bit hashes written when the spider closes
+SEEN_LOG = "wiki_titles.seen.log"  # in JOBDIR, 64-bit hashes added since, written as they are added
+
+
+class WikiTitleDupeFilter(BaseDupeFilter):
+    # Requests of the wiki articles (URLs of mwapi.article_url(), in any
+    # fetch mode) are keyed by title, the others by the first 8 bytes of
+    # their fingerprint. With JOBDIR every new hash is appended to SEEN_LOG
+    # at once (a crash of the process loses none of them), and merged into SEEN_FILE when
+    # the spider closes.
+
+    def __init__(self, fingerprinter, path=None, debug=False, stats=None):
+        self.fingerprinter = fingerprinter
+        self.debug = debug
+        self.stats = stats
+        self.logdupes = True
+        self.logger = logging.getLogger(__name__)
+        self.file = os.path.join(path, SEEN_FILE) if path else None
+        self.log_file = os.path.join(path, SEEN_LOG) if path else None
+        self.fout = None
+        if self.file and os.path.exists(self.file):
+            self.hashes = HashSet.load(self.file)
+        else:
+            self.hashes = HashSet()
+        if self.log_file:
+            self._replay_log()
+            self.fout = open(self.log_file, 'ab', buffering=0)
+
+    def _replay_log(self) -> None:
+        try:
+            with open(self.log_file, 'rb') as fin:
+                data = fin.read()
+        except FileNotFoundError:
+            return
+        logged = array('Q')
+        logged.frombytes(data[:len(data) - len(data) % 8])  # without a hash cut by a crash
+        for h in logged:
+            self.hashes.add(h)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        df = cls(crawler.request_fingerprinter, job_dir(crawler.settings),
+                 crawler.settings.getbool("DUPEFILTER_DEBUG"), crawler.stats)
+        if crawler.spider is not None:
+            crawler.spider.article_filter = df  # pre-filter of WikiMathSpider.parse
+        return df
+
+    def article_seen(self, article: str) -> bool:
+        """Whether a request of the article href '/wiki/<title>' was seen, without recording it"""
+        return title_hash(article_title(article)) in self.hashes
+
+    def request_key(self, request) -> int:
+        article = url_article(request.url)
+        if article is not None:
+            return title_hash(article_title(article))
+        return int.from_bytes(self.fingerprinter.fingerprint(request)[:8], 'little')
+
+    def request_seen(self, request) -> bool:
+        h = self.request_key(request)
+        if not self.hashes.add(h):
+            return True
+        if self.fout is not None:
+            self.fout.write(array('Q', (h,)).tobytes())
+        return False
+
+    def close(self, reason):
+        if self.fout is not None:
+            self.hashes.save(self.file)
+            self.fout.truncate(0)  # all in SEEN_FILE now
+            self.fout.close()
+            self.fout = None
+
+    def log(self, request, spider):
+        if self.debug:
+            self.logger.debug("Filtered duplicate request: %(request)s", {"request": request}, extra={"spider": spider})
+        elif self.logdupes:
+            self.logger.debug("Filtered duplicate request: %(request)s - no more duplicates will be shown"
+                              " (see DUPEFILTER_DEBUG to show all duplicates)", {"request": request}, extra={"spider": spider})
+            self.logdupes = False
+        if self.stats is not None:
+            self.stats.inc_value("dupefilter/filtered", spider=spider)
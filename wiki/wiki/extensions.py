@@ -0,0 +1,51 @@
+# Scrapy extensions of the wiki project
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+from scrapy import signals
+from twisted.internet import task
+
+from .metrics import STATS_INTERVAL, StatsReporter, summary
+
+
+class WikiMetricsExtension:
+    # Reports the stage times of the spider (spider.metrics, see
+    # wiki/metrics.py) every WIKI_STATS_INTERVAL seconds and when it closes:
+    # copied into the Scrapy stats as wiki/<stage>/count, total_s, mean_ms,
+    # p50_ms and p99_ms, written to the WIKI_STATS_FILE JSON file and served
+    # on http://127.0.0.1:<WIKI_METRICS_PORT>/metrics if these are set.
+
+    def __init__(self, stats, reporter, interval):
+        self.stats = stats
+        self.reporter = reporter
+        self.interval = interval
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        reporter = StatsReporter(settings.get("WIKI_STATS_FILE"), settings.getint("WIKI_METRICS_PORT") or None)
+        s = cls(crawler.stats, reporter, settings.getfloat("WIKI_STATS_INTERVAL", STATS_INTERVAL))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def report(self, spider):
+        snapshot = spider.metrics.snapshot()
+        for stage, values in summary(snapshot)["stages"].items():
+            for name, value in values.items():
+                self.stats.set_value(f"wiki/{stage}/{name}", value, spider=spider)
+        self.reporter.report(snapshot)
+
+    def spider_opened(self, spider):
+        if hasattr(spider, "metrics"):
+            self.task = task.LoopingCall(self.report, spider)
+            self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.task is not None:
+            if self.task.running:
+                self.task.stop()
+            self.report(spider)
+        self.reporter.close()
@@ -0,0 +1,277 @@
+# Math-aware text extraction shared by all crawlers
+#
+# The original recursive extract_text_with_math called find_all('math') and
+# find_all('span', class_='texhtml') on every node it visited. The functions
+# below produce the same output while visiting each node of the article once.
+#
+# The citation sections are not removed from the tree either: a Cut marks the
+# first of them and everything after it is skipped while walking, as
+# extract() on every following tag would (the strings of the elements before
+# the cut stay, extract() was only called on tags).
+
+import re
+from collections import namedtuple
+
+import bs4
+from bs4 import NavigableString, CData
+
+
+# parenthesis_regex = re.compile(r'\(.+?\)')  # to remove parenthesis content
+citations_regex = re.compile(r'\[.+?\]')  # to remove citations, e.g. [1]
+
+# A formula of the extracted text: offset of its opening $ in the text, display
+# (block) or inline, source element ('math' or 'texhtml') and LaTeX code
+Formula = namedtuple('Formula', ['offset', 'display', 'source', 'latex'])
+
+
+class MathSegment:
+    """Rendered formula, $latex$"""
+    __slots__ = ('text', 'formula')
+
+    def __init__(self, formula):
+        self.text = f"${formula.latex}$"
+        self.formula = formula
+
+
+def remove_citations(text: str, formulas: list):
+    """citations_regex.sub('', text), with the offsets of its formulas moved accordingly"""
+    removed = [m.span() for m in citations_regex.finditer(text)]
+    if not removed:
+        return text, formulas
+    moved = []
+    for formula in formulas:
+        shift = sum(min(end, formula.offset) - start for start, end in removed if start < formula.offset)
+        moved.append(formula._replace(offset=formula.offset - shift))
+    return citations_regex.sub('', text), moved
+
+
+def render_segments(segments, collapsed_text) -> tuple:
+    """(text, formulas) of a list of str / MathSegment / collapsed subtree segments"""
+    out = []
+    formulas = []
+    length = 0
+    for segment in segments:
+        if isinstance(segment, str):
+            text = segment
+        elif isinstance(segment, MathSegment):
+            text = segment.text
+            formulas.append(segment.formula._replace(offset=length))
+        else:
+            text = collapsed_text(segment)
+        out.append(text)
+        length += len(text)
+    return "".join(out), formulas
+
+
+class Cut:
+    """Everything from marker on, in document order, is left out"""
+
+    def __init__(self, marker: bs4.element.Tag):
+        self.marker = marker
+        self.ancestors = {id(parent) for parent in marker.parents}
+
+
+def _children(element: bs4.element.Tag, cut):
+    """Yield (child, kept) for the children of element"""
+    if cut is None or id(element) not in cut.ancestors:
+        for child in element.contents:
+            yield child, True
+        return
+    removing = False
+    for child in element.contents:
+        if child is cut.marker:
+            removing = True
+        # strings are not extracted, they stay in place
+        yield child, not (removing and not isinstance(child, str))
+        if id(child) in cut.ancestors:
+            removing = True
+
+
+def get_text(element: bs4.element.Tag, cut=None) -> str:
+    """element.get_text() without what comes after cut"""
+    if cut is None or id(element) not in cut.ancestors:
+        return element.get_text()
+    types = _text_types(element)
+    return "".join(s for s in _strings(element, cut) if type(s) in types)
+
+
+def _strings(element: bs4.element.Tag, cut):
+    for child, kept in _children(element, cut):
+        if isinstance(child, str):
+            yield child
+        elif kept:
+            yield from _strings(child, cut)
+
+
+def _is_math(element: bs4.element.Tag) -> bool:
+    return element.name == 'math'
+
+
+def _is_texhtml(element: bs4.element.Tag) -> bool:
+    return element.name == "span" and "texhtml" in element.get("class", [])
+
+
+def _text_types(element: bs4.element.Tag):
+    """String classes taken into account by element.get_text()"""
+    types = getattr(element, 'interesting_string_types', None)
+    if types is None:
+        return (NavigableString, CData)
+    if isinstance(types, type):
+        return (types,)
+    return types
+
+
+class _Collapsed:
+    """Placeholder for a math-free subtree, rendered as its stripped get_text()"""
+    __slots__ = ('element', 'start', 'end')
+
+    def __init__(self, element, start, end):
+        self.element = element
+        self.start = start
+        self.end = end
+
+
+class _SinglePassExtractor:
+    """Walk a subtree once and emit text / $alttext$ / $texhtml$ segments in document order.
+
+    Every node is tentatively expanded into segments. Once a tag turns out to
+    contain no math, its segments are replaced by a single placeholder that
+    points into the flat list of strings seen so far, so that only maximal
+    math-free subtrees are joined (once) when the text is rendered.
+    """
+
+    def __init__(self, cut=None):
+        self.cut = cut
+        self.segments = []  # str, MathSegment or _Collapsed, in document order
+        self.strings = []  # every NavigableString met outside of formulas
+        self.nested_paragraphs = []  # <p> tags found below the root
+        self.formulas = []  # <math> tags found below the root
+
+    def walk(self, element: bs4.element.Tag) -> bool:
+        """Expand the children of element, return True if it contains math"""
+        mark = len(self.segments)
+        start = len(self.strings)
+        has_math = False
+        for child, kept in _children(element, self.cut):
+            if not kept:
+                pass
+            elif isinstance(child, str):  # Regular text
+                self.segments.append(child)
+                self.strings.append(child)
+            elif _is_math(child):  # MathML element
+                has_math = True
+                self.formulas.append(child)
+                alttext = child.get('alttext')
+                if alttext:
+                    self.segments.append(MathSegment(Formula(0, child.get('display') == 'block', 'math', alttext)))
+            elif _is_texhtml(child):  # LaTeX element
+                has_math = True
+                self.segments.append(MathSegment(Formula(0, False, 'texhtml', get_text(child, self.cut))))
+            else:
+                if child.name == 'p':
+                    self.nested_paragraphs.append(child)
+                if self.walk(child):
+                    has_math = True
+        if not has_math:
+            # Regular HTML element without math
+            del self.segments[mark:]
+            self.segments.append(_Collapsed(element, start, len(self.strings)))
+        return has_math
+
+    def _collapsed_text(self, segment: _Collapsed) -> str:
+        types = _text_types(segment.element)
+        text = "".join(s for s in self.strings[segment.start:segment.end] if type(s) in types)
+        return text.strip()
+
+    def render(self) -> tuple:
+        """(text, formulas)"""
+        return render_segments(self.segments, self._collapsed_text)
+
+
+def extract_text_with_math(element: bs4.element.Tag, cut=None) -> str:
+    """Plain text of element where formulas are replaced by $latex$"""
+    if isinstance(element, str):  # Regular text
+        return element
+    if _is_math(element):  # MathML element
+        alttext = element.get('alttext')
+        return f"${alttext}$" if alttext else ""
+    if _is_texhtml(element):  # LaTeX element
+        return f"${get_text(element, cut)}$"
+
+    extractor = _SinglePassExtractor(cut)
+    extractor.walk(element)
+    return extractor.render()[0]
+
+
+def _paragraph_text(element: bs4.element.Tag, visited_math_elements: set, cut):
+    """Cleaned text of a <p> and its formulas, also returns the <p> tags nested in it"""
+    extractor = _SinglePassExtractor(cut)
+    extractor.walk(element)
+    visited_math_elements.update(extractor.formulas)
+    text, formulas = remove_citations(*extractor.render())
+    return text, formulas, extractor.nested_paragraphs
+
+
+class ArticleText:
+    """Lines of the article text and the formulas found in them"""
+
+    def __init__(self):
+        self.lines = []
+        self.formulas = []
+        self.length = 0
+
+    def add(self, text: str, formulas: list = ()) -> None:
+        self.formulas.extend(f._replace(offset=self.length + f.offset) for f in formulas)
+        self.lines.append(text + '\n')
+        self.length += len(text) + 1
+
+    def result(self) -> tuple:
+        return "".join(self.lines), self.formulas
+
+
+def extract_article_text(content: bs4.element.Tag, cut=None) -> str:
+    return extract_article(content, cut)[0]
+
+
+def extract_article(content: bs4.element.Tag, cut=None) -> tuple:
+    """Text of every <p> and standalone <math> below content, one per line.
+
+    Equivalent to iterating over content.find_all(['p', 'math']) and skipping
+    the formulas already rendered inside a paragraph, assuming (as in
+    MediaWiki output) that formula markup never contains <p> or <math> tags.
+    Like before, a standalone formula is skipped when an equal <math> tag
+    (same markup) appeared in an earlier paragraph.
+
+    Returns (text, formulas), formulas being the Formula of every $latex$
+    of the text, in order.
+    """
+    out_text = ArticleText()
+    visited_math_elements = set()
+
+    def add_paragraph(elem):
+        text, formulas, nested_paragraphs = _paragraph_text(elem, visited_math_elements, cut)
+        if text:
+            out_text.add(text, formulas)  # extra line between paragraphs
+        # nested <p> are listed again by find_all(['p', 'math'])
+        for _nested in nested_paragraphs:
+            text, formulas, _ = _paragraph_text(_nested, visited_math_elements, cut)
+            if text:
+                out_text.add(text, formulas)
+
+    def visit(element):
+        for elem, kept in _children(element, cut):
+            if not kept or isinstance(elem, str):
+                continue
+            if elem.name == 'p':
+                add_paragraph(elem)
+            elif elem.name == 'math':  # latex math equation
+                if elem in visited_math_elements:
+                    continue
+                latex_code = elem.get('alttext').strip()
+                if latex_code:
+                    out_text.add(f"${latex_code}$", [Formula(0, elem.get('display') == 'block', 'math', latex_code)])
+            else:
+                visit(elem)
+
+    visit(content)
+    return out_text.result()
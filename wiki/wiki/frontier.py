@@ -0,0 +1,136 @@
+# Disk-backed URL frontier shared by the crawlers
+#
+# The queue lives in a SQLite file, only SQLite's page cache is held in
+# memory, so the frontier stays small even with millions of pending articles,
+# and a new session reopens the file instead of reloading a text file.
+#
+# Dedup keeps a 64-bit hash of every URL ever pushed (an integer primary key,
+# 8 bytes per URL on disk). A collision drops a URL with a probability of
+# about 1e-7 at 6M articles.
+#
+# URLs handed out by pop() stay in an in-flight table until done() or retry(),
+# they go back to the queue when the file is reopened after a crash.
+#
+# A ranked frontier hands out the URL of highest score first (then the oldest),
+# the scores are set by rescore(), e.g. from the link graph (see linkgraph.py).
+# New URLs start at 0.
+#
+# Changes are appended to SQLite's write-ahead log and become durable at
+# commit(), so a checkpoint costs in proportion to the URLs pushed and popped
+# since the previous one. close() folds the write-ahead log back into the file.
+
+import sqlite3
+import hashlib
+
+
+def url_hash(url: str) -> int:
+    """Signed 64-bit hash of a URL, fits a SQLite INTEGER"""
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+_RESCORE_CHUNK = 10000  # pending URLs rescored at once
+
+
+class Frontier:
+    """FIFO queue of URLs with O(1) dedup, stored in a SQLite file, optionally ordered by score"""
+
+    def __init__(self, path: str, ranked: bool = False):
+        self.path = path
+        self.ranked = ranked
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS seen (h INTEGER PRIMARY KEY)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS queue (seq INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS in_flight (url TEXT PRIMARY KEY)")
+        if "score" not in [row[1] for row in self.db.execute("PRAGMA table_info(queue)")]:
+            self.db.execute("ALTER TABLE queue ADD COLUMN score REAL NOT NULL DEFAULT 0")  # file of an older version
+        if ranked:
+            self.db.execute("CREATE INDEX IF NOT EXISTS queue_rank ON queue (score DESC, seq)")
+        # URLs taken by a previous session that did not finish them
+        self.db.execute("INSERT INTO queue (url) SELECT url FROM in_flight")
+        self.db.execute("DELETE FROM in_flight")
+        self.db.commit()
+        self.size = self.db.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+
+    def __len__(self) -> int:
+        """Number of pending URLs, in-flight ones excluded"""
+        return self.size
+
+    def __contains__(self, url: str) -> bool:
+        """True if url was ever pushed"""
+        return self.db.execute("SELECT 1 FROM seen WHERE h = ?", (url_hash(url),)).fetchone() is not None
+
+    def is_new(self) -> bool:
+        """True if nothing was ever pushed, e.g. to import a previous pending_urls.txt"""
+        return self.db.execute("SELECT 1 FROM seen LIMIT 1").fetchone() is None
+
+    def push(self, url: str) -> bool:
+        """Queue url unless it was already pushed, return True if queued"""
+        if self.db.execute("INSERT OR IGNORE INTO seen (h) VALUES (?)", (url_hash(url),)).rowcount == 0:
+            return False
+        self.db.execute("INSERT INTO queue (url) VALUES (?)", (url,))
+        self.size += 1
+        return True
+
+    def push_many(self, urls) -> int:
+        """Queue the new URLs of urls, return how many were queued"""
+        return sum(self.push(url) for url in urls)
+
+    def pop(self):
+        """Oldest pending URL (of highest score if ranked), None if the queue is empty"""
+        order = "score DESC, seq" if self.ranked else "seq"
+        row = self.db.execute("SELECT seq, url FROM queue ORDER BY {} LIMIT 1".format(order)).fetchone()
+        if row is None:
+            return None
+        seq, url = row
+        self.db.execute("DELETE FROM queue WHERE seq = ?", (seq,))
+        self.db.execute("INSERT OR IGNORE INTO in_flight (url) VALUES (?)", (url,))
+        self.size -= 1
+        return url
+
+    def done(self, url: str) -> None:
+        """url was crawled, forget it"""
+        self.db.execute("DELETE FROM in_flight WHERE url = ?", (url,))
+
+    def retry(self, url: str) -> None:
+        """Put an in-flight url back at the end of the queue"""
+        self.done(url)
+        self.db.execute("INSERT INTO queue (url) VALUES (?)", (url,))
+        self.size += 1
+
+    def rescore(self, scores_of) -> None:
+        """Set the score of every pending URL, scores_of maps a list of URLs to their scores"""
+        last_seq = -1
+        while True:
+            rows = self.db.execute("SELECT seq, url FROM queue WHERE seq > ? ORDER BY seq LIMIT ?",
+                                   (last_seq, _RESCORE_CHUNK)).fetchall()
+            if not rows:
+                return
+            seqs = [seq for seq, _ in rows]
+            scores = scores_of([url for _, url in rows])
+            self.db.executemany("UPDATE queue SET score = ? WHERE seq = ?", zip(map(float, scores), seqs))
+            last_seq = seqs[-1]
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.db.close()
+
+
+def checkpoint(frontier: Frontier, visited, *sinks) -> None:
+    """Make the crawl state durable, the output sinks (and link graph) first, then the visited log
+
+    A crash after a checkpoint brings back the frontier as it was then, its
+    URLs popped since are crawled again and the visited ones give no new text.
+    The visited log only gets the URLs of pages flushed to the sinks: a page
+    whose text was still in a sink buffer is crawled again (and written twice
+    if the buffer happened to fill up before the crash).
+    """
+    for sink in sinks:
+        sink.flush()
+    visited.sync()
+    frontier.commit()
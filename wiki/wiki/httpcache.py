@@ -0,0 +1,138 @@
+# On-disk HTTP response cache shared by the crawlers
+#
+# Pages are stored in a SQLite file keyed by normalized URL, with their ETag,
+# Last-Modified, zlib-compressed HTML and the article links found in them.
+# A refresh crawl sends conditional requests: on a 304 the cached links are
+# reused and the page is not parsed again. In replay mode nothing is
+# downloaded, the cached pages are served as if they came from the server
+# (offline benchmarks, parser experiments).
+
+import json
+import time
+import zlib
+import sqlite3
+from urllib.parse import urlsplit, urlunsplit
+
+from .visited import article_title
+
+CONDITIONAL_HEADERS = ('If-None-Match', 'If-Modified-Since')
+
+
+def cache_key(url: str) -> str:
+    """Normalized URL, e.g. 'https://EN.wikipedia.org/wiki/euler%27s_identity#x' -> "https://en.wikipedia.org/wiki/Euler's_identity" """
+    parts = urlsplit(url)
+    path = parts.path
+    if path.startswith('/wiki/'):
+        path = '/wiki/' + article_title(path)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ''))
+
+
+class CacheEntry:
+    __slots__ = ('url', 'status', 'etag', 'last_modified', 'body', 'links')
+
+    def __init__(self, url, status, etag, last_modified, body, links):
+        self.url = url
+        self.status = status
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body  # compressed HTML
+        self.links = json.loads(links) if links is not None else None
+
+    def html(self) -> str:
+        return zlib.decompress(self.body).decode('utf-8')
+
+    def conditional_headers(self) -> dict:
+        """Headers of a request that only gets the page if it changed"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """Cached pages in a SQLite file, several processes can share it"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                        "key TEXT PRIMARY KEY, url TEXT NOT NULL, status INTEGER NOT NULL, "
+                        "etag TEXT, last_modified TEXT, body BLOB NOT NULL, links TEXT, fetched REAL NOT NULL)")
+        self.db.commit()
+
+    def get(self, url: str):
+        """CacheEntry of url, None if it is not cached"""
+        row = self.db.execute("SELECT url, status, etag, last_modified, body, links FROM responses WHERE key = ?",
+                              (cache_key(url),)).fetchone()
+        return CacheEntry(*row) if row is not None else None
+
+    def put(self, url: str, status: int, etag, last_modified, html: str, links: list = None) -> None:
+        body = zlib.compress(html.encode('utf-8'))
+        links = json.dumps(links) if links is not None else None
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (cache_key(url), url, status, etag, last_modified, body, links, time.time()))
+
+    def set_links(self, url: str, links: list) -> None:
+        """Keep the article links of a cached page, so that a 304 needs no parsing"""
+        with self.db:
+            self.db.execute("UPDATE responses SET links = ? WHERE key = ?", (json.dumps(links), cache_key(url)))
+
+    def touch(self, url: str) -> None:
+        """The cached page was checked against the server"""
+        with self.db:
+            self.db.execute("UPDATE responses SET fetched = ? WHERE key = ?", (time.time(), cache_key(url)))
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class Fetched:
+    """Result of fetch(), links is set on a 304 when the cached page has them, retry_after on a 429 or 503"""
+    __slots__ = ('status', 'html', 'links', 'retry_after')
+
+    def __init__(self, status, html, links=None, retry_after=None):
+        self.status = status
+        self.html = html
+        self.links = links
+        self.retry_after = retry_after
+
+
+def fetch(session, url: str, cache: ResponseCache = None, replay: bool = False, headers: dict = None):
+    """GET url with a requests.Session (or requests) through cache, None on a cache miss in replay mode
+
+    A 304 gives Fetched(304, None, links), a page served from the cache
+    without links in it gives Fetched(200, html). A 304 with no cached page
+    to serve is a miss, the page is requested again without conditional
+    headers (a second 304 gives Fetched(502, None)). New 200 pages are
+    stored, without links until set_links().
+    """
+    entry = cache.get(url) if cache is not None else None
+    if replay:
+        if entry is None:
+            return None
+        return Fetched(entry.status, entry.html())
+
+    headers = dict(headers or {})
+    if entry is not None:
+        headers.update(entry.conditional_headers())
+    r = session.get(url, headers=headers)
+    if r.status_code == 304 and entry is not None:
+        cache.touch(url)
+        if entry.links is not None:
+            return Fetched(304, None, entry.links)
+        return Fetched(entry.status, entry.html())
+    if r.status_code == 304:
+        # nothing cached (e.g. conditional headers of the caller): ask for the page itself
+        headers = {name: value for name, value in headers.items() if name.title() not in CONDITIONAL_HEADERS}
+        r = session.get(url, headers=headers)
+        if r.status_code == 304:
+            # invalid answer to an unconditional request: a failed request (Bad Gateway), retried by the crawler
+            return Fetched(502, None)
+    if r.status_code == 200 and cache is not None:
+        cache.put(url, r.status_code, r.headers.get('ETag'), r.headers.get('Last-Modified'), r.text)
+    return Fetched(r.status_code, r.text, retry_after=r.headers.get('Retry-After'))
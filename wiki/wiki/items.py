@@ -12,4 +12,5 @@ class WikiItem(scrapy.Item):
     key = scrapy.Field()
     url = scrapy.Field()
     text = scrapy.Field()
+    formulas = scrapy.Field()  # {"offset", "display", "source", "latex"} of every formula of text
 
@@ -0,0 +1,188 @@
+# Link graph of the crawled articles, and the priority of the pending ones
+#
+# Articles are nodes with dense integer ids, one per title (see
+# visited.article_title), kept in a SQLite file <prefix>.sqlite. The links of
+# every crawled page are appended to <prefix>.edges as int32 pairs (source id,
+# target id), 8 bytes per link. csr() turns the log into CSR arrays, sorted
+# and without duplicate links, and export_csr() saves them with the titles.
+#
+# flush() is called by the crawlers before each checkpoint, like the output
+# sinks: the new titles are committed first, then the links of the pages
+# crawled since the previous flush are appended, so that the log only holds
+# committed ids. A page whose links were lost in a crash is crawled again.
+#
+# Ranker reorders a ranked Frontier by the in-degree or the PageRank of the
+# pending articles, computed with NumPy over the whole graph every interval
+# seconds; PageRank starts from the previous ranking, so only a few power
+# iterations are needed when the graph grew a little.
+
+import os
+import time
+import sqlite3
+
+import numpy as np
+
+from .visited import article_title
+
+PRIORITIES = ['bfs', 'indegree', 'pagerank']
+DEFAULT_PRIORITY = 'bfs'
+RANK_INTERVAL = 60  # seconds between two rankings of the pending URLs
+DAMPING = 0.85
+TOLERANCE = 1e-6  # L1 change of the PageRank vector between two iterations
+MAX_ITERATIONS = 50
+_EDGE = np.dtype([('source', '<i4'), ('target', '<i4')])
+_LOOKUP_CHUNK = 500  # titles per SQLite query, below its limit of variables
+
+
+class LinkGraph:
+    """Append-only directed graph of the article links"""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.db = sqlite3.connect(prefix + '.sqlite')
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS nodes (id INTEGER PRIMARY KEY, title TEXT NOT NULL UNIQUE)")
+        self.db.commit()
+        self.num_nodes = self.db.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+        self.edges_file = prefix + '.edges'
+        self.fout = open(self.edges_file, 'ab')
+        # a link cut by a crash is dropped
+        self.fout.truncate(self.fout.tell() - self.fout.tell() % _EDGE.itemsize)
+        self.fout.seek(0, os.SEEK_END)
+        self.pending = []  # (source, target) ids of the links added since the last flush
+
+    def node_id(self, url: str) -> int:
+        """Id of the article of url, a new one if it was never seen"""
+        title = article_title(url)
+        row = self.db.execute("SELECT id FROM nodes WHERE title = ?", (title,)).fetchone()
+        if row is not None:
+            return row[0]
+        self.db.execute("INSERT INTO nodes (id, title) VALUES (?, ?)", (self.num_nodes, title))
+        self.num_nodes += 1
+        return self.num_nodes - 1
+
+    def add(self, source: str, targets) -> None:
+        """Links of the crawled page source to the hrefs targets"""
+        source_id = self.node_id(source)
+        for target in targets:
+            target_id = self.node_id(target)
+            if target_id != source_id:
+                self.pending.append((source_id, target_id))
+
+    def node_ids(self, urls: list) -> list:
+        """Ids of the articles of urls, None for the unknown ones"""
+        titles = [article_title(url) for url in urls]
+        ids = {}
+        for start in range(0, len(titles), _LOOKUP_CHUNK):
+            chunk = titles[start:start + _LOOKUP_CHUNK]
+            ids.update(self.db.execute("SELECT title, id FROM nodes WHERE title IN ({})".format(
+                ",".join("?" * len(chunk))), chunk))
+        return [ids.get(title) for title in titles]
+
+    def edges(self) -> np.ndarray:
+        """All the links, those not flushed yet included, as a (source, target) record array"""
+        self.fout.flush()
+        logged = np.fromfile(self.edges_file, dtype=_EDGE)
+        return np.concatenate([logged, np.array(self.pending, dtype=_EDGE)])
+
+    def csr(self) -> tuple:
+        """(indptr, indices): the targets of node i are indices[indptr[i]:indptr[i + 1]], sorted, once each"""
+        edges = self.edges()
+        n = self.num_nodes
+        keys = np.unique(edges['source'].astype(np.int64) * n + edges['target'])
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // n, minlength=n), out=indptr[1:])
+        return indptr, (keys % n).astype(np.int32)
+
+    def titles(self):
+        """Titles in the order of their ids"""
+        for (title,) in self.db.execute("SELECT title FROM nodes ORDER BY id"):
+            yield title
+
+    def export_csr(self, path: str) -> tuple:
+        """Save the CSR arrays to <path>.npz and the titles, one per line, to <path>.titles.txt"""
+        indptr, indices = self.csr()
+        np.savez(path + '.npz', indptr=indptr, indices=indices)
+        with open(path + '.titles.txt', 'w', encoding='utf-8') as fout:
+            for title in self.titles():
+                fout.write(title + '\n')
+        return indptr, indices
+
+    def flush(self) -> None:
+        self.db.commit()
+        if self.pending:
+            self.fout.write(np.array(self.pending, dtype=_EDGE).tobytes())
+            self.pending = []
+        self.fout.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.fout.close()
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.db.close()
+
+
+def in_degrees(indptr: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    return np.bincount(indices, minlength=len(indptr) - 1).astype(np.float64)
+
+
+def pagerank(indptr: np.ndarray, indices: np.ndarray, start: np.ndarray = None, damping: float = DAMPING,
+             tolerance: float = TOLERANCE, max_iterations: int = MAX_ITERATIONS) -> np.ndarray:
+    """PageRank of the nodes of a CSR graph, by power iteration from start (uniform by default)
+
+    The nodes without links (e.g. the articles not crawled yet) spread their
+    rank over all the nodes. Nodes added since start begin at 1 / n.
+    """
+    n = len(indptr) - 1
+    if n == 0:
+        return np.empty(0)
+    out_degrees = np.diff(indptr)
+    sources = np.repeat(np.arange(n), out_degrees)
+    dangling = out_degrees == 0
+    rank = np.full(n, 1.0 / n)
+    if start is not None and len(start) > 0:
+        rank[:len(start)] = start[:n]
+        rank /= rank.sum()
+    for _ in range(max_iterations):
+        share = rank / np.maximum(out_degrees, 1)
+        new_rank = damping * np.bincount(indices, weights=share[sources], minlength=n)
+        new_rank += (1 - damping + damping * rank[dangling].sum()) / n
+        change = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if change < tolerance:
+            break
+    return rank
+
+
+class Ranker:
+    """Gives the pending URLs of a ranked Frontier the score of their article in the link graph"""
+
+    def __init__(self, frontier, graph: LinkGraph, priority: str, interval: float = RANK_INTERVAL):
+        self.frontier = frontier
+        self.graph = graph
+        self.priority = priority
+        self.interval = interval
+        self.last_rank = time.monotonic()
+        self.scores = None  # of the last ranking, PageRank starts from it
+
+    def rank(self) -> None:
+        start = time.monotonic()
+        indptr, indices = self.graph.csr()
+        if self.priority == 'pagerank':
+            self.scores = pagerank(indptr, indices, self.scores)
+        else:
+            self.scores = in_degrees(indptr, indices)
+
+        def scores_of(urls):
+            return [self.scores[i] if i is not None else 0.0 for i in self.graph.node_ids(urls)]
+
+        self.frontier.rescore(scores_of)
+        self.last_rank = time.monotonic()
+        print("Ranked {} pending URLs by {} in {:.2f}s ({} articles, {} links)".format(
+            len(self.frontier), self.priority, self.last_rank - start, len(indptr) - 1, len(indices)))
+
+    def maybe_rank(self) -> None:
+        """Rank again if the last ranking is older than interval"""
+        if time.monotonic() - self.last_rank > self.interval:
+            self.rank()
@@ -0,0 +1,241 @@
+# lxml port of extractor.py
+#
+# Works on lxml.html trees instead of BeautifulSoup ones and reproduces the
+# output of the html.parser based extraction, including BeautifulSoup's
+# whitespace normalization and get_text() rules for comments and
+# <style> / <script> / <template> content.
+#
+# The citation sections are not removed from the tree: a Cut marks the first
+# of them and everything after it is skipped while walking, except the text
+# that belongs to elements before the cut (BeautifulSoup only extracts tags).
+
+import lxml.etree
+import lxml.html
+
+from .extractor import Formula, ArticleText, MathSegment, remove_citations, render_segments
+
+
+# tags whose strings get a dedicated NavigableString class in BeautifulSoup
+_STRING_CONTAINERS = ('style', 'script', 'template')
+_TEXT = 'text'
+# tags in which BeautifulSoup keeps whitespace-only strings untouched
+_PRESERVE_WHITESPACE = ('pre', 'textarea')
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+
+class Cut:
+    """Everything from marker on, in document order, is left out"""
+
+    def __init__(self, marker):
+        self.marker = marker
+        self.ancestors = set(marker.iterancestors())
+
+
+def _is_element(element) -> bool:
+    # comments and processing instructions are elements with a non-str tag
+    return isinstance(element.tag, str)
+
+
+def _children(element, cut):
+    """Yield (child, kept) for the children of element"""
+    if cut is None or element not in cut.ancestors:
+        for child in element:
+            yield child, True
+        return
+    removing = False
+    for child in element:
+        if child is cut.marker:
+            removing = True
+        # comments are strings for BeautifulSoup, they stay in place
+        yield child, not (removing and _is_element(child))
+        if child in cut.ancestors:
+            removing = True
+
+
+def _is_math(element) -> bool:
+    return element.tag == 'math'
+
+
+def _is_texhtml(element) -> bool:
+    return element.tag == "span" and "texhtml" in element.get("class", "").split()
+
+
+def _inner_kind(element, kind: str) -> str:
+    """String class of the text directly inside element"""
+    return element.tag if element.tag in _STRING_CONTAINERS else kind
+
+
+def _inner_preserve(element, preserve: bool) -> bool:
+    return preserve or element.tag in _PRESERVE_WHITESPACE
+
+
+def _accepted_kind(element) -> str:
+    """String class taken into account by get_text() on element"""
+    return element.tag if element.tag in _STRING_CONTAINERS else _TEXT
+
+
+def _bs4_string(text: str, preserve: bool) -> str:
+    """BeautifulSoup turns whitespace-only strings into a single newline or space"""
+    if preserve or text.strip(_ASCII_SPACES):
+        return text
+    return "\n" if "\n" in text else " "
+
+
+def _strings(element, kind: str, preserve: bool, cut):
+    """Yield (kind, text) for every string below element, in document order"""
+    inner = _inner_kind(element, kind)
+    inner_preserve = _inner_preserve(element, preserve)
+    if element.text:
+        yield inner, _bs4_string(element.text, inner_preserve)
+    for child, kept in _children(element, cut):
+        if kept and _is_element(child):
+            yield from _strings(child, inner, inner_preserve, cut)
+        if child.tail:
+            yield inner, _bs4_string(child.tail, inner_preserve)
+
+
+def get_text(element, kind: str = _TEXT, preserve: bool = False, cut=None) -> str:
+    """Equivalent of BeautifulSoup's Tag.get_text()"""
+    accepted = _accepted_kind(element)
+    return "".join(text for _kind, text in _strings(element, kind, preserve, cut) if _kind == accepted)
+
+
+class _Collapsed:
+    """Placeholder for a math-free subtree, rendered as its stripped get_text()"""
+    __slots__ = ('element', 'start', 'end')
+
+    def __init__(self, element, start, end):
+        self.element = element
+        self.start = start
+        self.end = end
+
+
+class _SinglePassExtractor:
+    """Same algorithm as extractor._SinglePassExtractor, on text / tail strings"""
+
+    def __init__(self, cut=None):
+        self.cut = cut
+        self.segments = []  # str, MathSegment or _Collapsed, in document order
+        self.strings = []  # (kind, text) met outside of formulas
+        self.nested_paragraphs = []  # <p> tags found below the root
+        self.formulas = []  # <math> tags found below the root
+
+    def _add_string(self, kind, text):
+        self.segments.append(text)
+        self.strings.append((kind, text))
+
+    def walk(self, element, kind: str = _TEXT, preserve: bool = False) -> bool:
+        """Expand the children of element, return True if it contains math"""
+        mark = len(self.segments)
+        start = len(self.strings)
+        inner = _inner_kind(element, kind)
+        inner_preserve = _inner_preserve(element, preserve)
+        has_math = False
+        if element.text:
+            self._add_string(inner, _bs4_string(element.text, inner_preserve))
+        for child, kept in _children(element, self.cut):
+            if not kept:
+                pass
+            elif not _is_element(child):  # Comment, rendered like any other string
+                if child.text:
+                    self.segments.append(_bs4_string(child.text, inner_preserve))
+            elif _is_math(child):  # MathML element
+                has_math = True
+                self.formulas.append(child)
+                alttext = child.get('alttext')
+                if alttext:
+                    self.segments.append(MathSegment(Formula(0, child.get('display') == 'block', 'math', alttext)))
+            elif _is_texhtml(child):  # LaTeX element
+                has_math = True
+                latex = get_text(child, inner, inner_preserve, self.cut)
+                self.segments.append(MathSegment(Formula(0, False, 'texhtml', latex)))
+            else:
+                if child.tag == 'p':
+                    self.nested_paragraphs.append(child)
+                if self.walk(child, inner, inner_preserve):
+                    has_math = True
+            if child.tail:
+                self._add_string(inner, _bs4_string(child.tail, inner_preserve))
+        if not has_math:
+            # Regular HTML element without math
+            del self.segments[mark:]
+            self.segments.append(_Collapsed(element, start, len(self.strings)))
+        return has_math
+
+    def _collapsed_text(self, segment: _Collapsed) -> str:
+        accepted = _accepted_kind(segment.element)
+        text = "".join(s for _kind, s in self.strings[segment.start:segment.end] if _kind == accepted)
+        return text.strip()
+
+    def render(self) -> tuple:
+        """(text, formulas)"""
+        return render_segments(self.segments, self._collapsed_text)
+
+
+def extract_text_with_math(element, cut=None) -> str:
+    """Plain text of element where formulas are replaced by $latex$"""
+    if _is_math(element):  # MathML element
+        alttext = element.get('alttext')
+        return f"${alttext}$" if alttext else ""
+    if _is_texhtml(element):  # LaTeX element
+        return f"${get_text(element, cut=cut)}$"
+
+    extractor = _SinglePassExtractor(cut)
+    extractor.walk(element)
+    return extractor.render()[0]
+
+
+def _markup_key(element) -> bytes:
+    """Stand-in for BeautifulSoup's structural Tag equality"""
+    return lxml.etree.tostring(element, with_tail=False)
+
+
+def _paragraph_text(element, visited_math_elements: set, cut):
+    """Cleaned text of a <p> and its formulas, also returns the <p> tags nested in it"""
+    extractor = _SinglePassExtractor(cut)
+    extractor.walk(element)
+    visited_math_elements.update(_markup_key(m) for m in extractor.formulas)
+    text, formulas = remove_citations(*extractor.render())
+    return text, formulas, extractor.nested_paragraphs
+
+
+def extract_article_text(content, cut=None) -> str:
+    return extract_article(content, cut)[0]
+
+
+def extract_article(content, cut=None) -> tuple:
+    """(text, formulas) of every <p> and standalone <math> below content, one per line"""
+    out_text = ArticleText()
+    visited_math_elements = set()
+
+    def add_paragraph(elem):
+        text, formulas, nested_paragraphs = _paragraph_text(elem, visited_math_elements, cut)
+        if text:
+            out_text.add(text, formulas)  # extra line between paragraphs
+        # nested <p> are listed again by find_all(['p', 'math'])
+        for _nested in nested_paragraphs:
+            text, formulas, _ = _paragraph_text(_nested, visited_math_elements, cut)
+            if text:
+                out_text.add(text, formulas)
+
+    def visit(element):
+        for elem, kept in _children(element, cut):
+            if not kept or not _is_element(elem):
+                continue
+            if elem.tag == 'p':
+                add_paragraph(elem)
+            elif elem.tag == 'math':  # latex math equation
+                if _markup_key(elem) in visited_math_elements:
+                    continue
+                latex_code = elem.get('alttext').strip()
+                if latex_code:
+                    out_text.add(f"${latex_code}$", [Formula(0, elem.get('display') == 'block', 'math', latex_code)])
+            else:
+                visit(elem)
+
+    visit(content)
+    return out_text.result()
+
+
+def parse_document(html: str):
+    return lxml.html.document_fromstring(html)
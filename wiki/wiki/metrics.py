@@ -0,0 +1,224 @@
+# Timing of the crawl stages, and its reports
+#
+# Metrics keeps a histogram of the duration of every stage of a page: wait
+# (rate limiter), fetch, parse, links (filtering the article links), visited
+# (Ray visited actor query), frontier (queueing them), extract (text and
+# formulas), write (output sinks), and of the checkpoints. The buckets are fixed,
+# so the histograms of several workers add up: a snapshot is a plain dict,
+# the Ray workers send theirs to the driver and merge_snapshots() sums them.
+# Timing a stage costs a few microseconds, pages take milliseconds.
+#
+# StatsReporter writes the last snapshot, with estimated percentiles, to a
+# JSON file every interval seconds and/or serves it in the Prometheus text
+# format on http://127.0.0.1:<port>/metrics.
+#
+# PageProfiler profiles a random share of the pages with cProfile (a .prof
+# file per page, e.g. for snakeviz or pstats) or pyinstrument (an .html file
+# per page, requires pyinstrument).
+
+import os
+import re
+import json
+import time
+import random
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .visited import article_title
+
+BUCKETS = [0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]  # seconds
+STATS_INTERVAL = 10  # seconds between two writes of the stats file
+PROFILERS = ['cprofile', 'pyinstrument']
+DEFAULT_PROFILER = 'cprofile'
+METRICS_PREFIX = 'wiki_crawler'
+
+
+class Metrics:
+    """Histograms of the stage durations and counters of one process"""
+
+    def __init__(self):
+        self.buckets = {}  # stage -> counts per bucket of BUCKETS, then above the last one
+        self.sums = {}  # stage -> total seconds
+        self.counters = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        counts = self.buckets.get(stage)
+        if counts is None:
+            counts = self.buckets[stage] = [0] * (len(BUCKETS) + 1)
+            self.sums[stage] = 0.0
+        counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sums[stage] += seconds
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, snapshot: dict) -> None:
+        """Add the snapshot of another Metrics"""
+        for stage, histogram in snapshot["stages"].items():
+            counts = self.buckets.get(stage)
+            if counts is None:
+                counts = self.buckets[stage] = [0] * (len(BUCKETS) + 1)
+                self.sums[stage] = 0.0
+            for i, n in enumerate(histogram["buckets"]):
+                counts[i] += n
+            self.sums[stage] += histogram["sum"]
+        for name, n in snapshot["counters"].items():
+            self.count(name, n)
+
+    def snapshot(self) -> dict:
+        return {"stages": {stage: {"buckets": list(counts), "sum": self.sums[stage]} for stage, counts in self.buckets.items()},
+                "counters": dict(self.counters)}
+
+
+def merge_snapshots(snapshots) -> dict:
+    """Sum of the snapshots of several processes"""
+    merged = Metrics()
+    for snapshot in snapshots:
+        merged.merge(snapshot)
+    return merged.snapshot()
+
+
+def _percentile(counts: list, p: float) -> float:
+    """Upper bound of the bucket of the p-th percentile, in seconds"""
+    rank = p / 100 * sum(counts)
+    seen = 0
+    for i, n in enumerate(counts):
+        seen += n
+        if n and seen >= rank:
+            return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+    return 0.0
+
+
+def summary(snapshot: dict) -> dict:
+    """Count, total and mean time and p50/p99 of every stage, in milliseconds"""
+    stages = {}
+    for stage, histogram in snapshot["stages"].items():
+        count = sum(histogram["buckets"])
+        stages[stage] = {"count": count, "total_s": histogram["sum"], "mean_ms": 1000 * histogram["sum"] / max(count, 1),
+                         "p50_ms": 1000 * _percentile(histogram["buckets"], 50),
+                         "p99_ms": 1000 * _percentile(histogram["buckets"], 99)}
+    return {"time": time.time(), "stages": stages, "counters": snapshot["counters"], "histograms": snapshot["stages"]}
+
+
+def prometheus_text(snapshot: dict, prefix: str = METRICS_PREFIX) -> str:
+    """Snapshot in the Prometheus text exposition format"""
+    lines = ["# TYPE {}_stage_seconds histogram".format(prefix)]
+    for stage, histogram in sorted(snapshot["stages"].items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS + ["+Inf"], histogram["buckets"]):
+            cumulative += n
+            lines.append('{}_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(prefix, stage, bound, cumulative))
+        lines.append('{}_stage_seconds_sum{{stage="{}"}} {}'.format(prefix, stage, histogram["sum"]))
+        lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(prefix, stage, cumulative))
+    for name, n in sorted(snapshot["counters"].items()):
+        lines.append("# TYPE {}_{}_total counter".format(prefix, name))
+        lines.append("{}_{}_total {}".format(prefix, name, n))
+    return "\n".join(lines) + "\n"
+
+
+class StatsReporter:
+    """JSON stats file and/or Prometheus endpoint of the last reported snapshot"""
+
+    def __init__(self, stats_file: str = None, port: int = None, interval: float = STATS_INTERVAL):
+        self.stats_file = stats_file
+        self.interval = interval
+        self.last = {"stages": {}, "counters": {}}
+        self.last_report = time.monotonic()
+        self.server = None
+        if port is not None:
+            reporter = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path not in ('/', '/metrics'):
+                        self.send_error(404)
+                        return
+                    body = prometheus_text(reporter.last).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+            threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True).start()
+            print("Metrics on http://127.0.0.1:{}/metrics".format(self.server.server_address[1]))
+
+    def enabled(self) -> bool:
+        return self.stats_file is not None or self.server is not None
+
+    def report(self, snapshot: dict) -> None:
+        self.last = snapshot
+        self.last_report = time.monotonic()
+        if self.stats_file is not None:
+            with open(self.stats_file + '.tmp', 'w') as fout:
+                json.dump(summary(snapshot), fout, indent=1)
+            os.replace(self.stats_file + '.tmp', self.stats_file)
+
+    def maybe_report(self, collect) -> None:
+        """Report collect() if the last report is older than interval"""
+        if self.enabled() and time.monotonic() - self.last_report >= self.interval:
+            self.report(collect())
+
+    def close(self, snapshot: dict = None) -> None:
+        if snapshot is not None and self.enabled():
+            self.report(snapshot)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class PageProfiler:
+    """Profiles a random share rate of the pages, one output file per page in directory"""
+
+    def __init__(self, directory: str, rate: float = 0.0, profiler: str = DEFAULT_PROFILER):
+        self.directory = directory
+        self.rate = rate
+        self.profiler = profiler
+        if rate > 0:
+            if profiler == 'pyinstrument':
+                # optional dependency, only needed when this profiler is selected
+                import pyinstrument  # noqa: F401
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url: str, extension: str) -> str:
+        name = re.sub(r'[^\w.-]', '_', article_title(url))[:100]
+        return os.path.join(self.directory, "{}.{}.{}{}".format(name, os.getpid(), int(time.time() * 1000), extension))
+
+    @contextmanager
+    def profile(self, url: str):
+        if self.rate <= 0 or random.random() >= self.rate:
+            yield
+            return
+        if self.profiler == 'pyinstrument':
+            import pyinstrument
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                with open(self._path(url, '.html'), 'w', encoding='utf-8') as fout:
+                    fout.write(profiler.output_html())
+            return
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(self._path(url, '.prof'))
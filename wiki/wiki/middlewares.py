@@ -4,10 +4,14 @@
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import TextResponse
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from .httpcache import CONDITIONAL_HEADERS, ResponseCache
+
 
 class WikiSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +105,81 @@ class WikiDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class WikiHttpCacheMiddleware:
+    # Conditional re-crawl through the ResponseCache of the crawler scripts,
+    # enabled by the WIKI_HTTP_CACHE setting.
+    #
+    # A 304 is answered with the cached page; when its links are known they
+    # are passed in meta["wiki_cached_links"] and the spider does not parse
+    # it. meta["wiki_store_links"] asks the spider to give the links of a
+    # page to spider.http_cache. Every text response is cached: the HTML
+    # pages, and the JSON of WIKI_FETCH_MODE "parse". A 304 with no cached
+    # page (removed since the request was sent) is requested again without
+    # conditional headers.
+
+    def __init__(self, path, replay=False):
+        self.cache = ResponseCache(path)
+        self.replay = replay
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get("WIKI_HTTP_CACHE")
+        if not path:
+            raise NotConfigured
+        s = cls(path, crawler.settings.getbool("WIKI_HTTP_CACHE_REPLAY"))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def cached_response(self, request, entry):
+        return TextResponse(url=request.url, status=entry.status, body=entry.html().encode("utf-8"),
+                            encoding="utf-8", request=request, flags=["cached"])
+
+    def process_request(self, request, spider):
+        entry = self.cache.get(request.url)
+        if self.replay:
+            if entry is None:
+                raise IgnoreRequest(f"Not in cache: {request.url}")
+            return self.cached_response(request, entry)
+        if entry is not None:
+            for name, value in entry.conditional_headers().items():
+                request.headers.setdefault(name, value)
+        return None
+
+    def process_response(self, request, response, spider):
+        if "cached" in response.flags:
+            return response
+        if response.status == 304:
+            entry = self.cache.get(request.url)
+            if entry is None:
+                if request.meta.get("wiki_unconditional"):
+                    return response
+                headers = request.headers.copy()
+                for name in CONDITIONAL_HEADERS:
+                    headers.pop(name, None)
+                return request.replace(headers=headers, dont_filter=True,
+                                       meta=dict(request.meta, wiki_unconditional=True))
+            self.cache.touch(request.url)
+            if entry.links is not None:
+                request.meta["wiki_cached_links"] = entry.links
+            else:
+                request.meta["wiki_store_links"] = True
+            return self.cached_response(request, entry)
+        if response.status == 200 and isinstance(response, TextResponse):
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            self.cache.put(request.url, response.status,
+                           etag.decode("latin-1") if etag else None,
+                           last_modified.decode("latin-1") if last_modified else None,
+                           response.text)
+            request.meta["wiki_store_links"] = True
+        return response
+
+    def spider_opened(self, spider):
+        spider.http_cache = self.cache
+        spider.logger.info("HTTP cache %s opened (replay: %s)" % (self.cache.path, self.replay))
+
+    def spider_closed(self, spider):
+        self.cache.close()
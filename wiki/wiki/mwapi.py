@@ -0,0 +1,90 @@
+# Content-only fetch modes of the crawlers
+#
+# /wiki/<title> is the full rendered page, skin, navigation and sidebars
+# included, of which only div#mw-content-text is used. The other modes ask
+# MediaWiki for the article content alone:
+# - "rest": Parsoid HTML of the REST API, /api/rest_v1/page/html/<title>;
+#   its links are relative (./<title>), they are rewritten to /wiki/<title>
+#   and the ones to the article itself (citations) to #<fragment>;
+# - "parse": action=parse of the Action API (prop=text, JSON), the
+#   div.mw-parser-output of div#mw-content-text, wrapped into the latter.
+# article_content() turns the response into HTML that the parsers read like a
+# full page, the article links and the extracted text stay the same.
+#
+# There is no batched variant: action=query gives the wikitext or plain text
+# extracts of many titles per call, but not the rendered HTML of the formulas.
+
+import re
+import json
+from urllib.parse import quote, unquote, urlsplit, parse_qs
+
+FETCH_MODES = ['page', 'rest', 'parse']
+DEFAULT_FETCH_MODE = 'page'
+REST_HTML_PATH = '/api/rest_v1/page/html/'
+ACTION_API_PATH = '/w/api.php'
+PARSE_QUERY = 'action=parse&format=json&formatversion=2&prop=text&redirects=1&page='
+MISSING_CONTENT = '<div id="mw-content-text"></div>'  # content of the pages the API has no article for
+
+TITLE_SAFE = ";@$!*(),/~:"  # not percent-encoded in the article hrefs of MediaWiki (wfUrlencode)
+
+_RELATIVE_HREF = re.compile(r'href="\./([^"#]*)(#[^"]*)?"')
+
+
+def article_url(base_url: str, article: str, mode: str = DEFAULT_FETCH_MODE) -> str:
+    """URL fetched for the article href '/wiki/<title>' in a fetch mode"""
+    if mode == 'page':
+        return base_url + article
+    title = quote(unquote(article[len('/wiki/'):]), safe='')  # '/' and '&' are part of some titles
+    if mode == 'rest':
+        return base_url + REST_HTML_PATH + title
+    if mode == 'parse':
+        return base_url + ACTION_API_PATH + '?' + PARSE_QUERY + title
+    raise ValueError("Unknown fetch mode {}, expected one of {}".format(mode, ", ".join(FETCH_MODES)))
+
+
+def url_article(url: str):
+    """Article href '/wiki/<title>' of a URL of article_url() in any fetch mode, None for other URLs
+
+    The requests redirected by the server (renamed articles, normalized
+    titles) are keyed by the article they ended at with it.
+    """
+    parts = urlsplit(url)
+    if parts.path.startswith('/wiki/'):
+        return parts.path
+    if parts.path.startswith(REST_HTML_PATH):
+        title = unquote(parts.path[len(REST_HTML_PATH):])
+    elif parts.path == ACTION_API_PATH and parse_qs(parts.query).get('action') == ['parse']:
+        title = parse_qs(parts.query).get('page', [''])[0]
+    else:
+        return None
+    return '/wiki/' + quote(title.replace(' ', '_'), safe=TITLE_SAFE) if title else None
+
+
+def _wiki_links(html: str, article: str) -> str:
+    own_title = unquote(article[len('/wiki/'):])
+
+    def rewrite(match):
+        title, fragment = match.group(1), match.group(2) or ''
+        if fragment and unquote(title) == own_title:
+            return 'href="{}"'.format(fragment)
+        return 'href="/wiki/{}{}"'.format(title, fragment)
+
+    return _RELATIVE_HREF.sub(rewrite, html)
+
+
+def article_content(status: int, body: str, article: str, mode: str = DEFAULT_FETCH_MODE) -> tuple:
+    """(status, HTML for the parsers) of a 200 or 404 response to article_url()
+
+    A missing article is a 404 with an empty div#mw-content-text, as the
+    API has no "this page does not exist" page.
+    """
+    if mode == 'page':
+        return status, body
+    if mode == 'rest':
+        if status == 404:
+            return 404, MISSING_CONTENT
+        return status, _wiki_links(body, article)
+    data = json.loads(body)
+    if 'error' in data:  # e.g. missingtitle, answered with a 200
+        return 404, MISSING_CONTENT
+    return status, '<div id="mw-content-text">' + data['parse']['text'] + '</div>'
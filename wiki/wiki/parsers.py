@@ -0,0 +1,136 @@
+# Parser backends for the article extraction step
+#
+# A backend turns the HTML of a Wikipedia page into an Article giving access
+# to the links of div#mw-content-text and to its math-aware text. All the
+# backends give the same results, "html.parser" being the reference.
+#
+# Parsoid HTML (HTML dumps, REST API) has no div#mw-content-text, the whole
+# <body> is the content then.
+
+from bs4 import BeautifulSoup, Tag
+
+from .extractor import Cut, extract_article
+
+
+DEFAULT_PARSER = 'html.parser'
+
+# citation sections, everything from the first one on is dropped
+CITATION_SECTION_IDS = ["See_also", "References", "External_links", "Works_cited"]
+
+
+class Article:
+    """Parsed page, links() and text() are computed on demand"""
+
+    def links(self) -> list:
+        """href of every <a> in div#mw-content-text, in document order"""
+        raise NotImplementedError
+
+    def text(self) -> str:
+        """Text of the article without citation sections, formulas as $latex$"""
+        return self.text_with_formulas()[0]
+
+    def text_with_formulas(self) -> tuple:
+        """(text(), Formula of every $latex$ of the text in order, see extractor.Formula)"""
+        raise NotImplementedError
+
+
+class ArticleParser:
+    name = None
+
+    def parse(self, html: str) -> Article:
+        raise NotImplementedError
+
+
+class Bs4Article(Article):
+
+    def __init__(self, html: str, features: str):
+        self.soup = BeautifulSoup(html, features)
+        self.content = self.soup.find('div', {'id':'mw-content-text'}) or self.soup.body
+        if self.content is None:
+            raise ValueError("No div#mw-content-text in page")
+
+    def links(self) -> list:
+        return [a.get('href') for a in self.content.find_all('a')]
+
+    def text_with_formulas(self) -> tuple:
+        # the first citation element ends the article: found in one pass over
+        # the page and skipped with everything after it, the tree is not changed
+        cut = None
+        content_seen = False
+        for element in self.soup.descendants:
+            if element is self.content:
+                content_seen = True
+            elif isinstance(element, Tag) and element.get('id') in CITATION_SECTION_IDS:
+                if not content_seen:
+                    return "", []  # the whole content comes after it
+                cut = Cut(element)
+                break
+        # get plain text from each <p> and standalone <math>
+        return extract_article(self.content, cut)
+
+
+class Bs4Parser(ArticleParser):
+    """BeautifulSoup with the pure-Python html.parser, the original behaviour"""
+    name = 'html.parser'
+
+    def parse(self, html: str) -> Article:
+        return Bs4Article(html, 'html.parser')
+
+
+class LxmlArticle(Article):
+
+    def __init__(self, html: str, lxml_extractor):
+        self._lxml_extractor = lxml_extractor
+        self.root = lxml_extractor.parse_document(html)
+        found = self.root.xpath('//div[@id="mw-content-text"]') or self.root.xpath('/html/body')
+        if not found:
+            raise ValueError("No div#mw-content-text in page")
+        self.content = found[0]
+
+    def links(self) -> list:
+        return [a.get('href') for a in self.content.iter('a')]
+
+    def text_with_formulas(self) -> tuple:
+        # leave out the first citation section and everything after it
+        cut = None
+        content_seen = False
+        for element in self.root.iter():
+            if element is self.content:
+                content_seen = True
+            elif element.get('id') in CITATION_SECTION_IDS:
+                if not content_seen:
+                    # the whole content comes after the citations
+                    return "", []
+                cut = self._lxml_extractor.Cut(element)
+                break
+        return self._lxml_extractor.extract_article(self.content, cut)
+
+
+class LxmlParser(ArticleParser):
+    """lxml (libxml2) tree, several times faster than html.parser"""
+    name = 'lxml'
+
+    def __init__(self):
+        # optional dependency, only needed when this backend is selected
+        from . import lxml_extractor
+        self.lxml_extractor = lxml_extractor
+
+    def parse(self, html: str) -> Article:
+        return LxmlArticle(html, self.lxml_extractor)
+
+
+PARSERS = {
+    Bs4Parser.name: Bs4Parser,
+    LxmlParser.name: LxmlParser,
+}
+
+_instances = {}
+
+
+def get_parser(name: str = DEFAULT_PARSER) -> ArticleParser:
+    """Shared parser instance for a backend name"""
+    if name not in PARSERS:
+        raise ValueError("Unknown parser backend {} (choose from {})".format(name, ", ".join(PARSERS)))
+    if name not in _instances:
+        _instances[name] = PARSERS[name]()
+    return _instances[name]
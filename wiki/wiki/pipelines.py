@@ -5,9 +5,21 @@
 
 
 # useful for handling different item types with a single interface
+import queue
+import logging
+import threading
+import time
+
 from itemadapter import ItemAdapter
 import pymongo
+from pymongo import UpdateOne
+from scrapy.exceptions import DropItem, NotConfigured
+from twisted.internet.threads import deferToThread
 from .items import WikiItem
+from .extractor import Formula
+from .sinks import open_sink, open_formula_sink, article_record, formula_records
+
+logger = logging.getLogger(__name__)
 
 
 
@@ -33,4 +45,156 @@ class WikiMongoDBPipeline:
         self.db[self.data_collection].update_one({"key": data["key"]}, {"$set": data}, upsert=True)
 
         return item
-    
+
+
+class WikiMongoDBBulkPipeline:
+    # Same documents as WikiMongoDBPipeline, without a round trip per item in
+    # the reactor: process_item only queues an UpdateOne upsert, a writer
+    # thread sends the queue with bulk_write every MONGODB_BATCH_SIZE items
+    # or MONGODB_FLUSH_INTERVAL seconds. The queue is bounded: when MongoDB
+    # falls behind, process_item returns a Deferred that fires once the
+    # upsert is queued (by a thread of the reactor pool), and Scrapy holds
+    # the next items back meanwhile, without blocking the reactor nor
+    # buffering the crawl in memory. A failed batch is sent again
+    # MONGODB_RETRY_TIMES times (upserts, so without duplicates); if it still
+    # fails the spider is closed with the reason "mongodb_error" and the next
+    # items are dropped, instead of losing their documents silently.
+    # close_spider flushes what is left.
+
+    _STOP = object()
+
+    def __init__(self, mongodb_uri='mongodb://localhost:27017/', mongodb_db='wiki', data_collection='wiki_math',
+                 batch_size=500, flush_interval=5.0, clean_start=True, retry_times=3, retry_delay=1.0, client=None):
+        self.mongodb_uri = mongodb_uri
+        self.mongodb_db = mongodb_db
+        self.data_collection = data_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clean_start = clean_start
+        self.retry_times = retry_times
+        self.retry_delay = retry_delay  # seconds before the first retry of a batch, doubled at each one
+        self.client = client  # e.g. a mongomock.MongoClient in tests
+        self.own_client = client is None
+        self.num_written = 0
+        self.num_errors = 0
+        self.num_failed = 0  # documents of the batches given up
+        self.error = None  # of the last batch given up
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(settings.get("MONGODB_URI", 'mongodb://localhost:27017/'),
+                   settings.get("MONGODB_DATABASE", 'wiki'),
+                   settings.get("MONGODB_COLLECTION", 'wiki_math'),
+                   settings.getint("MONGODB_BATCH_SIZE", 500),
+                   settings.getfloat("MONGODB_FLUSH_INTERVAL", 5.0),
+                   settings.getbool("MONGODB_CLEAN_START", True),
+                   settings.getint("MONGODB_RETRY_TIMES", 3),
+                   settings.getfloat("MONGODB_RETRY_DELAY", 1.0))
+
+    def open_spider(self, spider):
+        if self.client is None:
+            self.client = pymongo.MongoClient(self.mongodb_uri)
+        self.collection = self.client[self.mongodb_db][self.data_collection]
+        if self.clean_start:
+            self.collection.delete_many({})
+        self.collection.create_index("key", unique=True)
+        self.queue = queue.Queue(maxsize=4 * self.batch_size)
+        self.writer = threading.Thread(target=self._write_loop, name="mongodb-writer", daemon=True)
+        self.writer.start()
+
+    def close_spider(self, spider):
+        # the last batch is written in a thread of the reactor pool
+        return deferToThread(self._close)
+
+    def _close(self):
+        self.queue.put(self._STOP)
+        self.writer.join()
+        logger.info("MongoDB: %d documents written, %d errors", self.num_written, self.num_errors)
+        if self.num_failed:
+            logger.error("MongoDB: %d documents not written, last error: %r", self.num_failed, self.error)
+        if self.own_client:
+            self.client.close()
+
+    def process_item(self, item, spider):
+        if self.error is not None:
+            spider.crawler.engine.close_spider(spider, "mongodb_error")
+            raise DropItem("MongoDB write failed: {!r}".format(self.error))
+        data = dict(WikiItem(item))
+        operation = UpdateOne({"key": data["key"]}, {"$set": data}, upsert=True)
+        try:
+            self.queue.put_nowait(operation)
+        except queue.Full:
+            # MongoDB is behind: wait for room in a thread, not in the reactor
+            return deferToThread(self.queue.put, operation).addCallback(lambda _: item)
+        return item
+
+    def _write_loop(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                operation = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                operation = None
+            if operation is self._STOP:
+                self._flush(batch)
+                return
+            if operation is not None:
+                batch.append(operation)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        for attempt in range(self.retry_times + 1):
+            try:
+                # unordered: one failed document does not stop the rest of the batch
+                result = self.collection.bulk_write(batch, ordered=False)
+                self.num_written += result.upserted_count + result.matched_count
+                return
+            except Exception as e:  # PyMongoError mostly, the writer thread must survive any of them
+                self.num_errors += 1
+                error = e
+            if attempt < self.retry_times:
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning("MongoDB bulk write of %d documents failed: %r, retrying in %.1f s", len(batch), error, delay)
+                time.sleep(delay)
+        logger.error("MongoDB bulk write of %d documents failed %d times: %r", len(batch), self.retry_times + 1, error)
+        self.num_failed += len(batch)
+        self.error = error
+
+
+class WikiSinkPipeline:
+    # Writes the items to the output sink of the crawler scripts (see
+    # wiki/sinks.py), enabled by the WIKI_OUTPUT setting: a .jsonl, .jsonl.zst
+    # or .parquet file. The formulas go to formulas/<WIKI_OUTPUT file>.
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get("WIKI_OUTPUT")
+        if not path:
+            raise NotConfigured
+        return cls(path)
+
+    def open_spider(self, spider):
+        self.sink = open_sink(self.path)
+        self.formula_sink = open_formula_sink(self.path)
+
+    def close_spider(self, spider):
+        self.sink.close()
+        self.formula_sink.close()
+
+    def process_item(self, item, spider):
+        data = ItemAdapter(item)
+        with spider.metrics.time('write'):
+            formulas = [Formula(**f) for f in data.get("formulas") or []]
+            self.sink.write(article_record(data["url"], data["text"], len(formulas)))
+            self.formula_sink.write_many(formula_records(data["url"], formulas))
+        return item
@@ -0,0 +1,280 @@
+# Politeness limits of the crawl engines
+#
+# TokenBucket and HostRateLimiter cap the request rate of the asyncio crawler.
+#
+# FetchScheduler adapts to the server instead, per host:
+# - the requests in flight are limited by an AIMD window: it grows by one
+#   after a window of successes and is halved on a 429 or 503, once for all
+#   the requests that were in flight at the time;
+# - a 429 or 503 pauses the host for its Retry-After (without one, a backoff
+#   delay growing with the throttles since the last success), so that the
+#   other requests don't get throttled as well;
+# - a failed URL waits in a delayed-retry queue, an exponential backoff with
+#   full jitter for errors, the pause of the host when throttled, and is
+#   dropped after max_attempts errors.
+# It does no I/O: the crawlers call start() and finish() around each request
+# and sleep for wait_time() when nothing can start. AsyncFetchScheduler waits
+# in acquire() and wakes up the waiters in release().
+
+import time
+import heapq
+import random
+import asyncio
+import email.utils
+from urllib.parse import urlparse
+
+SUCCESS_STATUSES = (200, 304, 404)  # pages done, 404 included
+THROTTLE_STATUSES = (429, 503)
+DEFAULT_WINDOW = 16  # initial requests in flight per host
+MIN_WINDOW = 1
+MAX_WINDOW = 256
+BACKOFF_BASE = 1.0  # seconds, delay of a first retry is at most 2 * BACKOFF_BASE
+BACKOFF_CAP = 300.0  # seconds
+MAX_ATTEMPTS = 8  # errors before a URL is dropped, throttling not counted
+DONE, RETRY, DROP = 'done', 'retry', 'drop'  # outcomes of FetchScheduler.finish()
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average, with bursts of up to `burst` requests"""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it"""
+        async with self.lock:  # serve waiters in order
+            self._refill()
+            while self.tokens < 1.0:
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1.0
+
+
+class HostRateLimiter:
+    """One TokenBucket per host, a rate <= 0 disables the limit"""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+
+    def bucket(self, url: str) -> TokenBucket:
+        host = urlparse(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return self.buckets[host]
+
+    async def acquire(self, url: str) -> None:
+        if self.rate <= 0:
+            return
+        await self.bucket(url).acquire()
+
+
+def retry_after_seconds(value: str, now: float = None):
+    """Seconds to wait from a Retry-After header (delay in seconds or HTTP date), None if missing or invalid"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - (time.time() if now is None else now))
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """Exponential backoff with full jitter: uniform in [0, min(cap, base * 2 ** attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** min(attempt, 32)))
+
+
+class AIMDWindow:
+    """Additive increase, multiplicative decrease of a number of requests in flight"""
+
+    def __init__(self, initial: float = DEFAULT_WINDOW, minimum: float = MIN_WINDOW, maximum: float = MAX_WINDOW,
+                 increase: float = 1.0, decrease: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.increase = increase
+        self.decrease = decrease
+        self.epoch = 0  # number of decreases, a request started before the last one can't decrease again
+
+    def size(self) -> int:
+        return max(int(self.minimum), int(self.limit))
+
+    def success(self) -> None:
+        # +increase once every `limit` successes, i.e. once per window
+        self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+    def throttled(self, epoch: int) -> bool:
+        """Decrease the window, unless it was since the request of epoch started; True if decreased"""
+        if epoch < self.epoch:
+            return False
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        self.epoch += 1
+        return True
+
+
+class _HostState:
+    __slots__ = ('window', 'in_flight', 'paused_until', 'throttles')
+
+    def __init__(self, window: AIMDWindow):
+        self.window = window
+        self.in_flight = 0
+        self.paused_until = 0.0  # time.monotonic()
+        self.throttles = 0  # window decreases since the last success, attempt of the backoff without Retry-After
+
+
+class FetchScheduler:
+    """AIMD window and Retry-After pause per host, and delayed retries of the failed URLs"""
+
+    def __init__(self, window: int = DEFAULT_WINDOW, min_window: int = MIN_WINDOW, max_window: int = MAX_WINDOW,
+                 max_attempts: int = MAX_ATTEMPTS, backoff_base: float = BACKOFF_BASE, backoff_cap: float = BACKOFF_CAP):
+        self.initial_window = window
+        self.min_window = min_window
+        self.max_window = max_window
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hosts = {}
+        self.retries = []  # heap of (time.monotonic() of the retry, sequence number, url)
+        self.num_scheduled = 0
+        self.attempts = {}  # url -> errors so far
+        self.num_throttled = 0
+        self.num_errors = 0
+        self.num_dropped = 0
+
+    def host(self, url: str) -> _HostState:
+        host = urlparse(url).netloc
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = _HostState(AIMDWindow(self.initial_window, self.min_window, self.max_window))
+        return state
+
+    def pause_time(self, url: str) -> float:
+        """Seconds before the host of url may be requested again"""
+        return max(0.0, self.host(url).paused_until - time.monotonic())
+
+    def can_start(self, url: str) -> bool:
+        state = self.host(url)
+        return state.paused_until <= time.monotonic() and state.in_flight < state.window.size()
+
+    def start(self, url: str) -> int:
+        """A request to url is sent, returns the token to give back to finish()"""
+        state = self.host(url)
+        state.in_flight += 1
+        return state.window.epoch
+
+    def cancel(self, url: str) -> None:
+        """A request started with start() was not sent after all"""
+        self.host(url).in_flight -= 1
+
+    def finish(self, url: str, token: int, status: int = None, retry_after: str = None) -> str:
+        """Outcome of a request started with start(): DONE, RETRY (url is queued for later) or DROP
+
+        status is None after a connection error, retry_after is the
+        Retry-After header of the response.
+        """
+        state = self.host(url)
+        state.in_flight -= 1
+        if status in SUCCESS_STATUSES:
+            state.window.success()
+            state.throttles = 0
+            self.attempts.pop(url, None)
+            return DONE
+        if status in THROTTLE_STATUSES:
+            self.num_throttled += 1
+            if state.window.throttled(token):
+                state.throttles += 1
+            pause = retry_after_seconds(retry_after)
+            if pause is None:
+                pause = backoff_delay(state.throttles, self.backoff_base, self.backoff_cap)
+            state.paused_until = max(state.paused_until, time.monotonic() + pause)
+            # spread the retries over a second after the pause
+            self._schedule(url, state.paused_until - time.monotonic() + random.uniform(0, self.backoff_base))
+            return RETRY
+        return self.fail(url)
+
+    def fail(self, url: str) -> str:
+        """url failed (an error status, a connection or parsing error): RETRY after a backoff delay, or DROP"""
+        self.num_errors += 1
+        attempt = self.attempts.get(url, 0) + 1
+        if attempt >= self.max_attempts:
+            self.attempts.pop(url, None)
+            self.num_dropped += 1
+            return DROP
+        self.attempts[url] = attempt
+        self._schedule(url, backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+        return RETRY
+
+    def _schedule(self, url: str, delay: float) -> None:
+        self.num_scheduled += 1
+        heapq.heappush(self.retries, (time.monotonic() + delay, self.num_scheduled, url))
+
+    def unschedule(self, url: str) -> None:
+        """Remove the delayed retry of url, retried elsewhere (e.g. by another node of a shared frontier)"""
+        retries = [entry for entry in self.retries if entry[2] != url]
+        if len(retries) != len(self.retries):
+            heapq.heapify(retries)
+            self.retries = retries
+
+    def ready(self) -> list:
+        """URLs whose retry time has come, removed from the queue"""
+        now = time.monotonic()
+        urls = []
+        while self.retries and self.retries[0][0] <= now:
+            urls.append(heapq.heappop(self.retries)[2])
+        return urls
+
+    def num_retries(self) -> int:
+        """URLs waiting for their retry"""
+        return len(self.retries)
+
+    def wait_time(self, url: str = None) -> float:
+        """Seconds before the next retry is due or the host of url is not paused anymore, 0 if neither is waited for"""
+        now = time.monotonic()
+        times = [self.host(url).paused_until - now] if url is not None else []
+        if self.retries:
+            times.append(self.retries[0][0] - now)
+        return max(0.0, min((t for t in times if t > 0), default=0.0))
+
+    def window(self, url: str) -> int:
+        return self.host(url).window.size()
+
+
+class AsyncFetchScheduler(FetchScheduler):
+    """FetchScheduler whose acquire() waits until a request to the host may start"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = asyncio.Condition()
+
+    async def acquire(self, url: str) -> int:
+        async with self.changed:
+            while not self.can_start(url):
+                pause = self.pause_time(url)
+                try:
+                    # woken up by release(), or at the end of the pause
+                    await asyncio.wait_for(self.changed.wait(), pause if pause > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+            return self.start(url)
+
+    async def release(self, url: str, token: int, status: int = None, retry_after: str = None) -> str:
+        async with self.changed:
+            outcome = self.finish(url, token, status, retry_after)
+            self.changed.notify_all()
+        return outcome
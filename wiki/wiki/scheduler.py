@@ -0,0 +1,136 @@
+# Scrapy scheduler and dupefilter of the wiki project on a shared frontier
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/scheduler.html
+#
+# Enabled in settings.py with WIKI_SHARED_FRONTIER (see wiki/sharedfrontier.py),
+# the spiders of several nodes (and ray-wiki-crawler.py --frontier) then
+# crawl one frontier without fetching an article twice.
+
+from collections import deque
+
+from scrapy import signals
+from scrapy.core.scheduler import BaseScheduler
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.utils.misc import load_object
+
+from .mwapi import url_article
+from .sharedfrontier import DEFAULT_LEASE_TIMEOUT, open_shared_frontier
+
+
+def open_frontier(settings):
+    uri = settings.get("WIKI_SHARED_FRONTIER")
+    if not uri:
+        raise ValueError("The shared scheduler and dupefilter need the WIKI_SHARED_FRONTIER setting")
+    return open_shared_frontier(uri, settings.getfloat("WIKI_LEASE_TIMEOUT", DEFAULT_LEASE_TIMEOUT))
+
+
+class WikiSharedDupeFilter(BaseDupeFilter):
+    # Requests seen by any node, in the seen set of the shared frontier: the
+    # article of the wiki requests (of their URL, the redirect target of a
+    # redirected request), the fingerprint of the others
+
+    def __init__(self, frontier, fingerprinter, stats=None):
+        self.frontier = frontier
+        self.fingerprinter = fingerprinter
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(open_frontier(crawler.settings), crawler.request_fingerprinter, crawler.stats)
+
+    def request_seen(self, request):
+        key = url_article(request.url) or self.fingerprinter.fingerprint(request).hex()
+        return not self.frontier.add_seen([key])[0]
+
+    def log(self, request, spider):
+        if self.stats is not None:
+            self.stats.inc_value("dupefilter/filtered", spider=spider)
+
+    def close(self, reason):
+        self.frontier.close()
+
+
+class WikiSharedScheduler(BaseScheduler):
+    # The wiki article requests (meta wiki_article, see
+    # WikiMathSpider.article_request) are queued in the shared frontier by
+    # the article of their URL, dedup included, and rebuilt with
+    # spider.article_request() by the node that leases them; a redirected
+    # request (whose meta is copied from the original) is queued as the
+    # article it was redirected to. A lease is acknowledged when its request
+    # leaves the downloader (or its response comes from the HTTP cache), the
+    # leases of a node that stopped are handed out again after
+    # WIKI_LEASE_TIMEOUT seconds. The other requests, and the dont_filter ones
+    # (e.g. retries), go through the dupefilter to a queue of this node.
+
+    def __init__(self, frontier, dupefilter, stats=None):
+        self.frontier = frontier
+        self.dupefilter = dupefilter
+        self.stats = stats
+        self.local = deque()
+        self.spider = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        dupefilter_cls = load_object(crawler.settings["DUPEFILTER_CLASS"])
+        if hasattr(dupefilter_cls, "from_crawler"):
+            dupefilter = dupefilter_cls.from_crawler(crawler)
+        else:
+            dupefilter = dupefilter_cls()
+        s = cls(open_frontier(crawler.settings), dupefilter, crawler.stats)
+        crawler.signals.connect(s.request_done, signal=signals.request_left_downloader)
+        crawler.signals.connect(s.response_received, signal=signals.response_received)
+        return s
+
+    def open(self, spider):
+        self.spider = spider
+        return self.dupefilter.open()
+
+    def close(self, reason):
+        self.frontier.close()
+        return self.dupefilter.close(reason)
+
+    def has_pending_requests(self):
+        # the URLs leased by the other nodes may still lead to new ones
+        return bool(self.local) or len(self.frontier) > 0
+
+    def enqueue_request(self, request):
+        article = url_article(request.url) if "wiki_article" in request.meta else None
+        if article is not None and not request.dont_filter:
+            if not self.frontier.push(article):  # queued by a node before
+                self.dupefilter.log(request, self.spider)
+                return False
+            self._inc("scheduler/enqueued/shared")
+            return True
+        if not request.dont_filter and self.dupefilter.request_seen(request):
+            self.dupefilter.log(request, self.spider)
+            return False
+        self.local.append(request)
+        self._inc("scheduler/enqueued/memory")
+        return True
+
+    def next_request(self):
+        if self.local:
+            self._inc("scheduler/dequeued/memory")
+            return self.local.popleft()
+        article = self.frontier.pop()
+        if article is None:
+            return None
+        self._inc("scheduler/dequeued/shared")
+        request = self.spider.article_request(article)
+        request.meta["wiki_lease"] = True
+        return request
+
+    def request_done(self, request, spider):
+        if request.meta.get("wiki_lease"):
+            self.frontier.ack([request.meta["wiki_article"]])
+
+    def response_received(self, response, request, spider):
+        self.request_done(request, spider)
+
+    def _inc(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key, spider=self.spider)
+
+    def __len__(self):
+        return len(self.local) + len(self.frontier)
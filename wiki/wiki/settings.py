@@ -19,6 +19,73 @@ NEWSPIDER_MODULE = "wiki.spiders"
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = True
 
+# HTML parser backend of the article extraction: "html.parser" or "lxml"
+# (see wiki/parsers.py)
+WIKI_PARSER = "html.parser"
+
+# Fetch mode of the articles (see wiki/mwapi.py): "page" (full page), "rest"
+# (Parsoid HTML of the REST API) or "parse" (action=parse), the last two
+# without the skin, navigation and sidebars
+WIKI_FETCH_MODE = "page"
+
+# Dupefilter keyed by the 64-bit hash of the article titles, 8 to 16 bytes
+# per article instead of a SHA1 fingerprint string, which the spider also
+# asks before building the requests of the links (see wiki/dupefilters.py).
+# Set JOBDIR for a long crawl: without it the pending requests are Request
+# objects in memory, and the seen hashes are lost when the crawl stops. With
+# it Scrapy queues the requests on disk and the hashes are written there as
+# they are added, so that a stopped or crashed crawl resumes
+# JOBDIR = "crawls/wiki_math"
+DUPEFILTER_CLASS = "wiki.dupefilters.WikiTitleDupeFilter"
+
+# Frontier shared with the spiders of other nodes and ray-wiki-crawler.py
+# --frontier (see wiki/sharedfrontier.py): redis://host:6379/0 (?prefix= for
+# the keys) or a SQLite file for the processes of one machine, enabled by
+#   SCHEDULER = "wiki.scheduler.WikiSharedScheduler"
+#   DUPEFILTER_CLASS = "wiki.scheduler.WikiSharedDupeFilter"
+# The articles leased by a node that stopped are crawled by another one after
+# WIKI_LEASE_TIMEOUT seconds
+WIKI_SHARED_FRONTIER = None
+WIKI_LEASE_TIMEOUT = 300
+
+# HTTP response cache shared with the crawler scripts (see wiki/httpcache.py):
+# path of the cache file, None disables it. Cached pages are re-crawled with
+# conditional requests, and with WIKI_HTTP_CACHE_REPLAY only served from the
+# cache, without network
+WIKI_HTTP_CACHE = None
+WIKI_HTTP_CACHE_REPLAY = False
+
+# Output file of WikiSinkPipeline, in the format of the crawler scripts (see
+# wiki/sinks.py): *.jsonl, *.jsonl.zst or *.parquet; None disables it
+WIKI_OUTPUT = None
+
+# Stage times of the spider (see wiki/metrics.py), reported by
+# WikiMetricsExtension every WIKI_STATS_INTERVAL seconds into the Scrapy stats
+# (wiki/<stage>/...), the WIKI_STATS_FILE JSON file and a Prometheus endpoint
+# on WIKI_METRICS_PORT; None disables the last two. WIKI_PROFILE_RATE of the
+# pages are profiled with WIKI_PROFILER ("cprofile" or "pyinstrument") to
+# WIKI_PROFILE_DIR
+WIKI_STATS_FILE = None
+WIKI_METRICS_PORT = None
+WIKI_STATS_INTERVAL = 10
+WIKI_PROFILE_RATE = 0.0
+WIKI_PROFILE_DIR = "profiles"
+WIKI_PROFILER = "cprofile"
+
+# MongoDB output of WikiMongoDBBulkPipeline (see wiki/pipelines.py): upserts
+# are sent in bulk every MONGODB_BATCH_SIZE items or MONGODB_FLUSH_INTERVAL
+# seconds; MONGODB_CLEAN_START empties the collection when the spider opens.
+# A failed batch is sent again MONGODB_RETRY_TIMES times, after
+# MONGODB_RETRY_DELAY seconds doubled at each retry, then the spider is closed
+MONGODB_URI = "mongodb://localhost:27017/"
+MONGODB_DATABASE = "wiki"
+MONGODB_COLLECTION = "wiki_math"
+MONGODB_BATCH_SIZE = 500
+MONGODB_FLUSH_INTERVAL = 5.0
+MONGODB_CLEAN_START = True
+MONGODB_RETRY_TIMES = 3
+MONGODB_RETRY_DELAY = 1.0
+
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 CONCURRENT_REQUESTS = 32
 
@@ -50,15 +117,18 @@ CONCURRENT_REQUESTS = 32
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
+DOWNLOADER_MIDDLEWARES = {
 #    "wiki.middlewares.WikiDownloaderMiddleware": 543,
-#}
+    # below HttpCompressionMiddleware (590): responses are cached decompressed
+    "wiki.middlewares.WikiHttpCacheMiddleware": 580,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+    "wiki.extensions.WikiMetricsExtension": 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -0,0 +1,330 @@
+# URL frontier shared by several crawler nodes
+#
+# Frontier (frontier.py) belongs to one process. A SharedFrontier lives in
+# Redis, or in a SQLite file for the nodes of one machine and for tests, and
+# the nodes take their URLs from it with leases:
+# - push() queues the URLs never pushed before by any node, dedup is a set
+#   of 64-bit URL hashes (as in Frontier);
+# - lease(n) atomically takes up to n queued URLs for lease_timeout seconds;
+# - done() acknowledges them, retry() puts one back in the queue;
+# - the leases of a crashed node expire and are queued again by the next
+#   lease() of any node, up to max_attempts times per URL.
+# So a URL is fetched by one node at a time, and again only if its node did
+# not acknowledge it in time.
+#
+# It has the interface of Frontier: pop() takes its URLs from a batch of
+# leases, done() is acknowledged at commit() (see checkpoint() in frontier.py),
+# after the outputs of the page are flushed. len() counts the URLs queued or
+# leased by any node, the crawl is over when it is 0.
+#
+# open_shared_frontier("redis://host:6379/0?prefix=wiki") or
+# open_shared_frontier("path/frontier_shared.sqlite")
+
+import time
+import sqlite3
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DEFAULT_LEASE_TIMEOUT = 300  # seconds before the URLs of a silent node are handed out again
+DEFAULT_MAX_ATTEMPTS = 5  # expired leases of a URL before it is dropped
+LEASE_BATCH = 16  # URLs leased at once by pop()
+DEFAULT_PREFIX = 'wiki'  # of the Redis keys
+
+
+def seen_key(url: str) -> bytes:
+    """64-bit hash of a URL, its entry in the seen set"""
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest()
+
+
+class SharedFrontier:
+    """Leased FIFO queue of URLs shared by several nodes, with the interface of Frontier"""
+
+    def __init__(self, lease_timeout: float = DEFAULT_LEASE_TIMEOUT, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.leased = []  # URLs leased by pop(), not handed out yet
+        self.acks = []  # URLs done since the last commit()
+
+    # backend operations
+
+    def push_many(self, urls) -> int:
+        """Queue the URLs never pushed before, return how many were queued"""
+        raise NotImplementedError
+
+    def add_seen(self, keys: list) -> list:
+        """Add keys to the seen set, True for the ones that were not in it"""
+        raise NotImplementedError
+
+    def lease(self, n: int) -> list:
+        """Up to n queued URLs, leased for lease_timeout seconds, after queueing the expired leases again"""
+        raise NotImplementedError
+
+    def ack(self, urls: list) -> None:
+        """End the leases of urls"""
+        raise NotImplementedError
+
+    def release(self, url: str) -> None:
+        """End the lease of url and queue it again"""
+        raise NotImplementedError
+
+    def num_queued(self) -> int:
+        raise NotImplementedError
+
+    def num_leased(self) -> int:
+        """URLs leased by all the nodes"""
+        raise NotImplementedError
+
+    def is_new(self) -> bool:
+        """True if nothing was ever pushed"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        for url in self.leased:  # to the other nodes at once, not after the lease timeout
+            self.release(url)
+        self.leased = []
+        self.commit()
+
+    # Frontier interface
+
+    def __len__(self) -> int:
+        return self.num_queued() + self.num_leased()
+
+    def push(self, url: str) -> bool:
+        return self.push_many([url]) == 1
+
+    def pop(self):
+        """Next leased URL, None if no URL is queued right now (other nodes may still push some)"""
+        if not self.leased:
+            self.leased = self.lease(LEASE_BATCH)[::-1]
+        return self.leased.pop() if self.leased else None
+
+    def done(self, url: str) -> None:
+        self.acks.append(url)
+
+    def retry(self, url: str) -> None:
+        self.release(url)
+
+    def commit(self) -> None:
+        if self.acks:
+            self.ack(self.acks)
+            self.acks = []
+
+
+class SqliteSharedFrontier(SharedFrontier):
+    """SharedFrontier in a SQLite file, for the processes of one machine"""
+
+    def __init__(self, path: str, lease_timeout: float = DEFAULT_LEASE_TIMEOUT, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        super().__init__(lease_timeout, max_attempts)
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)  # transactions are explicit
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS seen (h BLOB PRIMARY KEY) WITHOUT ROWID")
+        self.db.execute("CREATE TABLE IF NOT EXISTS queue (seq INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, "
+                        "attempts INTEGER NOT NULL DEFAULT 0)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS leases (url TEXT PRIMARY KEY, deadline REAL NOT NULL, "
+                        "attempts INTEGER NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS leases_deadline ON leases (deadline)")
+
+    def _transaction(self):
+        # the write lock is taken at once, so that two nodes never lease the same URL
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def push_many(self, urls) -> int:
+        urls = list(urls)
+        if not urls:
+            return 0
+        db = self._transaction()
+        try:
+            queued = 0
+            for url in urls:
+                if db.execute("INSERT OR IGNORE INTO seen (h) VALUES (?)", (seen_key(url),)).rowcount:
+                    db.execute("INSERT INTO queue (url) VALUES (?)", (url,))
+                    queued += 1
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return queued
+
+    def add_seen(self, keys: list) -> list:
+        db = self._transaction()
+        try:
+            new = [db.execute("INSERT OR IGNORE INTO seen (h) VALUES (?)", (seen_key(key),)).rowcount == 1 for key in keys]
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return new
+
+    def lease(self, n: int) -> list:
+        now = time.time()
+        db = self._transaction()
+        try:
+            expired = db.execute("SELECT url, attempts FROM leases WHERE deadline <= ?", (now,)).fetchall()
+            if expired:
+                db.execute("DELETE FROM leases WHERE deadline <= ?", (now,))
+                db.executemany("INSERT INTO queue (url, attempts) VALUES (?, ?)",
+                               [(url, attempts + 1) for url, attempts in expired if attempts + 1 < self.max_attempts])
+            rows = db.execute("SELECT seq, url, attempts FROM queue ORDER BY seq LIMIT ?", (n,)).fetchall()
+            if rows:
+                db.execute("DELETE FROM queue WHERE seq <= ?", (rows[-1][0],))
+                db.executemany("INSERT OR REPLACE INTO leases (url, deadline, attempts) VALUES (?, ?, ?)",
+                               [(url, now + self.lease_timeout, attempts) for _, url, attempts in rows])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return [url for _, url, _ in rows]
+
+    def ack(self, urls: list) -> None:
+        db = self._transaction()
+        try:
+            db.executemany("DELETE FROM leases WHERE url = ?", [(url,) for url in urls])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def release(self, url: str) -> None:
+        db = self._transaction()
+        try:
+            row = db.execute("SELECT attempts FROM leases WHERE url = ?", (url,)).fetchone()
+            if row is not None:
+                db.execute("DELETE FROM leases WHERE url = ?", (url,))
+                db.execute("INSERT INTO queue (url, attempts) VALUES (?, ?)", (url, row[0]))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def num_queued(self) -> int:
+        # URLs are leased from the lowest seq and queued at the highest: the seqs are contiguous
+        return self.db.execute("SELECT COALESCE(MAX(seq) - MIN(seq) + 1, 0) FROM queue").fetchone()[0]
+
+    def num_leased(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM leases").fetchone()[0]
+
+    def is_new(self) -> bool:
+        return self.db.execute("SELECT 1 FROM seen LIMIT 1").fetchone() is None
+
+    def close(self) -> None:
+        super().close()
+        self.db.close()
+
+
+# KEYS: seen, queue | ARGV: (hash, url) pairs
+_PUSH_SCRIPT = """
+local queued = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('SADD', KEYS[1], ARGV[i]) == 1 then
+        redis.call('RPUSH', KEYS[2], ARGV[i + 1])
+        queued = queued + 1
+    end
+end
+return queued
+"""
+
+# KEYS: queue, leases, attempts | ARGV: n, lease timeout, max attempts
+_LEASE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+for _, url in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], url)
+    if redis.call('HINCRBY', KEYS[3], url, 1) < tonumber(ARGV[3]) then
+        redis.call('RPUSH', KEYS[1], url)
+    else
+        redis.call('HDEL', KEYS[3], url)
+    end
+end
+local urls = {}
+for i = 1, tonumber(ARGV[1]) do
+    local url = redis.call('LPOP', KEYS[1])
+    if not url then
+        break
+    end
+    redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), url)
+    urls[#urls + 1] = url
+end
+return urls
+"""
+
+# KEYS: queue, leases | ARGV: url
+_RELEASE_SCRIPT = """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+"""
+
+
+class RedisSharedFrontier(SharedFrontier):
+    """SharedFrontier in Redis (5 or later): a set of URL hashes, a list, a sorted set of lease deadlines"""
+
+    def __init__(self, url: str, prefix: str = DEFAULT_PREFIX, lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, client=None):
+        super().__init__(lease_timeout, max_attempts)
+        if client is None:
+            # optional dependency, only needed when this backend is selected
+            import redis
+            client = redis.Redis.from_url(url)
+        self.redis = client
+        self.keys = {name: "{}:{}".format(prefix, name) for name in ('seen', 'queue', 'leases', 'attempts')}
+        self._push = self.redis.register_script(_PUSH_SCRIPT)
+        self._lease = self.redis.register_script(_LEASE_SCRIPT)
+        self._release = self.redis.register_script(_RELEASE_SCRIPT)
+
+    def push_many(self, urls) -> int:
+        args = []
+        for url in urls:
+            args += [seen_key(url), url]
+        if not args:
+            return 0
+        return self._push(keys=[self.keys['seen'], self.keys['queue']], args=args)
+
+    def add_seen(self, keys: list) -> list:
+        pipe = self.redis.pipeline()
+        for key in keys:
+            pipe.sadd(self.keys['seen'], seen_key(key))
+        return [added == 1 for added in pipe.execute()]
+
+    def lease(self, n: int) -> list:
+        urls = self._lease(keys=[self.keys['queue'], self.keys['leases'], self.keys['attempts']],
+                           args=[n, self.lease_timeout, self.max_attempts])
+        return [url.decode('utf-8') for url in urls]
+
+    def ack(self, urls: list) -> None:
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.keys['leases'], *urls)
+        pipe.hdel(self.keys['attempts'], *urls)
+        pipe.execute()
+
+    def release(self, url: str) -> None:
+        self._release(keys=[self.keys['queue'], self.keys['leases']], args=[url])
+
+    def num_queued(self) -> int:
+        return self.redis.llen(self.keys['queue'])
+
+    def num_leased(self) -> int:
+        return self.redis.zcard(self.keys['leases'])
+
+    def is_new(self) -> bool:
+        return self.redis.scard(self.keys['seen']) == 0
+
+    def close(self) -> None:
+        super().close()
+        self.redis.close()
+
+
+def open_shared_frontier(uri: str, lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+                         max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> SharedFrontier:
+    """RedisSharedFrontier of a redis:// or rediss:// URL (?prefix= for the keys), else SqliteSharedFrontier of a file"""
+    parts = urlsplit(uri)
+    if parts.scheme in ('redis', 'rediss', 'unix'):
+        query = dict(parse_qsl(parts.query))
+        prefix = query.pop('prefix', DEFAULT_PREFIX)  # not an option of the Redis client
+        url = urlunsplit(parts._replace(query=urlencode(query)))
+        return RedisSharedFrontier(url, prefix, lease_timeout, max_attempts)
+    if parts.scheme == 'sqlite':
+        uri = uri[len('sqlite://'):]
+    return SqliteSharedFrontier(uri, lease_timeout, max_attempts)
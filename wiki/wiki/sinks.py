@@ -0,0 +1,241 @@
+# Output sinks of the crawled articles
+#
+# Every crawler writes article records through a sink chosen from the file
+# name: "*.jsonl" (buffered JSON lines), "*.jsonl.zst" (zstd-compressed JSON
+# lines, requires zstandard) or "*.parquet" (columnar, requires pyarrow).
+#
+# Records are buffered, flush() is called by the crawlers before each
+# checkpoint so that the output is always ahead of the visited log.
+#
+# The formulas of the articles (see extractor.Formula) go to a second sink of
+# the same format, formulas/<name> next to the article output <name>, one
+# record per formula: url, title, offset of its $ in the text, display,
+# source element and LaTeX code.
+#
+# A Parquet file can't be appended to and is unreadable until it is closed,
+# so ParquetSink writes a series of complete part files of rows_per_file rows
+# each and keeps the rows of the next part in a JSONL spool file until then;
+# a new session picks up the spool.
+
+import os
+import glob
+import json
+import time
+
+from .visited import article_title
+
+FORMATS = ['jsonl', 'jsonl.zst', 'parquet']
+DEFAULT_FORMAT = 'jsonl'
+BUFFER_SIZE = 1 << 20  # bytes buffered by the JSONL sinks between two flushes
+ZSTD_LEVEL = 3
+ROWS_PER_FILE = 10000  # rows of a Parquet part file, in a single row group
+FORMULAS_DIR = "formulas"
+
+# columns of the records and their Parquet types
+ARTICLE_COLUMNS = [("url", "string"), ("title", "string"), ("text", "string"), ("num_formulas", "int32"),
+                   ("crawl_time", "timestamp")]
+FORMULA_COLUMNS = [("url", "string"), ("title", "string"), ("offset", "int32"), ("display", "bool"),
+                   ("source", "string"), ("latex", "string")]
+
+
+def article_record(url: str, text: str, num_formulas: int) -> dict:
+    """Output record of an article, url first, num_formulas is len() of its formulas (<math> and texhtml)"""
+    return {"url": url, "title": article_title(url), "text": text,
+            "num_formulas": num_formulas, "crawl_time": int(time.time())}
+
+
+def formula_records(url: str, formulas: list) -> list:
+    """Output records of the formulas of an article"""
+    title = article_title(url)
+    return [{"url": url, "title": title, "offset": f.offset, "display": f.display, "source": f.source,
+             "latex": f.latex} for f in formulas]
+
+
+def sink_format(path: str) -> str:
+    for fmt in sorted(FORMATS, key=len, reverse=True):
+        if path.endswith('.' + fmt):
+            return fmt
+    raise ValueError("Unknown output format of {} (choose from {})".format(path, ", ".join(FORMATS)))
+
+
+class Sink:
+    """Append-only writer of article records"""
+
+    def write(self, record: dict) -> None:
+        raise NotImplementedError
+
+    def write_many(self, records: list) -> None:
+        for record in records:
+            self.write(record)
+
+    def flush(self) -> None:
+        """Hand the records written so far to the OS"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonlSink(Sink):
+
+    def __init__(self, path: str, buffer_size: int = BUFFER_SIZE):
+        self.path = path
+        self.fout = open(path, 'a', encoding='utf-8', buffering=buffer_size)
+
+    def write(self, record: dict) -> None:
+        self.fout.write(json.dumps(record) + '\n')
+
+    def flush(self) -> None:
+        self.fout.flush()
+
+    def close(self) -> None:
+        self.fout.close()
+
+
+class ZstdJsonlSink(Sink):
+    """JSON lines in zstd frames, a frame ends at every flush
+
+    Each session appends new frames to the file, a zstd stream of several
+    frames decompresses as one. The size of the file at the end of the last
+    frame is kept in <path>.size: a frame cut by a crash is truncated when
+    the file is opened again, the frames appended after it stay readable.
+    """
+
+    def __init__(self, path: str, level: int = ZSTD_LEVEL, buffer_size: int = BUFFER_SIZE):
+        # optional dependency, only needed when this format is selected
+        import zstandard
+        self.zstandard = zstandard
+        self.path = path
+        self.size_file = path + '.size'
+        self.raw = open(path, 'ab')
+        try:
+            with open(self.size_file) as fin:
+                size = int(fin.read())
+            if size < self.raw.tell():
+                self.raw.truncate(size)
+                self.raw.seek(size)
+        except (FileNotFoundError, ValueError):
+            pass
+        self.writer = zstandard.ZstdCompressor(level=level).stream_writer(self.raw, write_size=buffer_size, closefd=False)
+
+    def write(self, record: dict) -> None:
+        self.writer.write((json.dumps(record) + '\n').encode('utf-8'))
+
+    def flush(self) -> None:
+        self.writer.flush(self.zstandard.FLUSH_FRAME)
+        self.raw.flush()
+        with open(self.size_file, 'w') as fout:
+            fout.write(str(self.raw.tell()))
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+        self.raw.close()
+
+
+class ParquetSink(Sink):
+    """Parquet part files <name>.<part>.parquet of rows_per_file rows, zstd-compressed columns"""
+
+    def __init__(self, path: str, columns: list = ARTICLE_COLUMNS, rows_per_file: int = ROWS_PER_FILE):
+        # optional dependency, only needed when this format is selected
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        types = {"string": pyarrow.string(), "int32": pyarrow.int32(), "bool": pyarrow.bool_(),
+                 "timestamp": pyarrow.timestamp('s', tz='UTC')}
+        self.schema = pyarrow.schema([(name, types[type_name]) for name, type_name in columns])
+        self.base = path[:-len('.parquet')] if path.endswith('.parquet') else path
+        self.rows_per_file = rows_per_file
+        self.num_parts = len(glob.glob(glob.escape(self.base) + '.[0-9][0-9][0-9][0-9][0-9].parquet'))
+        # rows of the next part, left by the previous session
+        self.spool_file = self.base + '.parquet.pending'
+        self.rows = []
+        valid_size = 0
+        if os.path.exists(self.spool_file):
+            with open(self.spool_file, 'rb') as fin:
+                for line in fin:
+                    try:
+                        self.rows.append(json.loads(line))
+                    except ValueError:
+                        break  # torn last line of a crash
+                    valid_size += len(line)
+        self.spool = open(self.spool_file, 'a', encoding='utf-8', buffering=BUFFER_SIZE)
+        self.spool.truncate(valid_size)
+
+    def write(self, record: dict) -> None:
+        row = {name: record.get(name) for name in self.schema.names}
+        self.rows.append(row)
+        self.spool.write(json.dumps(row) + '\n')
+        if len(self.rows) >= self.rows_per_file:
+            self._write_part()
+
+    def _write_part(self) -> None:
+        part_file = "{}.{:05d}.parquet".format(self.base, self.num_parts)
+        table = self.pa.Table.from_pylist(self.rows, schema=self.schema)
+        self.pq.write_table(table, part_file + '.tmp', compression='zstd', row_group_size=len(self.rows))
+        os.replace(part_file + '.tmp', part_file)
+        self.num_parts += 1
+        self.rows = []
+        self.spool.seek(0)
+        self.spool.truncate()
+
+    def flush(self) -> None:
+        self.spool.flush()
+
+    def close(self) -> None:
+        if self.rows:
+            self._write_part()
+        self.spool.close()
+        os.remove(self.spool_file)
+
+
+SINKS = {
+    'jsonl': JsonlSink,
+    'jsonl.zst': ZstdJsonlSink,
+    'parquet': ParquetSink,
+}
+
+
+def open_sink(path: str, columns: list = ARTICLE_COLUMNS) -> Sink:
+    """Sink of the format given by the extension of path"""
+    fmt = sink_format(path)
+    if fmt == 'parquet':
+        return ParquetSink(path, columns)
+    return SINKS[fmt](path)
+
+
+def open_formula_sink(article_path: str) -> Sink:
+    """Sink of the formula records of the articles written to article_path"""
+    path = os.path.join(os.path.dirname(article_path), FORMULAS_DIR, os.path.basename(article_path))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open_sink(path, FORMULA_COLUMNS)
+
+
+def read_lines(path: str):
+    """Raw JSON lines of a jsonl or jsonl.zst output file"""
+    if sink_format(path) == 'jsonl.zst':
+        import zstandard
+        with open(path, 'rb') as raw:
+            reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+            rest = b''
+            try:
+                while True:
+                    chunk = reader.read(BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    lines = (rest + chunk).split(b'\n')
+                    rest = lines.pop()
+                    for line in lines:
+                        yield line + b'\n'
+            except zstandard.ZstdError:
+                pass  # frame cut by a crash, its pages are crawled again
+        return
+    with open(path, 'rb') as fin:
+        yield from fin
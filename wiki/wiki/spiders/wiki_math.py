@@ -1,38 +1,10 @@
+from urllib.parse import urlparse
+
 import scrapy
-import bs4
-from bs4 import BeautifulSoup
-import re
 from ..items import WikiItem
-
-
-def extract_text_with_math(element: bs4.element.Tag) -> str:
-    extracted_text = ""
-    
-    if isinstance(element, str):  # Regular text
-        extracted_text += element
-
-    elif element.name == 'math':  # MathML element
-        alttext = element.get('alttext')
-        if alttext:
-            extracted_text += f"${alttext}$"
-    
-    elif element.name == "span" and "texhtml" in element.get("class", []):  # LaTeX element
-        extracted_text += f"${element.get_text()}$"
-
-    else:
-        if not bool(element.find_all('math')) and not bool(element.find_all('span', class_='texhtml')):  
-            # Regular HTML element without math
-            extracted_text += element.get_text().strip()
-        else: # recursive call to extract text from children elements
-            for content in element.contents:
-                x = extract_text_with_math(content)
-                if x:
-                    extracted_text += x
-    
-        return extracted_text
-
-
-
+from ..parsers import DEFAULT_PARSER, get_parser
+from ..metrics import DEFAULT_PROFILER, Metrics, PageProfiler
+from ..mwapi import DEFAULT_FETCH_MODE, article_url, article_content, url_article
 
 
 class WikiMathSpider(scrapy.Spider):
@@ -46,74 +18,101 @@ class WikiMathSpider(scrapy.Spider):
         'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36',
     }
     custom_settings = {"ITEM_PIPELINES" : {
-                        "wiki.pipelines.WikiMongoDBPipeline": 500 # 保存到本地mongodb
+                        "wiki.pipelines.WikiSinkPipeline": 400, # WIKI_OUTPUT file, if set
+                        "wiki.pipelines.WikiMongoDBBulkPipeline": 500 # 保存到本地mongodb
                         }
                     }
 
+    def __init__(self, start_url=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # e.g. scrapy crawl wiki_math -a start_url=http://127.0.0.1:8000/wiki/Mathematics
+        if start_url:
+            uri = urlparse(start_url)
+            self.start_url = start_url
+            self.base_url = f"{uri.scheme}://{uri.netloc}"
+            self.allowed_domains = [uri.hostname]
+        self.metrics = Metrics()  # stage times, reported by WikiMetricsExtension
+        self.fetch_mode = DEFAULT_FETCH_MODE  # WIKI_FETCH_MODE, set by from_crawler()
+        self.article_filter = None  # WikiTitleDupeFilter, if it is the DUPEFILTER_CLASS
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        settings = crawler.settings
+        spider.profiler = PageProfiler(settings.get("WIKI_PROFILE_DIR", "profiles"), settings.getfloat("WIKI_PROFILE_RATE", 0.0),
+                                       settings.get("WIKI_PROFILER", DEFAULT_PROFILER))
+        spider.fetch_mode = settings.get("WIKI_FETCH_MODE", DEFAULT_FETCH_MODE)
+        return spider
+
+    def article_request(self, article):
+        """Request of the article href '/wiki/<title>' in the fetch mode"""
+        return scrapy.Request(article_url(self.base_url, article, self.fetch_mode), headers=self.default_headers,
+                              callback=self.parse, errback=self.parse_error, meta={"wiki_article": article})
+
+    def new_articles(self, links):
+        """The links to articles the dupefilter has not seen, before a Request is built for them"""
+        if self.article_filter is None:
+            return links
+        new_links = [href for href in links if not self.article_filter.article_seen(href)]
+        self.crawler.stats.inc_value("dupefilter/prefiltered", len(links) - len(new_links), spider=self)
+        return new_links
+
     def start_requests(self):
         
-        yield scrapy.Request(self.start_url, headers=self.default_headers, callback=self.parse, errback=self.parse_error)
+        yield self.article_request(self.start_url[len(self.base_url):])
 
 
     def parse(self, response):
         try:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            content = soup.find('div', {'id':'mw-content-text'})
-            # add new related articles to queue
-            # check if are actual articles URL
-
-
-            for a in content.find_all('a'):
-                href = a.get('href')
-                if not href:
-                    continue
-                
-                if href[0:6] != '/wiki/':  # allow only article pages
-                    continue
-                elif ':' in href:  # ignore special articles e.g. 'Special:'
-                    continue
-                elif href[-4:] in ".png .jpg .jpeg .svg":  # ignore image files inside articles
-                    continue
-                yield scrapy.Request(self.base_url+href, headers=self.default_headers, callback=self.parse, errback=self.parse_error)
-
-            # remove all citation elements and related content
-            for _eid in ["See_also", "References", "External_links", "Works_cited"]:
-                # Find the element with id
-                _element = soup.find(id=_eid)
-                # Remove all the content after the references element
-                if _element is not None:
-                    for x in _element.find_all_next():
-                        x.extract()
-                    _element.extract()
-            
-            # parenthesis_regex = re.compile('\(.+?\)')  # to remove parenthesis content
-            citations_regex = re.compile('\[.+?\]')  # to remove citations, e.g. [1]
-
-            # get plain text from each <p>
-            elem_list = content.find_all(['p', 'math'])
-            
-            visited_math_elements = set()
-            out_text = ""
-            for elem in elem_list:
-                if elem.name == 'p':
-                    for _math_elem in elem.find_all('math'):
-                        visited_math_elements.add(_math_elem)
-
-                    # text = elem.get_text().strip()
-                    text = extract_text_with_math(elem)
-                    # text = parenthesis_regex.sub('', text)
-                    text = citations_regex.sub('', text)
-                    if text:
-                        out_text += text + '\n' # extra line between paragraphs
-                
-                elif elem.name == 'math' and elem not in visited_math_elements: # latex math equation
-                    latex_code = elem.get('alttext').strip()
-                    if latex_code:
-                        out_text += f"${latex_code}$" + '\n'
-            
-            _key = response.url.split('/wiki/')[-1]
+            cached_links = response.meta.get("wiki_cached_links")
+            if cached_links is not None:
+                # not modified since cached (see WikiHttpCacheMiddleware), its text is in a previous output
+                for href in self.new_articles(cached_links):
+                    yield self.article_request(href)
+                return
+
+            if "download_latency" in response.meta:
+                self.metrics.observe('fetch', response.meta["download_latency"])
+            # the stages are run before yielding, so that they are timed (and profiled) without Scrapy's own work
+            with self.profiler.profile(response.url):
+                # the article the request was redirected to, if it was
+                article = url_article(response.url) or response.meta["wiki_article"]
+                with self.metrics.time('parse'):
+                    _, html = article_content(response.status, response.text, article, self.fetch_mode)
+                    page = get_parser(self.settings.get("WIKI_PARSER", DEFAULT_PARSER)).parse(html)
+                # add new related articles to queue
+                # check if are actual articles URL
+
+                with self.metrics.time('links'):
+                    links = []
+                    for href in page.links():
+                        if not href:
+                            continue
+
+                        if href[0:6] != '/wiki/':  # allow only article pages
+                            continue
+                        elif ':' in href:  # ignore special articles e.g. 'Special:'
+                            continue
+                        elif href[-4:] in ".png .jpg .jpeg .svg":  # ignore image files inside articles
+                            continue
+                        links.append(href)
+
+                # get plain text without the citation sections
+                with self.metrics.time('extract'):
+                    out_text, formulas = page.text_with_formulas()
+
+            for href in self.new_articles(links):
+                yield self.article_request(href)
+
+            if response.meta.get("wiki_store_links"):
+                self.http_cache.set_links(response.url, links)
+
+            # the redirected URL of a full page, the article of an API response
+            url = response.url if self.fetch_mode == 'page' else self.base_url + article
+            _key = url.split('/wiki/')[-1]
             print(_key)
-            yield WikiItem({"key":_key, "url": response.url, "text": out_text})
+            yield WikiItem({"key":_key, "url": url, "text": out_text,
+                            "formulas": [f._asdict() for f in formulas]})
 
         except Exception as e:
             self.logger.error(repr(e))
@@ -0,0 +1,234 @@
+# Compact store of the visited articles shared by the crawlers
+#
+# The append-only text log (session_visited_urls.txt) stays the source of
+# truth. Visited URLs are normalized to article titles and kept as 64-bit
+# hashes: a sorted snapshot file, memory-mapped so that it loads instantly
+# and costs 8 bytes per article, plus a set of the hashes added since. A new
+# session maps the snapshot and only replays the end of the log written
+# after it. Two titles share a hash with a probability of about 1e-6 at 6M
+# articles.
+
+import os
+import mmap
+import heapq
+import struct
+import hashlib
+from array import array
+from bisect import bisect_left
+from urllib.parse import urlsplit, unquote
+
+SNAPSHOT_MAGIC = b'WIKIVIS1'
+SNAPSHOT_HEADER = struct.Struct('<8sQQ')  # magic, log offset covered, number of hashes
+SNAPSHOT_EVERY = 1000000  # new articles kept in memory before the snapshot is rewritten
+_WRITE_CHUNK = 65536  # hashes per write when merging a snapshot
+MERGE_MIN = 65536  # new hashes kept in a set before a HashSet merges them into its array
+
+
+def article_title(url: str) -> str:
+    """Canonical title of an article URL or href, e.g. '/wiki/Euler%27s_identity' -> "Euler's_identity" """
+    path = urlsplit(url).path
+    if path.startswith('/wiki/'):
+        path = path[len('/wiki/'):]
+    title = unquote(path).replace(' ', '_').strip('_')
+    # the first letter of a title is case-insensitive on Wikipedia
+    return title[:1].upper() + title[1:]
+
+
+def title_hash(title: str) -> int:
+    """Unsigned 64-bit hash of a title"""
+    return int.from_bytes(hashlib.blake2b(title.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class HashSet:
+    """In-memory set of 64-bit hashes, 8 to 16 bytes per hash instead of 60+ for a set of ints
+
+    The hashes are a sorted array plus a set of the ones added since, merged
+    into the array once it has an eighth of its size (amortized O(1) adds).
+    """
+
+    def __init__(self, hashes=()):
+        self.hashes = array('Q', sorted(hashes))
+        self.new_hashes = set()
+
+    def __contains__(self, h: int) -> bool:
+        if h in self.new_hashes:
+            return True
+        i = bisect_left(self.hashes, h)
+        return i < len(self.hashes) and self.hashes[i] == h
+
+    def __len__(self) -> int:
+        return len(self.hashes) + len(self.new_hashes)
+
+    def add(self, h: int) -> bool:
+        """Add h, return False if it was there"""
+        if h in self:
+            return False
+        self.new_hashes.add(h)
+        if len(self.new_hashes) >= max(MERGE_MIN, len(self.hashes) >> 3):
+            self.merge()
+        return True
+
+    def merge(self) -> None:
+        if self.new_hashes:
+            self.hashes = array('Q', heapq.merge(self.hashes, sorted(self.new_hashes)))
+            self.new_hashes = set()
+
+    def save(self, path: str) -> None:
+        """Write the sorted hashes to path atomically, see load()"""
+        self.merge()
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as fout:
+            self.hashes.tofile(fout)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """HashSet of a file written by save()"""
+        s = cls()
+        with open(path, 'rb') as fin:
+            s.hashes.frombytes(fin.read())
+        return s
+
+
+class VisitedStore:
+    """Set-like store of visited URLs backed by log_file and a memory-mapped snapshot"""
+
+    def __init__(self, log_file: str, snapshot_every: int = SNAPSHOT_EVERY, readonly: bool = False):
+        self.log_file = log_file
+        self.snapshot_file = os.path.splitext(log_file)[0] + '.idx'
+        self.snapshot_every = snapshot_every
+        self.readonly = readonly
+        self.new_hashes = set()  # hashes missing from the snapshot
+        self._mm = None
+        self._view = None
+        self.hashes = ()  # sorted hashes of the snapshot
+        log_offset = self._map_snapshot()
+        self._replay_log(log_offset)
+        self.fout = None
+        self.pending = []  # log lines written by sync(), after the output sinks are flushed
+        if not readonly:
+            self.fout = open(log_file, 'a')
+            if len(self.new_hashes) >= snapshot_every:
+                self.snapshot()
+
+    def _map_snapshot(self) -> int:
+        """Map the snapshot file, return the log offset it covers"""
+        try:
+            log_size = os.path.getsize(self.log_file)
+            with open(self.snapshot_file, 'rb') as fin:
+                header = fin.read(SNAPSHOT_HEADER.size)
+                if len(header) < SNAPSHOT_HEADER.size:
+                    return 0
+                magic, log_offset, count = SNAPSHOT_HEADER.unpack(header)
+                if magic != SNAPSHOT_MAGIC or log_offset > log_size:
+                    return 0  # not ours, or the log was replaced
+                if count > 0:
+                    self._mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._view = memoryview(self._mm)[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + 8 * count]
+                    self.hashes = self._view.cast('Q')
+                return log_offset
+        except FileNotFoundError:
+            return 0
+
+    def _replay_log(self, offset: int) -> None:
+        try:
+            with open(self.log_file, 'rb') as fin:
+                fin.seek(offset)
+                for line in fin:
+                    url = line.decode('utf-8').strip()
+                    if url:
+                        self._add_hash(title_hash(article_title(url)))
+        except FileNotFoundError:
+            pass
+
+    def _in_snapshot(self, h: int) -> bool:
+        i = bisect_left(self.hashes, h)
+        return i < len(self.hashes) and self.hashes[i] == h
+
+    def _add_hash(self, h: int) -> bool:
+        if h in self.new_hashes or self._in_snapshot(h):
+            return False
+        self.new_hashes.add(h)
+        return True
+
+    def __contains__(self, url: str) -> bool:
+        h = title_hash(article_title(url))
+        return h in self.new_hashes or self._in_snapshot(h)
+
+    def __len__(self) -> int:
+        return len(self.hashes) + len(self.new_hashes)
+
+    def add(self, url: str) -> bool:
+        """Record url as visited, return False if it already was"""
+        if not self._add_hash(title_hash(article_title(url))):
+            return False
+        if self.fout is not None:
+            self.pending.append(url + '\n')  # logged by sync(), after the outputs of the page
+        return True
+
+    def update(self, urls) -> list:
+        """Record urls as visited, return the ones that were not"""
+        return [url for url in urls if self.add(url)]
+
+    def _write_pending(self) -> None:
+        if self.pending:
+            self.fout.write(''.join(self.pending))
+            self.pending = []
+
+    def sync(self) -> None:
+        """Write the log to disk, and the snapshot every snapshot_every new articles
+
+        Called by checkpoint() once the output sinks are flushed: neither
+        the log nor the snapshot gets a URL whose record is not durable.
+        """
+        if self.fout is not None:
+            self._write_pending()
+            self.fout.flush()
+            os.fsync(self.fout.fileno())
+            if len(self.new_hashes) >= self.snapshot_every:
+                self.snapshot()
+
+    def snapshot(self) -> None:
+        """Merge the new hashes into the snapshot file, after the pending log lines (see sync())"""
+        if self.readonly:
+            return
+        self._write_pending()
+        self.fout.flush()
+        log_offset = self.fout.tell()
+        tmp_file = self.snapshot_file + '.tmp'
+        count = 0
+        with open(tmp_file, 'wb') as fout:
+            fout.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, log_offset, 0))
+            chunk = array('Q')
+            for h in heapq.merge(self.hashes, sorted(self.new_hashes)):
+                chunk.append(h)
+                if len(chunk) == _WRITE_CHUNK:
+                    chunk.tofile(fout)
+                    count += len(chunk)
+                    chunk = array('Q')
+            chunk.tofile(fout)
+            count += len(chunk)
+            fout.seek(0)
+            fout.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, log_offset, count))
+        self._unmap()
+        os.replace(tmp_file, self.snapshot_file)
+        self.new_hashes = set()
+        self._map_snapshot()
+
+    def _unmap(self) -> None:
+        if self._mm is not None:
+            self.hashes.release()
+            self._view.release()
+            self._mm.close()
+            self._mm = None
+        self.hashes = ()
+
+    def close(self) -> None:
+        """Write the snapshot and close the log, the store stays readable"""
+        if self.fout is not None:
+            if self.new_hashes:
+                self.snapshot()
+            self.fout.close()
+            self.fout = None
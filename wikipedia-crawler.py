@@ -5,188 +5,197 @@ import os
 import sys
 import time
 import argparse
-import re
-import json
+from collections import deque
 from urllib.parse import urlparse
 
 import requests
-from bs4 import BeautifulSoup
-import bs4
+
+from wiki.wiki.parsers import PARSERS, DEFAULT_PARSER, get_parser
+from wiki.wiki.frontier import Frontier, checkpoint
+from wiki.wiki.visited import VisitedStore
+from wiki.wiki.httpcache import ResponseCache, fetch
+from wiki.wiki.sinks import FORMATS, open_sink, open_formula_sink, article_record, formula_records
+from wiki.wiki.linkgraph import PRIORITIES, DEFAULT_PRIORITY, LinkGraph, Ranker
+from wiki.wiki.metrics import PROFILERS, DEFAULT_PROFILER, Metrics, StatsReporter, PageProfiler
+from wiki.wiki.ratelimit import MAX_ATTEMPTS, DONE, RETRY, FetchScheduler
+from wiki.wiki.mwapi import FETCH_MODES, DEFAULT_FETCH_MODE, article_url, article_content
 
 DEFAULT_OUTPUT = 'wiki_output.jsonl'
 DEFAULT_INTERVAL = 5.0  # interval between requests (seconds)
 DEFAULT_ARTICLES_LIMIT = 1  # total number articles to be extrated
+FRONTIER_FILE = 'frontier_wikipedia_crawler.sqlite'  # pending URLs, kept between sessions
+LINKS_FILE = 'links_wikipedia_crawler'  # link graph, .sqlite and .edges
+PROFILE_DIR = 'profiles_wikipedia_crawler'  # profiles of the pages sampled with --profile_rate
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/52.0.2743.116 Safari/537.36'
 
-visited_urls = set()  # all urls already visited, to not visit twice
-pending_urls = []  # queue
-
-
-def load_urls(session_file):
-    """Resume previous session if any, load visited URLs"""
-
-    try:
-        with open(session_file) as fin:
-            for line in fin:
-                visited_urls.add(line.strip())
-    except FileNotFoundError:
-        pass
+visited_urls = None  # all urls already visited, to not visit twice, a VisitedStore opened by main()
+pending_urls = None  # queue, a Frontier opened by main()
+http_cache = None  # ResponseCache opened by main() with --cache
+link_graph = None  # LinkGraph opened by main() with --links or a --priority
+replay = False  # serve pages from http_cache only
+fetch_mode = DEFAULT_FETCH_MODE  # full page, or content only from the REST or Action API
+fetch_scheduler = None  # Retry-After pauses and delayed retries, a FetchScheduler opened by main()
+metrics = Metrics()  # time of the stages of scrap()
 
 
-def extract_text_with_math(element: bs4.element.Tag) -> str:
-    extracted_text = ""
-    
-    if isinstance(element, str):  # Regular text
-        extracted_text += element
-
-    elif element.name == 'math':  # MathML element
-        alttext = element.get('alttext')
-        if alttext:
-            extracted_text += f"${alttext}$"
-    
-    elif element.name == "span" and "texhtml" in element.get("class", []):  # LaTeX element
-        extracted_text += f"${element.get_text()}$"
-
-    else:
-        if not bool(element.find_all('math')) and not bool(element.find_all('span', class_='texhtml')):  
-            # Regular HTML element without math
-            extracted_text += element.get_text().strip()
-        else: # recursive call to extract text from children elements
-            for content in element.contents:
-                extracted_text += extract_text_with_math(content)
-    
-    return extracted_text
-
-
-
-def scrap(base_url, article, output_file, session_file):
-    """Represents one request per article"""
+def scrap(base_url, article, sink, formula_sink, parser):
+    """Represents one request per article, returns DONE, RETRY (later, by fetch_scheduler) or DROP"""
 
     full_url = base_url + article
+    fetch_url = article_url(base_url, article, fetch_mode)
+    with metrics.time('wait'):
+        time.sleep(fetch_scheduler.pause_time(full_url))  # the server asked to slow down
+    token = fetch_scheduler.start(full_url)
     try:
-        r = requests.get(full_url, headers={'User-Agent': USER_AGENT})
+        with metrics.time('fetch'):
+            r = fetch(requests, fetch_url, http_cache, replay, headers={'User-Agent': USER_AGENT})
     except requests.exceptions.ConnectionError:
-        print("Check your Internet connection")
-        # input("Press [ENTER] to continue to the next request.")
-        print("Retrying in 5 seconds...")
-        time.sleep(DEFAULT_INTERVAL)
-        try:
-            r = requests.get(full_url, headers={'User-Agent': USER_AGENT})
-        except requests.exceptions.ConnectionError:
-            return
-    if r.status_code not in (200, 404):
-        print("Failed to request page (code {})".format(r.status_code))
+        metrics.count('failed')
+        print("Check your Internet connection, retrying later")
+        return fetch_scheduler.finish(full_url, token)
+    if r is None:
+        fetch_scheduler.cancel(full_url)
+        print("Not in cache")
+        return DONE
+    outcome = fetch_scheduler.finish(full_url, token, r.status, r.retry_after)
+    if outcome != DONE:
+        metrics.count('failed')
+        print("Failed to request page (code {}), {}".format(r.status, "retrying later" if outcome == RETRY else "dropped"))
         # input("Press [ENTER] to continue to the next request.")
-        return
-
-    soup = BeautifulSoup(r.text, 'html.parser')
-    content = soup.find('div', {'id':'mw-content-text'})
-
-    with open(session_file, 'a') as fout:
-        fout.write(full_url + '\n')  # log URL to session file
-
-    # add new related articles to queue
-    # check if are actual articles URL
-    for a in content.find_all('a'):
-        href = a.get('href')
-        if not href:
-            continue
-        if href[0:6] != '/wiki/':  # allow only article pages
-            continue
-        elif ':' in href:  # ignore special articles e.g. 'Special:'
-            continue
-        elif href[-4:] in ".png .jpg .jpeg .svg":  # ignore image files inside articles
-            continue
-        elif base_url + href in visited_urls:  # already visited
-            continue
-        if href in pending_urls:  # already added to queue
-            continue
-        pending_urls.append(href)
+        return outcome
+
+    if r.status == 304:
+        # not modified since cached, its links are known and its text is in a previous output
+        page = None
+        links = r.links
+    else:
+        with metrics.time('parse'):
+            _, html = article_content(r.status, r.html, article, fetch_mode)
+            page = parser.parse(html)
+        with metrics.time('links'):
+            # check if are actual articles URL
+            links = []
+            for href in page.links():
+                if not href:
+                    continue
+                if href[0:6] != '/wiki/':  # allow only article pages
+                    continue
+                elif ':' in href:  # ignore special articles e.g. 'Special:'
+                    continue
+                elif href[-4:] in ".png .jpg .jpeg .svg":  # ignore image files inside articles
+                    continue
+                links.append(href)
+        if http_cache is not None and r.status == 200 and not replay:
+            http_cache.set_links(fetch_url, links)
+
+    with metrics.time('frontier'):
+        # add new related articles to queue
+        for href in links:
+            if base_url + href in visited_urls:  # already visited
+                continue
+            pending_urls.push(href)  # ignored if already added to queue
 
     print("Number of pending URLs: {}".format(len(pending_urls)))
 
     # skip if already added text from this article, as continuing session
-    if full_url in visited_urls:
-        return
-    visited_urls.add(full_url)
-
-    # remove all citation elements and related content
-    for _eid in ["See_also", "References", "External_links", "Works_cited"]:
-        # Find the element with id
-        _element = soup.find(id=_eid)
-        # Remove all the content after the references element
-        if _element is not None:
-            for x in _element.find_all_next():
-                x.extract()
-            _element.extract()
-    
-    # parenthesis_regex = re.compile('\(.+?\)')  # to remove parenthesis content
-    citations_regex = re.compile('\[.+?\]')  # to remove citations, e.g. [1]
-
-    # get plain text from each <p>
-    elem_list = content.find_all(['p', 'math'])
-    
-    visited_math_elements = set()
-    out_text = ""
-    for elem in elem_list:
-        if elem.name == 'p':
-            for _math_elem in elem.find_all('math'):
-                visited_math_elements.add(_math_elem)
-
-            # text = elem.get_text().strip()
-            text = extract_text_with_math(elem)
-            # text = parenthesis_regex.sub('', text)
-            text = citations_regex.sub('', text)
-            if text:
-                out_text += text + '\n' # extra line between paragraphs
-        
-        elif elem.name == 'math' and elem not in visited_math_elements: # latex math equation
-            latex_code = elem.get('alttext').strip()
-            if latex_code:
-                out_text += f"${latex_code}$" + '\n'
-
-    json_data = {"url": full_url, "text": out_text}
-    append_to_jsonl(output_file, json_data)
-
-
-# Write data to JSONL file
-def append_to_jsonl(file_path, data):
-    with open(file_path, 'a', encoding='utf-8') as f:
-        json.dump(data, f)
-        f.write('\n')  # Add newline to separate JSON objects
-
-
-def main(initial_url, articles_limit, interval, output_file):
+    if not visited_urls.add(full_url):  # log URL to session file
+        return DONE
+    if page is None:
+        metrics.count('not_modified')
+        print("Not modified")
+        return DONE
+
+    # get plain text without the citation sections
+    with metrics.time('extract'):
+        out_text, formulas = page.text_with_formulas()
+
+    with metrics.time('write'):
+        if link_graph is not None:
+            link_graph.add(article, links)
+        sink.write(article_record(full_url, out_text, len(formulas)))
+        formula_sink.write_many(formula_records(full_url, formulas))
+    metrics.count('pages')
+    return DONE
+
+
+def main(initial_url, articles_limit, interval, output_file, parser_name=DEFAULT_PARSER, cache_file=None, replay_only=False,
+         record_links=False, priority=DEFAULT_PRIORITY, stats_file=None, metrics_port=None, profile_rate=0.0,
+         profiler_name=DEFAULT_PROFILER, max_attempts=MAX_ATTEMPTS, fetch_mode_name=DEFAULT_FETCH_MODE):
     """ Main loop, single thread """
+    global pending_urls, visited_urls, http_cache, replay, link_graph, fetch_scheduler, fetch_mode
+    parser = get_parser(parser_name)
+    fetch_mode = fetch_mode_name
+    if cache_file:
+        http_cache = ResponseCache(cache_file)
+        replay = replay_only
+    elif replay_only:
+        sys.exit("--replay needs a --cache file")
+    if replay:
+        interval = 0  # no request is sent
     minutes_estimate = interval * articles_limit / 60
     print("This session will take {:.1f} minute(s) to download {} article(s):".format(minutes_estimate, articles_limit))
     print("\t(Press CTRL+C to pause)\n")
     session_file = "session_wikipedia_crawler.txt"
-    load_urls(session_file)  # load previous session (if any)
+    visited_urls = VisitedStore(session_file)  # load previous session (if any)
+    pending_urls = Frontier(FRONTIER_FILE, ranked=priority != 'bfs')  # pending URLs of the previous session (if any)
+    sink = open_sink(output_file)  # format from the extension: .jsonl, .jsonl.zst or .parquet
+    formula_sink = open_formula_sink(output_file)  # ./formulas/<output file>
+    outputs = [sink, formula_sink]  # flushed at each checkpoint
+    ranker = None
+    if record_links or priority != 'bfs':
+        link_graph = LinkGraph(LINKS_FILE)
+        outputs.append(link_graph)
+        if priority != 'bfs':
+            ranker = Ranker(pending_urls, link_graph, priority)
+    reporter = StatsReporter(stats_file, metrics_port)  # --stats file and/or Prometheus endpoint
+    profiler = PageProfiler(PROFILE_DIR, profile_rate, profiler_name)
+    fetch_scheduler = FetchScheduler(window=1, max_window=1, max_attempts=max_attempts)  # one request at a time
+    ready_urls = deque()  # failed URLs whose retry time has come, before the pending ones
     base_url = '{uri.scheme}://{uri.netloc}'.format(uri=urlparse(initial_url))
     initial_url = initial_url[len(base_url):]
-    pending_urls.append(initial_url)
+    if len(pending_urls) == 0:
+        pending_urls.push(initial_url)
 
     
     counter = 0
-    while len(pending_urls) > 0:
+    while len(pending_urls) > 0 or ready_urls or fetch_scheduler.num_retries() > 0:
         try:
+            ready_urls.extend(url[len(base_url):] for url in fetch_scheduler.ready())
+            if not ready_urls and len(pending_urls) == 0:
+                time.sleep(fetch_scheduler.wait_time())  # only delayed retries left
+                continue
             counter += 1
             if counter > articles_limit:
                 break
-            try:
-                next_url = pending_urls.pop(0)
-            except IndexError:
+            next_url = ready_urls.popleft() if ready_urls else pending_urls.pop()
+            if next_url is None:
                 break
 
             time.sleep(interval)
             article_format = next_url.replace('/wiki/', '')[:35]
             print("{:<7} {}".format(counter, article_format))
-            scrap(base_url, next_url, output_file, session_file)
+            with profiler.profile(next_url):
+                outcome = scrap(base_url, next_url, sink, formula_sink, parser)
+            if outcome != RETRY:  # a retried URL stays in flight in the frontier until it is done or dropped
+                pending_urls.done(next_url)
+            if ranker is not None:
+                ranker.maybe_rank()
+            with metrics.time('checkpoint'):
+                checkpoint(pending_urls, visited_urls, *outputs)
+            reporter.maybe_report(metrics.snapshot)
         except KeyboardInterrupt:
             input("\n> PAUSED. Press [ENTER] to continue...\n")
             counter -= 1
 
+    sink.close()
+    formula_sink.close()
+    if link_graph is not None:
+        link_graph.close()
+    pending_urls.close()
+    visited_urls.close()
+    reporter.close(metrics.snapshot())
+    if http_cache is not None:
+        http_cache.close()
     print("Finished!")
     sys.exit(0)
 
@@ -196,6 +205,18 @@ if __name__ == '__main__':
     parser.add_argument("--initial_url", nargs='?', help="Initial Wikipedia article, e.g. https://en.wikipedia.org/wiki/Mathematics", default="https://en.wikipedia.org/wiki/Mathematics")
     parser.add_argument("-a", "--articles", nargs='?', default=DEFAULT_ARTICLES_LIMIT, type=int, help="Total number of articles")
     parser.add_argument("-i", "--interval", nargs='?', default=DEFAULT_INTERVAL, type=float, help="Interval between requests")
-    parser.add_argument("-o", "--output", nargs='?', default=DEFAULT_OUTPUT, help="File output")
+    parser.add_argument("-o", "--output", nargs='?', default=DEFAULT_OUTPUT, help="File output ({})".format(", ".join("*." + f for f in FORMATS)))
+    parser.add_argument("-p", "--parser", nargs='?', default=DEFAULT_PARSER, choices=list(PARSERS), help="HTML parser backend")
+    parser.add_argument("--cache", nargs='?', default=None, help="HTTP response cache file, pages are then re-crawled with conditional requests")
+    parser.add_argument("--replay", action='store_true', help="Serve pages from the cache only, without network")
+    parser.add_argument("--links", action='store_true', help="Record the link graph ({}.sqlite and .edges)".format(LINKS_FILE))
+    parser.add_argument("--priority", nargs='?', default=DEFAULT_PRIORITY, choices=PRIORITIES, help="Order of the pending URLs, by link graph in-degree or PageRank instead of breadth-first (records the link graph)")
+    parser.add_argument("--stats", nargs='?', default=None, help="JSON file of the stage timings, rewritten every few seconds")
+    parser.add_argument("--metrics_port", nargs='?', default=None, type=int, help="Serve the stage timings in the Prometheus format on this local port")
+    parser.add_argument("--profile_rate", nargs='?', default=0.0, type=float, help="Share of the pages profiled, to {}/".format(PROFILE_DIR))
+    parser.add_argument("--profiler", nargs='?', default=DEFAULT_PROFILER, choices=PROFILERS, help="Profiler of the sampled pages")
+    parser.add_argument("--max_attempts", nargs='?', default=MAX_ATTEMPTS, type=int, help="Failed requests of a page before it is dropped, 429/503 responses not counted")
+    parser.add_argument("--fetch", nargs='?', default=DEFAULT_FETCH_MODE, choices=FETCH_MODES, help="Fetch the full page, or the article content only from the REST API (Parsoid HTML) or action=parse")
     args = parser.parse_args()
-    main(args.initial_url, args.articles, args.interval, args.output)
\ No newline at end of file
+    main(args.initial_url, args.articles, args.interval, args.output, args.parser, args.cache, args.replay, args.links,
+         args.priority, args.stats, args.metrics_port, args.profile_rate, args.profiler, args.max_attempts, args.fetch)
\ No newline at end of file